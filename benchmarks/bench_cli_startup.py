@@ -0,0 +1,93 @@
+"""Benchmark of the diffa CLI startup latency.
+
+Times (in fresh processes) `diffa --help`, `diffa data-diff --help` and, given a pair of
+tables, a no-op run: a data-diff of a pair with nothing new to catch up, so the time is
+mostly spent starting up, looking up the check state and running the count queries of
+the days to re-check (if any). Also lists the slowest imports of `diffa.cli`.
+
+Usage: python benchmarks/bench_cli_startup.py [--runs 10] \
+    [--source-table src.events --target-table tgt.events]
+(the no-op run uses the DIFFA__*_URI environment variables, and is run once beforehand
+to bring the pair up to date)
+"""
+
+import argparse
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+IMPORT_TIME_LIMIT = 10  # Slowest imports listed
+
+
+def get_diffa_command() -> List[str]:
+    diffa = shutil.which("diffa")
+    return [diffa] if diffa else [sys.executable, "-m", "diffa.cli"]
+
+
+def time_command(command: List[str], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=False)
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def report(name: str, timings: List[float]):
+    print(
+        f"{name:<24} median {statistics.median(timings) * 1000:8.1f} ms"
+        f"   min {min(timings) * 1000:8.1f} ms   max {max(timings) * 1000:8.1f} ms"
+    )
+
+
+def report_slowest_imports():
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import diffa.cli"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if match := re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line):
+            _, cumulative_us, _, module = match.groups()
+            imports.append((int(cumulative_us), module))
+    print("\nSlowest imports of diffa.cli (cumulative):")
+    for cumulative_us, module in sorted(imports, reverse=True)[:IMPORT_TIME_LIMIT]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--source-table", help="schema.table of the no-op run source")
+    parser.add_argument("--target-table", help="schema.table of the no-op run target")
+    args = parser.parse_args()
+
+    diffa = get_diffa_command()
+    report("diffa --help", time_command(diffa + ["--help"], args.runs))
+    report("diffa data-diff --help", time_command(diffa + ["data-diff", "--help"], args.runs))
+
+    if args.source_table and args.target_table:
+        source_schema, source_table = args.source_table.split(".")
+        target_schema, target_table = args.target_table.split(".")
+        no_op_run = diffa + [
+            "data-diff",
+            "--source-schema", source_schema,
+            "--source-table", source_table,
+            "--target-schema", target_schema,
+            "--target-table", target_table,
+        ]
+        # Bring the pair up to date, the next runs have nothing new to check
+        subprocess.run(no_op_run, capture_output=True, check=False)
+        report("no-op data-diff", time_command(no_op_run, args.runs))
+
+    report_slowest_imports()
+
+
+if __name__ == "__main__":
+    main()
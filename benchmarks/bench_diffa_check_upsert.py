@@ -0,0 +1,106 @@
+"""Benchmark of the diffa checks upsert (rows/s) against the Diffa DB.
+
+Compares the legacy single `INSERT ... VALUES` statement with the chunked COPY upsert.
+Rows are written under a dedicated benchmark pair, deleted at the end.
+
+Usage: DIFFA__DIFFA_DB_URI=postgresql://... python benchmarks/bench_diffa_check_upsert.py \
+    [--rows 1000 100000 1000000] [--chunk-size 50000] [--legacy-max-rows 1000000]
+"""
+
+import argparse
+import time
+import uuid
+from datetime import date, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.functions import now
+
+from diffa.config import ConfigManager, DEFAULT_UPSERT_CHUNK_SIZE
+from diffa.db.data_models import DiffaCheck
+from diffa.db.diffa_check import DiffaCheckDatabase
+
+BENCH_TABLE = "diffa_bench_upsert"
+
+
+def make_diffa_checks(n_rows: int):
+    return [
+        {
+            "id": uuid.uuid4(),
+            "source_database": "bench",
+            "source_schema": "bench",
+            "source_table": BENCH_TABLE,
+            "target_database": "bench",
+            "target_schema": "bench",
+            "target_table": BENCH_TABLE,
+            "check_date": date(2000, 1, 1) + timedelta(days=i % 10000),
+            "source_count": i,
+            "target_count": i,
+            "is_valid": True,
+            "diff_count": 0,
+        }
+        for i in range(n_rows)
+    ]
+
+
+def legacy_upsert(diffa_db: DiffaCheckDatabase, diffa_checks):
+    with diffa_db.conn.db_session() as session:
+        with session.begin():
+            stmt = insert(DiffaCheck).values(diffa_checks)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DiffaCheck.id],
+                set_={
+                    "source_count": stmt.excluded.source_count,
+                    "target_count": stmt.excluded.target_count,
+                    "is_valid": stmt.excluded.is_valid,
+                    "diff_count": stmt.excluded.diff_count,
+                    "check_date": stmt.excluded.check_date,
+                    "updated_at": now(),
+                },
+            )
+            session.execute(stmt)
+
+
+def copy_upsert(diffa_db: DiffaCheckDatabase, diffa_checks):
+    diffa_db.upsert_diffa_checks(iter(diffa_checks))
+
+
+def cleanup(diffa_db: DiffaCheckDatabase):
+    with diffa_db.conn.db_session() as session:
+        with session.begin():
+            session.execute(delete(DiffaCheck).where(DiffaCheck.source_table == BENCH_TABLE))
+
+
+def bench(name: str, upsert, diffa_db: DiffaCheckDatabase, diffa_checks):
+    started_at = time.perf_counter()
+    upsert(diffa_db, diffa_checks)
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"{name:<8} {len(diffa_checks):>9} rows  {elapsed:8.3f}s  "
+        f"{len(diffa_checks) / elapsed:>12,.0f} rows/s"
+    )
+    cleanup(diffa_db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_UPSERT_CHUNK_SIZE)
+    # The legacy statement takes minutes and gigabytes of client memory at 1M rows
+    parser.add_argument("--legacy-max-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    config_manager = ConfigManager().configure(
+        source_table=BENCH_TABLE, target_table=BENCH_TABLE, upsert_chunk_size=args.chunk_size
+    )
+    diffa_db = DiffaCheckDatabase(config_manager.diffa_check)
+    cleanup(diffa_db)
+    for n_rows in args.rows:
+        diffa_checks = make_diffa_checks(n_rows)
+        if n_rows <= args.legacy_max_rows:
+            bench("before", legacy_upsert, diffa_db, diffa_checks)
+        bench("after", copy_upsert, diffa_db, diffa_checks)
+
+
+if __name__ == "__main__":
+    main()
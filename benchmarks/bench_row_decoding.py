@@ -0,0 +1,86 @@
+"""Micro-benchmark of the count row decoding (rows/s).
+
+Compares the legacy decoding (a dataclass type built per row from a dict row, then
+`dataclasses.fields()` walked again for every key) with the cached row type fed from
+plain tuples.
+
+Usage: python benchmarks/bench_row_decoding.py [--rows 200000]
+"""
+
+import argparse
+import time
+from dataclasses import dataclass, fields, make_dataclass
+from datetime import date, timedelta
+from itertools import starmap
+
+from diffa.db.data_models import CountCheck
+
+DIMENSION_COLS = ["status", "country"]
+
+
+@dataclass(frozen=True)
+class LegacyCountCheck:
+    cnt: int
+    check_date: date
+
+    @classmethod
+    def create_with_dimensions(cls, dimension_cols):
+        return make_dataclass(
+            cls.__name__,
+            [(col, str) for col in sorted(dimension_cols)],
+            bases=(cls,),
+            frozen=True,
+        )
+
+    @classmethod
+    def get_dimension_fields(cls):
+        base_fields = {"check_date", "cnt"}
+        return [(f.name, f.type) for f in fields(cls) if f.name not in base_fields]
+
+    def to_flatten_dimension_format(self):
+        values = {
+            f[0]: getattr(self, f[0])
+            for f in self.get_dimension_fields() + [("check_date", date)]
+        }
+        return {tuple(values.items()): self}
+
+
+def make_rows(n_rows: int):
+    return [
+        (i, date(2024, 1, 1) + timedelta(days=i % 365), f"s{i % 7}", f"c{i % 13}")
+        for i in range(n_rows)
+    ]
+
+
+def legacy_decode(rows):
+    for cnt, check_date, country, status in rows:
+        row = {"check_date": check_date, "cnt": cnt, "country": country, "status": status}
+        count_check = LegacyCountCheck.create_with_dimensions(DIMENSION_COLS)(**row)
+        count_check.to_flatten_dimension_format()
+
+
+def cached_decode(rows):
+    for count_check in starmap(CountCheck.create_with_dimensions(DIMENSION_COLS), rows):
+        count_check.to_flatten_dimension_format()
+
+
+def bench(name: str, decode, rows):
+    started_at = time.perf_counter()
+    decode(rows)
+    elapsed = time.perf_counter() - started_at
+    print(f"{name:<8} {len(rows):>9} rows  {elapsed:8.3f}s  {len(rows) / elapsed:>12,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    # The legacy path is orders of magnitude slower, bench it on a slice
+    bench("before", legacy_decode, rows[: max(args.rows // 20, 1)])
+    bench("after", cached_decode, rows)
+
+
+if __name__ == "__main__":
+    main()
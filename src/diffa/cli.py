@@ -1,13 +1,35 @@
 import sys
 import os
+from typing import List
 
 import click
-from alembic import command
-from alembic.config import Config
 
-from diffa.managers.check_manager import CheckManager
-from diffa.managers.run_manager import RunManager
-from diffa.config import ConfigManager, ExitCode
+# Only the config is imported here, so that parsing the command line (e.g. --help) stays
+# fast. The managers (SQLAlchemy, psycopg2, pydantic) and alembic are imported by the
+# commands that use them.
+from diffa.config import (
+    ConfigManager,
+    ExitCode,
+    SHARD_SIZES,
+    GRANULARITIES,
+    DEFAULT_PARTITION_COL,
+    DEFAULT_GRANULARITY,
+    MERGE_ENGINES,
+    DEFAULT_FETCH_SIZE,
+    DEFAULT_SUMMARY_TOP_K,
+    DEFAULT_DRILL_DOWN_THRESHOLD,
+    DEFAULT_PK_DIFF_MAX_ROWS,
+    DEFAULT_UPSERT_CHUNK_SIZE,
+    DEFAULT_MAX_CONCURRENCY,
+    DIFFA_DB_POOL_SIZE,
+    DIFFA_DB_POOL_RECYCLE,
+    DEFAULT_RUN_HEARTBEAT_INTERVAL,
+    DEFAULT_RUN_TTL,
+    DEFAULT_WORKER_POLL_INTERVAL,
+    DEFAULT_HEARTBEAT_INTERVAL,
+    DEFAULT_JOB_TTL,
+    DEFAULT_MAX_ATTEMPTS,
+)
 from diffa.utils import RunningCheckRunsException, InvalidDiffException
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -36,9 +58,8 @@ def cli():
 )
 @click.option(
     "--source-table",
-    required=True,
     type=str,
-    help="Source table name.",
+    help="Source table name (required without --manifest).",
 )
 @click.option(
     "--target-database",
@@ -53,9 +74,20 @@ def cli():
 )
 @click.option(
     "--target-table",
-    required=True,
     type=str,
-    help="Target table name.",
+    help="Target table name (required without --manifest).",
+)
+@click.option(
+    "--partition-column",
+    type=str,
+    default=DEFAULT_PARTITION_COL,
+    help=f"Timestamp (or date) column the rows are bucketed by (default: {DEFAULT_PARTITION_COL}).",
+)
+@click.option(
+    "--granularity",
+    type=click.Choice(GRANULARITIES),
+    default=DEFAULT_GRANULARITY,
+    help=f"Size of the time buckets the rows are counted by (default: {DEFAULT_GRANULARITY}).",
 )
 @click.option(
     "--diff-dimensions",
@@ -63,54 +95,325 @@ def cli():
     type=str,
     help="Diff dimension columns.",
 )
+@click.option(
+    "--checksum-columns",
+    multiple=True,
+    type=str,
+    help="Also compare a checksum of these columns per day, to catch rows changed in place.",
+)
+@click.option(
+    "--drill-down-key",
+    type=str,
+    help="Bisect the invalid days on this key column (e.g. the primary key) to locate the differing key ranges.",
+)
+@click.option(
+    "--drill-down-threshold",
+    type=click.IntRange(min=1),
+    default=DEFAULT_DRILL_DOWN_THRESHOLD,
+    help=f"Rows of a key segment below which the drill-down compares its keys one by one (default: {DEFAULT_DRILL_DOWN_THRESHOLD}).",
+)
+@click.option(
+    "--drill-down-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the key ranges found by the drill-down to this CSV file.",
+)
+@click.option(
+    "--pk-column",
+    type=str,
+    help="List the keys of this column missing or extra in the target, for the invalid days.",
+)
+@click.option(
+    "--pk-diff-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="CSV file of the keys listed by --pk-column (default: <source schema>.<source table>.pk_diff.csv).",
+)
+@click.option(
+    "--pk-diff-max-rows",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PK_DIFF_MAX_ROWS,
+    help=f"Rows (source + target) of an invalid day above which its keys are not listed (default: {DEFAULT_PK_DIFF_MAX_ROWS}).",
+)
 @click.option(
     "--full-diff",
     is_flag=True,
     help="Full diff mode. Re-run the diff from the beginning.",
 )
-def data_diff(
-    *,
-    source_db_uri: str = None,
-    target_db_uri: str = None,
-    diffa_db_uri: str = None,
-    source_database: str = None,
-    source_schema: str = "public",
-    source_table: str,
-    target_database: str = None,
-    target_schema: str = "public",
-    target_table: str,
-    diff_dimensions: tuple = None,
-    full_diff: bool = False,
-):
-    config_manager = ConfigManager().configure(
-        source_database=source_database,
-        source_schema=source_schema,
-        source_table=source_table,
-        target_database=target_database,
-        target_schema=target_schema,
-        target_table=target_table,
-        source_db_uri=source_db_uri,
-        target_db_uri=target_db_uri,
-        diffa_db_uri=diffa_db_uri,
-        diff_dimension_cols=list(diff_dimensions) if diff_dimensions else None,
-        full_diff=full_diff,
-    )
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of concurrent connections per side for sharded count queries (default: 1).",
+)
+@click.option(
+    "--shard-size",
+    type=click.Choice(SHARD_SIZES),
+    help="Split the count queries into date shards of this size.",
+)
+@click.option(
+    "--server-side-cursor/--client-side-cursor",
+    default=None,
+    help="Stream the count rows through server-side cursors (default: on with --diff-dimensions).",
+)
+@click.option(
+    "--fetch-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_FETCH_SIZE,
+    help=f"Rows fetched per round trip by server-side cursors (default: {DEFAULT_FETCH_SIZE}).",
+)
+@click.option(
+    "--merge-engine",
+    type=click.Choice(MERGE_ENGINES),
+    default="row",
+    help="Engine merging the source/target counts. 'columnar' requires numpy, from the 'columnar' extra: pip install 'diffa[columnar]' (default: row).",
+)
+@click.option(
+    "--summary-top-k",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SUMMARY_TOP_K,
+    help=f"Worst dimension groups detailed per failed day in the summary (default: {DEFAULT_SUMMARY_TOP_K}).",
+)
+@click.option(
+    "--summary-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the full per-group breakdown of the failed days to this CSV file.",
+)
+@click.option(
+    "--upsert-chunk-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_UPSERT_CHUNK_SIZE,
+    help=f"Diffa checks saved per transaction (default: {DEFAULT_UPSERT_CHUNK_SIZE}).",
+)
+@click.option(
+    "--max-host-concurrency",
+    type=click.IntRange(min=1),
+    help="Max in-flight round trips (executes and fetches) per source/target DB host, across all checks and shards. Open server-side cursors are not capped (default: unlimited).",
+)
+@click.option(
+    "--max-host-active-queries",
+    type=click.IntRange(min=0),
+    help="Delay new queries while the DB host has more active queries than this.",
+)
+@click.option(
+    "--max-replica-lag",
+    type=click.FloatRange(min=0),
+    help="Delay new queries while the DB host is a replica lagging by more seconds than this.",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Check all the table pairs of this YAML (or JSON) manifest in one process. YAML requires pyyaml, from the 'manifest' extra: pip install 'diffa[manifest]'.",
+)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_CONCURRENCY,
+    help=f"Pairs of the manifest checked at the same time (default: {DEFAULT_MAX_CONCURRENCY}).",
+)
+@click.option(
+    "--diffa-db-pool-size",
+    type=click.IntRange(min=1),
+    default=DIFFA_DB_POOL_SIZE,
+    help=f"Connections kept open to the Diffa DB (default: {DIFFA_DB_POOL_SIZE}).",
+)
+@click.option(
+    "--diffa-db-pool-recycle",
+    type=click.IntRange(min=-1),
+    default=DIFFA_DB_POOL_RECYCLE,
+    help=f"Seconds before a pooled Diffa DB connection is replaced, -1 to never replace (default: {DIFFA_DB_POOL_RECYCLE}).",
+)
+@click.option(
+    "--diffa-db-pool-pre-ping/--no-diffa-db-pool-pre-ping",
+    default=True,
+    help="Test pooled Diffa DB connections before using them (default: enabled).",
+)
+@click.option(
+    "--run-heartbeat-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_RUN_HEARTBEAT_INTERVAL,
+    help=f"Seconds between two heartbeats of a check run (default: {DEFAULT_RUN_HEARTBEAT_INTERVAL}).",
+)
+@click.option(
+    "--run-ttl",
+    type=click.IntRange(min=1),
+    default=DEFAULT_RUN_TTL,
+    help=f"Seconds without heartbeat before a RUNNING check run of the pair is taken over (default: {DEFAULT_RUN_TTL}).",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    help="Log the time spent in each phase of the check, with the query statistics.",
+)
+@click.option(
+    "--profile",
+    type=click.Path(file_okay=False, writable=True),
+    help="Profile the check with cProfile and tracemalloc, and write the reports to this directory.",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the metrics of the check runs to this OpenMetrics textfile (e.g. diffa.prom).",
+)
+def data_diff(*, manifest: str = None, max_concurrency: int, **options):
+    from diffa.managers.batch_manager import build_config_manager
+    from diffa.managers.check_manager import CheckManager
+    from diffa.managers.run_manager import RunManager
+    from diffa.metrics import export_check_metrics
+
+    if manifest:
+        run_manifest(manifest, max_concurrency, options)
+        return
+    if not options["source_table"] or not options["target_table"]:
+        raise click.UsageError(
+            "--source-table and --target-table are required without --manifest."
+        )
+
+    config_manager = build_config_manager(options)
     run_manager = RunManager(config_manager=config_manager)
-    check_manager = CheckManager(config_manager=config_manager)
+    check_manager = CheckManager(
+        config_manager=config_manager, taken_over=run_manager.taken_over
+    )
     try:
         run_manager.start_run()
         check_manager.data_diff()
-        run_manager.complete_run()
+        run_manager.complete_run(check_manager.get_timings())
+        export_check_metrics(run_manager, check_manager, "VALID")
     except RunningCheckRunsException:
         raise
     except InvalidDiffException:
-        run_manager.complete_run()
+        run_manager.complete_run(check_manager.get_timings())
+        export_check_metrics(run_manager, check_manager, "INVALID")
         sys.exit(ExitCode.INVALID_DIFF.value)
     except Exception:
-        run_manager.fail_run()
+        run_manager.fail_run(check_manager.get_timings())
+        export_check_metrics(run_manager, check_manager, "FAILED")
         raise
 
 
+def load_manifest_checks(manifest: str, options: dict) -> List[dict]:
+    """Load the checks of the manifest, as the full data-diff options of each pair on top
+    of the given default options
+    """
+    from diffa.managers.batch_manager import load_manifest
+
+    checks = load_manifest(manifest)
+    for i, check in enumerate(checks):
+        if unknown_options := set(check) - set(options):
+            raise click.UsageError(
+                f"Unknown options in the check #{i + 1} of {manifest}: {', '.join(sorted(unknown_options))}"
+            )
+        if not check.get("source_table") or not check.get("target_table"):
+            raise click.UsageError(
+                f"The check #{i + 1} of {manifest} needs a source_table and a target_table."
+            )
+    return [options | check for check in checks]
+
+
+def run_manifest(manifest: str, max_concurrency: int, options: dict):
+    """Check all the pairs of the manifest. The command line options are the defaults
+    of every check.
+    """
+    from diffa.managers.batch_manager import BatchManager, build_config_manager
+
+    batch_manager = BatchManager(
+        list(map(build_config_manager, load_manifest_checks(manifest, options))),
+        max_concurrency=max_concurrency,
+    )
+    exit_code = batch_manager.get_exit_code(batch_manager.run())
+    if exit_code:
+        sys.exit(exit_code)
+
+
+@cli.command()
+@click.option(
+    "--manifest",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="YAML (or JSON) manifest of the table pairs to check, as for data-diff --manifest.",
+)
+@click.option("--diffa-db-uri", type=str, help="Diffa database info.")
+def enqueue(*, manifest: str, diffa_db_uri: str = None):
+    """Add a check job per table pair of the manifest to the queue in the Diffa DB"""
+    from diffa.db.diffa_check_job import DiffaCheckJobService
+
+    data_diff_defaults = {
+        param.name: param.default
+        for param in data_diff.params
+        if param.name not in ("manifest", "max_concurrency")
+    }
+    checks = load_manifest_checks(manifest, data_diff_defaults)
+    config_manager = ConfigManager()
+    config_manager.diffa_check_job.update(db_uri=diffa_db_uri)
+    jobs = DiffaCheckJobService(config_manager).enqueue_checks(checks)
+    click.echo(f"Enqueued {len(jobs)} check jobs.")
+
+
+@cli.command()
+@click.option("--diffa-db-uri", type=str, help="Diffa database info.")
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Jobs run at the same time by this worker (default: 1).",
+)
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_WORKER_POLL_INTERVAL,
+    help=f"Seconds between two claims when the queue is empty (default: {DEFAULT_WORKER_POLL_INTERVAL}).",
+)
+@click.option(
+    "--heartbeat-interval",
+    type=click.FloatRange(min=1),
+    default=DEFAULT_HEARTBEAT_INTERVAL,
+    help=f"Seconds between two heartbeats of a running job (default: {DEFAULT_HEARTBEAT_INTERVAL}).",
+)
+@click.option(
+    "--job-ttl",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOB_TTL,
+    help=f"Seconds without heartbeat before a running job is reclaimed by another worker (default: {DEFAULT_JOB_TTL}).",
+)
+@click.option(
+    "--max-attempts",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_ATTEMPTS,
+    help=f"Claims of a job before it is given up (default: {DEFAULT_MAX_ATTEMPTS}).",
+)
+@click.option(
+    "--exit-when-empty",
+    is_flag=True,
+    default=False,
+    help="Exit once the queue has no job left to claim, with the combined exit code of the jobs.",
+)
+def worker(
+    *,
+    diffa_db_uri: str = None,
+    max_concurrency: int = 1,
+    poll_interval: float = DEFAULT_WORKER_POLL_INTERVAL,
+    heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+    job_ttl: int = DEFAULT_JOB_TTL,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    exit_when_empty: bool = False,
+):
+    """Claim and run the check jobs of the queue in the Diffa DB"""
+    from diffa.managers.batch_manager import BatchManager
+    from diffa.managers.worker_manager import WorkerManager
+
+    config_manager = ConfigManager()
+    config_manager.diffa_check_job.update(db_uri=diffa_db_uri)
+    results = WorkerManager(
+        config_manager,
+        max_concurrency=max_concurrency,
+        poll_interval=poll_interval,
+        heartbeat_interval=heartbeat_interval,
+        job_ttl=job_ttl,
+        max_attempts=max_attempts,
+        exit_when_empty=exit_when_empty,
+    ).run()
+    if exit_code := BatchManager.get_exit_code(results):
+        sys.exit(exit_code)
+
+
 @cli.command()
 def configure():
     config_manager = ConfigManager()
@@ -135,6 +438,9 @@ def configure():
 
 @cli.command()
 def migrate():
+    from alembic import command
+    from alembic.config import Config
+
     alembic_cfg = Config(os.path.join(SCRIPT_DIR, "migrations", "alembic.ini"))
     command.upgrade(alembic_cfg, "head")
     click.echo("Database migration completed successfully.")
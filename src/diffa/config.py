@@ -3,7 +3,8 @@ import json
 from datetime import date
 from enum import Enum
 from urllib.parse import urlparse
-from typing import List, Optional
+from types import MappingProxyType
+from typing import Any, List, Mapping, Optional
 
 from diffa.utils import Logger
 
@@ -12,10 +13,33 @@ CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
 DIFFA_DB_SCHEMA = "diffa"
 DIFFA_DB_TABLE = "diffa_checks"
 DIFFA_CHECK_RUNS_TABLE = "diffa_check_runs"
+DIFFA_CHECK_JOBS_TABLE = "diffa_check_jobs"
+DIFFA_CHECK_RUN_TIMINGS_TABLE = "diffa_check_run_timings"
 DIFFA_BEGIN_DATE = date(2020, 6, 1) # Matching with Ascenda start date
+SHARD_SIZES = ("week", "month")
+GRANULARITIES = ("hour", "day", "week", "month")  # Time buckets the rows are counted by
+DEFAULT_PARTITION_COL = "created_at"  # Column the rows are bucketed by
+DEFAULT_GRANULARITY = "day"
+MERGE_ENGINES = ("row", "columnar")
+DEFAULT_FETCH_SIZE = 10000  # Rows fetched per round trip by server-side cursors
+DEFAULT_SUMMARY_TOP_K = 10  # Worst dimension groups detailed per failed day
+DEFAULT_DRILL_DOWN_THRESHOLD = 1000  # Rows of a key segment below which its keys are compared
+DEFAULT_PK_DIFF_MAX_ROWS = 1000000  # Rows (source + target) of an invalid day to list its keys
+DEFAULT_UPSERT_CHUNK_SIZE = 50000  # Diffa checks saved per transaction
+DEFAULT_MAX_CONCURRENCY = 4  # Pairs of a manifest checked at the same time
+DIFFA_DB_POOL_SIZE = 5  # Connections kept open to the Diffa DB
+DIFFA_DB_POOL_MAX_OVERFLOW = 5  # Extra connections opened under load
+DIFFA_DB_POOL_RECYCLE = 1800  # Seconds before a pooled connection is replaced
+DEFAULT_RUN_HEARTBEAT_INTERVAL = 60  # Seconds between two heartbeats of a check run
+DEFAULT_RUN_TTL = 600  # Seconds without heartbeat before a RUNNING check run is reclaimed
+DEFAULT_WORKER_POLL_INTERVAL = 10  # Seconds between two claims when the queue is empty
+DEFAULT_HEARTBEAT_INTERVAL = 30  # Seconds between two heartbeats of a running job
+DEFAULT_JOB_TTL = 300  # Seconds without heartbeat before a running job is reclaimed
+DEFAULT_MAX_ATTEMPTS = 3  # Claims of a job before it is given up
 
 
 class ExitCode(Enum):
+    CHECK_FAILED = 1  # A check failed with an error
     INVALID_DIFF = 4  # Invalid diff detected
 
 
@@ -35,13 +59,21 @@ class DBConfig:
         self.db_schema = db_schema
         self.db_table = db_table
 
+    def __setattr__(self, name: str, value: Any):
+        # Any change of the config invalidates its parsed snapshot
+        super().__setattr__("_db_info", None)
+        super().__setattr__(name, value)
+
+    def _get_settings(self) -> dict:
+        return {key: value for key, value in self.__dict__.items() if not key.startswith("_")}
+
     def __eq__(self, __value: object) -> bool:
         if not isinstance(__value, self.__class__):
             return NotImplemented
-        return self.__dict__ == __value.__dict__
+        return self._get_settings() == __value._get_settings()
 
     def __repr__(self):
-        return f"{self.__class__.__name__}({self.__dict__})"
+        return f"{self.__class__.__name__}({self._get_settings()})"
 
     def update(self, **kwargs):
         for key, value in kwargs.items():
@@ -83,8 +115,14 @@ class DBConfig:
             "db_uri": f"{dns.scheme}://{dns.username}:{dns.password}@{dns.hostname}:{dns.port}/{db_database}",
         }
 
-    def get_db_config(self):
-        return self._parse_db_info()
+    def get_db_config(self) -> Mapping[str, Any]:
+        """Parsed DB info. The URI is parsed once, into a read-only snapshot that is
+        replaced when the config changes.
+        """
+        if self._db_info is None:
+            db_info = MappingProxyType(self._parse_db_info())
+            super().__setattr__("_db_info", db_info)
+        return self._db_info
 
     def get_db_name(self):
         return self.get_db_config().get("database")
@@ -104,40 +142,200 @@ class DBConfig:
 
 class SourceConfig(DBConfig):
     """A class to handle the configs for the Source DBs"""
-    def __init__(self, *args, diff_dimension_cols: Optional[List[str]] = None, **kwargs):
+    def __init__(
+        self,
+        *args,
+        partition_col: str = DEFAULT_PARTITION_COL,
+        granularity: str = DEFAULT_GRANULARITY,
+        diff_dimension_cols: Optional[List[str]] = None,
+        checksum_cols: Optional[List[str]] = None,
+        drill_down_key: Optional[str] = None,
+        pk_col: Optional[str] = None,
+        parallelism: int = 1,
+        shard_size: Optional[str] = None,
+        server_side_cursor: Optional[bool] = None,
+        fetch_size: int = DEFAULT_FETCH_SIZE,
+        max_host_concurrency: Optional[int] = None,
+        max_host_active_queries: Optional[int] = None,
+        max_replica_lag: Optional[float] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
+        self.partition_col = partition_col
+        self.granularity = granularity
         self.diff_dimension_cols = diff_dimension_cols or []
+        self.checksum_cols = checksum_cols or []
+        self.drill_down_key = drill_down_key
+        self.pk_col = pk_col
+        self.parallelism = parallelism
+        self.shard_size = shard_size
+        self.server_side_cursor = server_side_cursor
+        self.fetch_size = fetch_size
+        self.max_host_concurrency = max_host_concurrency
+        self.max_host_active_queries = max_host_active_queries
+        self.max_replica_lag = max_replica_lag
+
+    def get_partition_col(self):
+        return self.partition_col
+
+    def get_granularity(self):
+        return self.granularity
 
     def get_diff_dimension_cols(self):
         return self.diff_dimension_cols
+
+    def get_checksum_cols(self):
+        return self.checksum_cols
+
+    def get_drill_down_key(self):
+        return self.drill_down_key
+
+    def get_pk_col(self):
+        return self.pk_col
+
+    def get_parallelism(self):
+        return self.parallelism
+
+    def get_shard_size(self):
+        return self.shard_size
+
+    def use_server_side_cursor(self):
+        """Stream with server-side cursors by default when diff dimensions are enabled"""
+        if self.server_side_cursor is None:
+            return bool(self.diff_dimension_cols)
+        return self.server_side_cursor
+
+    def get_fetch_size(self):
+        return self.fetch_size
+
+    def get_max_host_concurrency(self):
+        return self.max_host_concurrency
+
+    def get_max_host_active_queries(self):
+        return self.max_host_active_queries
+
+    def get_max_replica_lag(self):
+        return self.max_replica_lag
+
+
 class DiffaConfig(DBConfig):
     """A class to handle the configs for the Diffa DB"""
-    def __init__(self, *args, full_diff: bool = False, **kwargs):
+    def __init__(
+        self,
+        *args,
+        full_diff: bool = False,
+        merge_engine: str = "row",
+        summary_top_k: int = DEFAULT_SUMMARY_TOP_K,
+        summary_file: Optional[str] = None,
+        drill_down_threshold: int = DEFAULT_DRILL_DOWN_THRESHOLD,
+        drill_down_file: Optional[str] = None,
+        pk_diff_file: Optional[str] = None,
+        pk_diff_max_rows: int = DEFAULT_PK_DIFF_MAX_ROWS,
+        pool_size: int = DIFFA_DB_POOL_SIZE,
+        pool_recycle: int = DIFFA_DB_POOL_RECYCLE,
+        pool_pre_ping: bool = True,
+        upsert_chunk_size: int = DEFAULT_UPSERT_CHUNK_SIZE,
+        run_heartbeat_interval: float = DEFAULT_RUN_HEARTBEAT_INTERVAL,
+        run_ttl: int = DEFAULT_RUN_TTL,
+        timings: bool = False,
+        profile_dir: Optional[str] = None,
+        metrics_file: Optional[str] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.full_diff = full_diff
+        self.merge_engine = merge_engine
+        self.summary_top_k = summary_top_k
+        self.summary_file = summary_file
+        self.drill_down_threshold = drill_down_threshold
+        self.drill_down_file = drill_down_file
+        self.pk_diff_file = pk_diff_file
+        self.pk_diff_max_rows = pk_diff_max_rows
+        self.pool_size = pool_size
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.upsert_chunk_size = upsert_chunk_size
+        self.run_heartbeat_interval = run_heartbeat_interval
+        self.run_ttl = run_ttl
+        self.timings = timings
+        self.profile_dir = profile_dir
+        self.metrics_file = metrics_file
 
     def is_full_diff(self):
         return self.full_diff
 
+    def get_merge_engine(self):
+        return self.merge_engine
+
+    def get_summary_top_k(self):
+        return self.summary_top_k
+
+    def get_summary_file(self):
+        return self.summary_file
+
+    def get_drill_down_threshold(self):
+        return self.drill_down_threshold
+
+    def get_drill_down_file(self):
+        return self.drill_down_file
+
+    def get_pk_diff_file(self):
+        return self.pk_diff_file
+
+    def get_pk_diff_max_rows(self):
+        return self.pk_diff_max_rows
+
+    def get_upsert_chunk_size(self):
+        return self.upsert_chunk_size
+
+    def get_run_heartbeat_interval(self):
+        return self.run_heartbeat_interval
+
+    def get_run_ttl(self):
+        return self.run_ttl
+
+    def show_timings(self):
+        return self.timings
+
+    def get_profile_dir(self):
+        return self.profile_dir
+
+    def get_metrics_file(self):
+        return self.metrics_file
+
+    def get_pool_options(self):
+        return {
+            "pool_size": self.pool_size,
+            "max_overflow": DIFFA_DB_POOL_MAX_OVERFLOW,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+        }
+
+
 class ConfigManager:
     """Manage all the configuration needed for Diffa Operations"""
 
     def __init__(
         self,
-        source_config: SourceConfig = SourceConfig(),
-        target_config: SourceConfig = SourceConfig(),
-        diffa_check_config: DiffaConfig = DiffaConfig(),
-        diffa_check_run_config: DiffaConfig = DiffaConfig(),
+        source_config: Optional[SourceConfig] = None,
+        target_config: Optional[SourceConfig] = None,
+        diffa_check_config: Optional[DiffaConfig] = None,
+        diffa_check_run_config: Optional[DiffaConfig] = None,
+        diffa_check_job_config: Optional[DiffaConfig] = None,
     ):
+        # Each manager owns its configs, so that the pairs of a manifest don't share them
         self.config = {
-            "source": source_config,
-            "target": target_config,
-            "diffa_check": diffa_check_config.update(
+            "source": source_config or SourceConfig(),
+            "target": target_config or SourceConfig(),
+            "diffa_check": (diffa_check_config or DiffaConfig()).update(
                 db_schema=DIFFA_DB_SCHEMA, db_table=DIFFA_DB_TABLE
             ),
-            "diffa_check_run": diffa_check_run_config.update(
+            "diffa_check_run": (diffa_check_run_config or DiffaConfig()).update(
                 db_schema=DIFFA_DB_SCHEMA, db_table=DIFFA_CHECK_RUNS_TABLE
             ),
+            "diffa_check_job": (diffa_check_job_config or DiffaConfig()).update(
+                db_schema=DIFFA_DB_SCHEMA, db_table=DIFFA_CHECK_JOBS_TABLE
+            ),
         }
         self.__load_config()
 
@@ -153,35 +351,112 @@ class ConfigManager:
         target_schema: str = "public",
         target_table: str,
         diffa_db_uri: str = None,
+        partition_column: str = None,
+        granularity: str = None,
         diff_dimension_cols: List[str] = None,
+        checksum_cols: List[str] = None,
+        drill_down_key: str = None,
+        pk_column: str = None,
         full_diff: bool = False,
+        parallelism: int = None,
+        shard_size: str = None,
+        server_side_cursor: bool = None,
+        fetch_size: int = None,
+        merge_engine: str = None,
+        summary_top_k: int = None,
+        summary_file: str = None,
+        drill_down_threshold: int = None,
+        drill_down_file: str = None,
+        pk_diff_file: str = None,
+        pk_diff_max_rows: int = None,
+        diffa_db_pool_size: int = None,
+        diffa_db_pool_recycle: int = None,
+        diffa_db_pool_pre_ping: bool = None,
+        upsert_chunk_size: int = None,
+        max_host_concurrency: int = None,
+        max_host_active_queries: int = None,
+        max_replica_lag: float = None,
+        run_heartbeat_interval: float = None,
+        run_ttl: int = None,
+        timings: bool = None,
+        profile: str = None,
+        metrics_file: str = None,
     ):
         self.source.update(
             db_uri=source_db_uri,
             db_name=source_database,
             db_schema=source_schema,
             db_table=source_table,
+            partition_col=partition_column,
+            granularity=granularity,
             diff_dimension_cols=diff_dimension_cols,
+            checksum_cols=checksum_cols,
+            drill_down_key=drill_down_key,
+            pk_col=pk_column,
+            parallelism=parallelism,
+            shard_size=shard_size,
+            server_side_cursor=server_side_cursor,
+            fetch_size=fetch_size,
+            max_host_concurrency=max_host_concurrency,
+            max_host_active_queries=max_host_active_queries,
+            max_replica_lag=max_replica_lag,
         )
         self.target.update(
             db_uri=target_db_uri,
             db_name=target_database,
             db_schema=target_schema,
             db_table=target_table,
+            partition_col=partition_column,
+            granularity=granularity,
             diff_dimension_cols=diff_dimension_cols,
+            checksum_cols=checksum_cols,
+            drill_down_key=drill_down_key,
+            pk_col=pk_column,
+            parallelism=parallelism,
+            shard_size=shard_size,
+            server_side_cursor=server_side_cursor,
+            fetch_size=fetch_size,
+            max_host_concurrency=max_host_concurrency,
+            max_host_active_queries=max_host_active_queries,
+            max_replica_lag=max_replica_lag,
         )
         self.diffa_check.update(
             db_uri=diffa_db_uri,
             full_diff=full_diff,
+            merge_engine=merge_engine,
+            summary_top_k=summary_top_k,
+            summary_file=summary_file,
+            drill_down_threshold=drill_down_threshold,
+            drill_down_file=drill_down_file,
+            pk_diff_file=pk_diff_file,
+            pk_diff_max_rows=pk_diff_max_rows,
+            upsert_chunk_size=upsert_chunk_size,
+            timings=timings,
+            profile_dir=profile,
+            metrics_file=metrics_file,
         )
         self.diffa_check_run.update(
             db_uri=diffa_db_uri,
+            run_heartbeat_interval=run_heartbeat_interval,
+            run_ttl=run_ttl,
         )
+        self.diffa_check_job.update(
+            db_uri=diffa_db_uri,
+        )
+        for diffa_config in (
+            self.diffa_check,
+            self.diffa_check_run,
+            self.diffa_check_job,
+        ):
+            diffa_config.update(
+                pool_size=diffa_db_pool_size,
+                pool_recycle=diffa_db_pool_recycle,
+                pool_pre_ping=diffa_db_pool_pre_ping,
+            )
         return self
 
     def __load_config(self):
         uri_config = {}
-        os.makedirs(CONFIG_DIR, exist_ok=True)
         if os.path.exists(CONFIG_FILE):
             with open(CONFIG_FILE, "r", encoding="utf-8") as f:
                 uri_config = json.load(f)
@@ -202,6 +477,10 @@ class ConfigManager:
             db_uri=self.diffa_check_run.db_uri
             or os.getenv("DIFFA__DIFFA_DB_URI", uri_config.get("diffa_uri")),
         )
+        self.diffa_check_job.update(
+            db_uri=self.diffa_check_job.db_uri
+            or os.getenv("DIFFA__DIFFA_DB_URI", uri_config.get("diffa_uri")),
+        )
 
     @classmethod
     def save_config(self, source_uri: str, target_uri: str, diffa_uri: str):
@@ -212,6 +491,7 @@ class ConfigManager:
             "target_uri": target_uri,
             "diffa_uri": diffa_uri,
         }
+        os.makedirs(CONFIG_DIR, exist_ok=True)
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
             json.dump(config, f, indent=4)
 
@@ -1,10 +1,25 @@
+import atexit
+import queue
+import threading
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
 
 import psycopg2
 import psycopg2.extras
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from diffa.config import (
+    DIFFA_DB_POOL_SIZE,
+    DIFFA_DB_POOL_MAX_OVERFLOW,
+    DIFFA_DB_POOL_RECYCLE,
+)
+from diffa.utils import Logger
+
+logger = Logger(__name__)
 
 
 class Connection(ABC):
@@ -47,17 +62,158 @@ class PostgresConnection(Connection):
         self.conn = None
 
 
+class PostgresConnectionRegistry:
+    """Process-wide idle PostgreSQL connections, shared per DSN by all the source/target
+    databases of the process. Connections are closed at exit.
+    """
+
+    _idle_conns: Dict[str, queue.LifoQueue] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_idle_connections(cls, db_uri: str) -> queue.LifoQueue:
+        with cls._lock:
+            return cls._idle_conns.setdefault(db_uri, queue.LifoQueue())
+
+    @classmethod
+    @contextmanager
+    def checkout(cls, db_config: dict):
+        """Check out an idle connection of the DSN (a new one if none is idle)"""
+
+        idle_conns = cls.get_idle_connections(db_config["db_uri"])
+        try:
+            conn = idle_conns.get_nowait()
+        except queue.Empty:
+            conn = PostgresConnection(db_config)
+        try:
+            yield conn
+        finally:
+            idle_conns.put(conn)
+
+    @classmethod
+    def close_idle(cls, db_uri: str):
+        """Close the idle connections of the DSN"""
+
+        idle_conns = cls.get_idle_connections(db_uri)
+        while True:
+            try:
+                idle_conns.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @classmethod
+    def close_all(cls):
+        for db_uri in list(cls._idle_conns):
+            cls.close_idle(db_uri)
+
+
+atexit.register(PostgresConnectionRegistry.close_all)
+
+
+@dataclass
+class PoolMetrics:
+    """Counters of a SQLAlchemy connection pool"""
+
+    connects: int = 0
+    checkouts: int = 0
+    checkins: int = 0
+    invalidations: int = 0
+    checked_out: int = 0
+    max_checked_out: int = 0
+
+
+class EngineRegistry:
+    """Process-wide registry of SQLAlchemy engines, one pooled engine per database URI.
+    Engines are disposed at exit.
+    """
+
+    _engines: Dict[str, Engine] = {}
+    _metrics: Dict[str, PoolMetrics] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_engine(
+        cls,
+        db_uri: str,
+        pool_size: int = DIFFA_DB_POOL_SIZE,
+        max_overflow: int = DIFFA_DB_POOL_MAX_OVERFLOW,
+        pool_recycle: int = DIFFA_DB_POOL_RECYCLE,
+        pool_pre_ping: bool = True,
+    ) -> Engine:
+        """Get the engine of the URI, creating it on first use"""
+
+        with cls._lock:
+            if db_uri not in cls._engines:
+                engine = create_engine(
+                    db_uri,
+                    pool_size=pool_size,
+                    max_overflow=max_overflow,
+                    pool_recycle=pool_recycle,
+                    pool_pre_ping=pool_pre_ping,
+                )
+                cls._metrics[db_uri] = cls._track_pool_metrics(engine)
+                cls._engines[db_uri] = engine
+            return cls._engines[db_uri]
+
+    @staticmethod
+    def _track_pool_metrics(engine: Engine) -> PoolMetrics:
+        metrics = PoolMetrics()
+
+        def on_connect(*args):
+            metrics.connects += 1
+
+        def on_checkout(*args):
+            metrics.checkouts += 1
+            metrics.checked_out += 1
+            metrics.max_checked_out = max(metrics.max_checked_out, metrics.checked_out)
+
+        def on_checkin(*args):
+            metrics.checkins += 1
+            metrics.checked_out -= 1
+
+        def on_invalidate(*args):
+            metrics.invalidations += 1
+
+        event.listen(engine, "connect", on_connect)
+        event.listen(engine, "checkout", on_checkout)
+        event.listen(engine, "checkin", on_checkin)
+        event.listen(engine, "invalidate", on_invalidate)
+        return metrics
+
+    @classmethod
+    def get_pool_metrics(cls, db_uri: str) -> Optional[PoolMetrics]:
+        return cls._metrics.get(db_uri)
+
+    @classmethod
+    def dispose_all(cls):
+        """Dispose all the engines, closing their pooled connections"""
+
+        with cls._lock:
+            for db_uri, engine in cls._engines.items():
+                logger.debug(
+                    f"Disposing the engine of {engine.url!r}. Pool metrics: {cls._metrics[db_uri]}"
+                )
+                engine.dispose()
+            cls._engines.clear()
+            cls._metrics.clear()
+
+
+atexit.register(EngineRegistry.dispose_all)
+
+
 class DiffaConnection(Connection):
     """Connection adapter for Diffa State DB"""
 
-    def __init__(self, db_config: dict):
+    def __init__(self, db_config: dict, pool_options: Optional[dict] = None):
         super().__init__(db_config)
+        self.pool_options = pool_options or {}
         self.conn = None
 
+    def get_db_uri(self) -> str:
+        return self.db_config["db_uri"] + "?sslmode=prefer"  # Prefer SSL mode
+
     def __get_engine(self):
-        return create_engine(
-            self.db_config["db_uri"] + "?sslmode=prefer"
-        )  # Prefer SSL mode
+        return EngineRegistry.get_engine(self.get_db_uri(), **self.pool_options)
 
     def connect(self):
         if not self.conn:
@@ -66,13 +222,18 @@ class DiffaConnection(Connection):
 
     @contextmanager
     def db_session(self):
-        """Context Manager for DB session"""
+        """Context Manager for DB session, on a connection from the shared pool"""
 
-        session = sessionmaker(bind=self.__get_engine())()
-        yield session
-        session.close()
+        session = Session(bind=self.__get_engine())
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def get_pool_metrics(self) -> Optional[PoolMetrics]:
+        return EngineRegistry.get_pool_metrics(self.get_db_uri())
 
     def close(self):
-        if not self.conn:
+        if self.conn is not None:
             self.conn.close()
         self.conn = None
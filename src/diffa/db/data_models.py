@@ -1,35 +1,48 @@
-from datetime import date
-from typing import Optional, List, Tuple, Any
-from dataclasses import dataclass, fields, make_dataclass
-from functools import reduce
+from datetime import date, datetime, time, timedelta
+from typing import Optional, List, Tuple, Any, ClassVar
+from dataclasses import dataclass, make_dataclass
+from functools import reduce, lru_cache
+import hashlib
 import uuid
 
 from sqlalchemy import (
+    BigInteger,
     Column,
+    Float,
     Integer,
     String,
     MetaData,
     Date,
     Boolean,
     DateTime,
+    Text,
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from pydantic import BaseModel, model_validator
 
-from diffa.config import ConfigManager
-from diffa.utils import Logger
+from diffa.config import (
+    DIFFA_DB_SCHEMA,
+    DIFFA_DB_TABLE,
+    DIFFA_CHECK_RUNS_TABLE,
+    DIFFA_CHECK_JOBS_TABLE,
+    DIFFA_CHECK_RUN_TIMINGS_TABLE,
+    DEFAULT_GRANULARITY,
+    GRANULARITIES,
+)
+from diffa.utils import DiffaException, Logger
 
 logger = Logger(__name__)
 Base = declarative_base()
-config = ConfigManager()
+
+CHECKSUM_MODULUS = 2**64  # Checksums are sums of 64-bit row hashes, wrapped around
 
 
 class DiffaCheck(Base):
     """SQLAlchemy Model for Diffa state management"""
 
-    __tablename__ = config.diffa_check.get_db_table()
-    metadata = MetaData(schema=config.diffa_check.get_db_schema())
+    __tablename__ = DIFFA_DB_TABLE
+    metadata = MetaData(schema=DIFFA_DB_SCHEMA)
     id = Column(UUID, primary_key=True)
     source_database = Column(String)
     source_schema = Column(String)
@@ -42,6 +55,10 @@ class DiffaCheck(Base):
     target_count = Column(Integer)
     is_valid = Column(Boolean)
     diff_count = Column(Integer)
+    source_checksum = Column(BigInteger)
+    target_checksum = Column(BigInteger)
+    granularity = Column(String)
+    bucket_start = Column(DateTime)
     updated_at = Column(DateTime)
 
 
@@ -60,6 +77,10 @@ class DiffaCheckSchema(BaseModel):
     target_count: int
     is_valid: bool
     diff_count: int
+    source_checksum: Optional[int] = None
+    target_checksum: Optional[int] = None
+    granularity: str = DEFAULT_GRANULARITY
+    bucket_start: Optional[datetime] = None
 
     @classmethod
     def create_id(
@@ -71,9 +92,18 @@ class DiffaCheckSchema(BaseModel):
         target_schema: str,
         target_table: str,
         check_date: date,
+        granularity: str = DEFAULT_GRANULARITY,
+        bucket_start: Optional[datetime] = None,
     ):
-        """Create a unique ID for the diffa check"""
-        hash_input = f"{source_database}{source_schema}{source_table}{target_database}{target_schema}{target_table}{check_date}"
+        """Create a unique ID for the diffa check. The IDs of the daily checks only
+        depend on the pair and the day (as before buckets of other sizes existed).
+        """
+        bucket_key = (
+            check_date
+            if granularity == DEFAULT_GRANULARITY
+            else f"{granularity}:{bucket_start.isoformat()}"
+        )
+        hash_input = f"{source_database}{source_schema}{source_table}{target_database}{target_schema}{target_table}{bucket_key}"
         return uuid.uuid5(uuid.NAMESPACE_DNS, hash_input)
 
     class Config:
@@ -84,6 +114,8 @@ class DiffaCheckSchema(BaseModel):
 
     @model_validator(mode="after")
     def set_id_if_missing(self):
+        if self.bucket_start is None:
+            self.bucket_start = datetime.combine(self.check_date, time())
         if self.id is None:
             self.id = self.create_id(
                 self.source_database,
@@ -93,15 +125,100 @@ class DiffaCheckSchema(BaseModel):
                 self.target_schema,
                 self.target_table,
                 self.check_date,
+                self.granularity,
+                self.bucket_start,
             )
         return self
 
 
+class DiffaCheckPairSchema(BaseModel):
+    """Pydantic Model (validation) for the identity of a source/target pair"""
+
+    source_database: str
+    source_schema: str
+    source_table: str
+    target_database: str
+    target_schema: str
+    target_table: str
+
+
+class DiffaCheckFactory:
+    """Trusted bulk builder of the diffa check records of a source/target pair.
+
+    The pair identity is validated once, then records are built as plain dicts (the
+    DiffaCheckSchema fields) without per-row validation. The id is the same uuid5 as
+    DiffaCheckSchema.create_id, with the SHA-1 state of the namespace and the pair
+    identity computed once.
+    """
+
+    def __init__(self, granularity: str = DEFAULT_GRANULARITY, **pair_identity: str):
+        self.pair_identity = DiffaCheckPairSchema(**pair_identity).model_dump()
+        self.granularity = Granularity(granularity)
+        self._id_hash = hashlib.sha1(
+            uuid.NAMESPACE_DNS.bytes
+            + "".join(self.pair_identity.values()).encode("utf-8")
+        )
+
+    def create_id(self, bucket_start: datetime) -> uuid.UUID:
+        id_hash = self._id_hash.copy()
+        if self.granularity.name == DEFAULT_GRANULARITY:
+            bucket_key = bucket_start.date().isoformat()
+        else:
+            bucket_key = f"{self.granularity.name}:{bucket_start.isoformat()}"
+        id_hash.update(bucket_key.encode("utf-8"))
+        return uuid.UUID(bytes=id_hash.digest()[:16], version=5)
+
+    def create(
+        self,
+        check_date: date,
+        source_count: int,
+        target_count: int,
+        is_valid: bool,
+        source_checksum: Optional[int] = None,
+        target_checksum: Optional[int] = None,
+    ) -> dict:
+        """`check_date` is the bucket of the check: a date, or a datetime for hours"""
+
+        bucket_start = self.granularity.get_bucket_start(check_date)
+        return {
+            "id": self.create_id(bucket_start),
+            **self.pair_identity,
+            "check_date": bucket_start.date(),
+            "source_count": source_count,
+            "target_count": target_count,
+            "is_valid": is_valid,
+            "diff_count": target_count - source_count,
+            "source_checksum": source_checksum,
+            "target_checksum": target_checksum,
+            "granularity": self.granularity.name,
+            "bucket_start": bucket_start,
+        }
+
+    def from_merged_count_check(self, merged_count_check: "MergedCountCheck") -> dict:
+        if not merged_count_check.is_valid:
+            logger.info(
+                "Diff: "
+                f"Source Count: {merged_count_check.source_count}, "
+                f"Target Count: {merged_count_check.target_count}, "
+                f"Check Date: {merged_count_check.check_date}, "
+                + merged_count_check.get_checksum_message()
+                + f"Is Valid: {merged_count_check.is_valid} "
+            )
+        return self.create(
+            merged_count_check.check_date,
+            merged_count_check.source_count,
+            merged_count_check.target_count,
+            merged_count_check.is_valid,
+            merged_count_check.source_checksum,
+            merged_count_check.target_checksum,
+        )
+
+
 class DiffaCheckRun(Base):
     """SQLAlchemy Model for Diffa state management"""
 
-    __tablename__ = config.diffa_check_run.get_db_table()
-    metadata = MetaData(schema=config.diffa_check_run.get_db_schema())
+    __tablename__ = DIFFA_CHECK_RUNS_TABLE
+    metadata = MetaData(schema=DIFFA_DB_SCHEMA)
     run_id = Column(UUID, primary_key=True)
     source_database = Column(String)
     source_schema = Column(String)
@@ -111,6 +228,21 @@ class DiffaCheckRun(Base):
     target_table = Column(String)
     status = Column(String)
     updated_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+
+
+class DiffaCheckRunTiming(Base):
+    """SQLAlchemy Model for the phase timings of the Diffa check runs"""
+
+    __tablename__ = DIFFA_CHECK_RUN_TIMINGS_TABLE
+    metadata = MetaData(schema=DIFFA_DB_SCHEMA)
+    run_id = Column(UUID, primary_key=True)
+    phase = Column(String, primary_key=True)
+    elapsed_seconds = Column(Float)
+    rows = Column(BigInteger)
+    bytes = Column(BigInteger)
+    execute_seconds = Column(Float)
+    fetch_seconds = Column(Float)
 
 
 class DiffaCheckRunSchema(BaseModel):
@@ -149,22 +281,103 @@ class DiffaCheckRunSchema(BaseModel):
         return self
 
 
-@dataclass(frozen=True)
+class DiffaCheckJob(Base):
+    """SQLAlchemy Model for the distributed check queue"""
+
+    __tablename__ = DIFFA_CHECK_JOBS_TABLE
+    metadata = MetaData(schema=DIFFA_DB_SCHEMA)
+    job_id = Column(UUID, primary_key=True)
+    check_options = Column(JSONB)
+    status = Column(String)
+    result = Column(String)
+    error = Column(Text)
+    attempts = Column(Integer)
+    worker_id = Column(String)
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+class DiffaCheckJobSchema(BaseModel):
+    """Pydantic Model (validation) for the distributed check queue"""
+
+    job_id: uuid.UUID = None
+    check_options: dict
+    status: str = "PENDING"
+    result: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    worker_id: Optional[str] = None
+
+    class Config:
+        from_attributes = (
+            True  # Enable ORM mode to allow loading from SQLAlchemy models
+        )
+        validate_assignment = True
+
+    @model_validator(mode="after")
+    def set_id_if_missing(self):
+        if self.job_id is None:
+            self.job_id = uuid.uuid4()
+        return self
+
+    @model_validator(mode="after")
+    def validate_status(self):
+        if self.status not in ["PENDING", "RUNNING", "COMPLETED", "FAILED"]:
+            raise ValueError(f"Invalid status: {self.status}")
+        return self
+
+
+def wrap_checksum(checksum: int) -> int:
+    """Wrap a sum of row checksums into the signed 64-bit range, like the count queries
+    do, so that checksums summed in Python, NumPy and SQL all compare equal
+    """
+    return (checksum + CHECKSUM_MODULUS // 2) % CHECKSUM_MODULUS - CHECKSUM_MODULUS // 2
+
+
+@dataclass(frozen=True, slots=True)
 class CountCheck:
     """A single count check in Source/Target Database"""
 
     cnt: int
     check_date: date
 
+    # Sorted dimension field names, set on the classes created with dimensions
+    dimension_names: ClassVar[Tuple[str, ...]] = ()
+    # Whether the rows end with the checksum of the group (see --checksum-columns)
+    has_checksum: ClassVar[bool] = False
+
     @classmethod
-    def create_with_dimensions(cls, dimension_cols: Optional[List[str]] = None):
-        """Factory method to create a CountCheck class with dimension fields"""
+    def create_with_dimensions(
+        cls, dimension_cols: Optional[List[str]] = None, with_checksum: bool = False
+    ):
+        """Factory method to create a CountCheck class with dimension fields.
+        The class is created once per dimension signature and shared by all the rows.
+        Its fields are ordered as (cnt, check_date, *sorted dimensions[, checksum]).
+        """
+
+        if not dimension_cols and not with_checksum:
+            return cls
+        return cls._create_with_dimension_names(
+            tuple(sorted(dimension_cols or [])), with_checksum
+        )
 
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _create_with_dimension_names(
+        cls, dimension_names: Tuple[str, ...], with_checksum: bool = False
+    ):
         return make_dataclass(
             cls.__name__,
-            [(col, str) for col in sorted(dimension_cols)] if dimension_cols else [],
+            [(col, str) for col in dimension_names]
+            + ([("checksum", int)] if with_checksum else []),
             bases=(cls,),
             frozen=True,
+            slots=True,
+            namespace={
+                "dimension_names": dimension_names,
+                "has_checksum": with_checksum,
+            },
         )
 
     @classmethod
@@ -173,19 +386,146 @@ class CountCheck:
 
     @classmethod
     def get_dimension_fields(cls) -> List[Tuple[str, type]]:
-        base_fields = {name for name, _ in cls.get_base_fields()}
-
-        return [(f.name, f.type) for f in fields(cls) if f.name not in base_fields]
+        return [(name, str) for name in cls.dimension_names]
 
     def get_dimension_values(self):
         # check_date is still considered as a dimension field. In fact, it's a main dimension field.
-        return {
-            f[0]: getattr(self, f[0])
-            for f in self.get_dimension_fields() + [("check_date", date)]
-        }
+        values = {name: getattr(self, name) for name in self.dimension_names}
+        values["check_date"] = self.check_date
+        return values
+
+    def get_dimension_key(self) -> Tuple[Tuple[str, Any], ...]:
+        return tuple(
+            (name, getattr(self, name)) for name in self.dimension_names
+        ) + (("check_date", self.check_date),)
 
     def to_flatten_dimension_format(self) -> dict:
-        return {tuple(self.get_dimension_values().items()): self}
+        return {self.get_dimension_key(): self}
+
+    def get_sort_key(self) -> Tuple[date, Tuple[Tuple[bool, str], ...]]:
+        """Key matching the count query ordering: check_date, then the dimensions
+        compared bytewise (COLLATE "C") with NULLs last
+        """
+        return self.check_date, tuple(
+            (value is None, value or "")
+            for value in (getattr(self, name) for name in self.dimension_names)
+        )
+
+
+@dataclass(frozen=True)
+class Granularity:
+    """Size of the time buckets the rows are counted by (see GRANULARITIES).
+
+    A bucket is keyed by its start: a datetime for hours, a date for days, weeks
+    (starting on Mondays) and months.
+    """
+
+    name: str = DEFAULT_GRANULARITY
+
+    def __post_init__(self):
+        if self.name not in GRANULARITIES:
+            raise DiffaException(
+                f"Unknown granularity {self.name}, expected one of {', '.join(GRANULARITIES)}"
+            )
+
+    def truncate(self, value: date) -> date:
+        """Bucket holding the date (or datetime)"""
+
+        if self.name == "hour":
+            if isinstance(value, datetime):
+                return value.replace(minute=0, second=0, microsecond=0)
+            return datetime.combine(value, time())
+        day = value.date() if isinstance(value, datetime) else value
+        if self.name == "week":
+            return day - timedelta(days=day.weekday())
+        if self.name == "month":
+            return day.replace(day=1)
+        return day
+
+    def get_next_bucket(self, bucket: date) -> date:
+        if self.name == "hour":
+            return bucket + timedelta(hours=1)
+        if self.name == "week":
+            return bucket + timedelta(weeks=1)
+        if self.name == "month":
+            return (bucket + timedelta(days=32)).replace(day=1)
+        return bucket + timedelta(days=1)
+
+    def get_bucket_start(self, bucket: date) -> datetime:
+        if isinstance(bucket, datetime):
+            return bucket
+        return datetime.combine(bucket, time())
+
+    def to_ordinal(self, bucket: date) -> int:
+        """Integer key of the bucket, in bucket order"""
+
+        if self.name == "hour":
+            return bucket.toordinal() * 24 + bucket.hour
+        return bucket.toordinal()
+
+    def from_ordinal(self, ordinal: int) -> date:
+        if self.name == "hour":
+            return datetime.combine(date.fromordinal(ordinal // 24), time(ordinal % 24))
+        return date.fromordinal(ordinal)
+
+
+@dataclass(frozen=True)
+class ShardTiming:
+    """Timing of a single date shard of the count query on the Source/Target Database"""
+
+    side: str
+    shard_start: date
+    shard_end: Optional[date]
+    row_count: int
+    elapsed_seconds: float
+    attempts: int = 1
+
+    def __str__(self):
+        return (
+            f"{self.side} shard [{self.shard_start}, {self.shard_end or 'catch-up end'}): "
+            f"{self.row_count} rows in {self.elapsed_seconds:.2f}s"
+        )
+
+
+@dataclass(frozen=True)
+class KeySegment:
+    """Half-open [key_start, key_end) range of the drill-down key within a day"""
+
+    check_date: date
+    key_start: Any
+    key_end: Any
+
+
+@dataclass(frozen=True)
+class KeyRangeDiff:
+    """A run of consecutive keys of a day missing in the target (`missing`), only in
+    the target (`extra`) or with different checksums (`changed`). The range is closed:
+    [key_start, key_end].
+    """
+
+    check_date: date
+    kind: str
+    key_start: Any
+    key_end: Any
+    rows: int
+
+    def __str__(self):
+        key_range = (
+            f"{self.key_start}"
+            if self.key_start == self.key_end
+            else f"[{self.key_start}, {self.key_end}]"
+        )
+        return f"{self.check_date} {self.kind} {key_range} ({self.rows} rows)"
+
+
+MERGED_COUNT_CHECK_BASE_FIELDS = (
+    "source_count",
+    "target_count",
+    "check_date",
+    "is_valid",
+    "source_checksum",
+    "target_checksum",
+)
 
 
 class MergedCountCheck:
@@ -197,16 +537,41 @@ class MergedCountCheck:
         target_count: int,
         check_date: date,
         is_valid: Optional[bool] = None,
+        source_checksum: Optional[int] = None,
+        target_checksum: Optional[int] = None,
         **kwargs: Any,
     ):
         self.source_count = source_count
         self.target_count = target_count
         self.check_date = check_date
+        self.source_checksum = source_checksum
+        self.target_checksum = target_checksum
         for key, value in kwargs.items():
             setattr(self, key, value)
 
         self.is_valid = (
-            is_valid if is_valid is not None else source_count <= target_count
+            is_valid
+            if is_valid is not None
+            else source_count <= target_count and not self.has_checksum_diff()
+        )
+
+    def has_checksum_diff(self) -> bool:
+        """Rows changed in place: same counts on both sides, but different checksums.
+        When the counts differ, the checksums differ anyway and tell nothing more.
+        """
+        return (
+            self.source_checksum is not None
+            and self.target_checksum is not None
+            and self.source_count == self.target_count
+            and self.source_checksum != self.target_checksum
+        )
+
+    def get_checksum_message(self) -> str:
+        if self.source_checksum is None and self.target_checksum is None:
+            return ""
+        return (
+            f"Source Checksum: {self.source_checksum}, "
+            f"Target Checksum: {self.target_checksum}, "
         )
 
     def __eq__(self, other):
@@ -220,7 +585,7 @@ class MergedCountCheck:
         dynamic_fields = [
             f
             for f in self.__dict__.keys()
-            if f not in ["source_count", "target_count", "check_date", "is_valid"]
+            if f not in MERGED_COUNT_CHECK_BASE_FIELDS
         ]
         precedence = (
             ["check_date"]
@@ -233,7 +598,13 @@ class MergedCountCheck:
         )
 
     def __str__(self):
-        return f"MergedCountCheck({", ".join(f"{k}={v!r}" for k, v in self.__dict__.items())})"
+        # The checksums are only shown when checked (see --checksum-columns)
+        fields = {
+            k: v
+            for k, v in self.__dict__.items()
+            if v is not None or k not in ("source_checksum", "target_checksum")
+        }
+        return f"MergedCountCheck({", ".join(f"{k}={v!r}" for k, v in fields.items())})"
 
     @classmethod
     def create_with_dimensions(cls, dimension_fields: List[Tuple[str, type]]):
@@ -255,39 +626,13 @@ class MergedCountCheck:
         merged_count_check_values = count_check.get_dimension_values()
         merged_count_check_values["source_count"] = source.cnt if source else 0
         merged_count_check_values["target_count"] = target.cnt if target else 0
-
-        return cls(**merged_count_check_values)
-
-    def to_diffa_check_schema(
-        self,
-        source_database: str,
-        source_schema: str,
-        source_table: str,
-        target_database: str,
-        target_schema: str,
-        target_table: str,
-    ) -> DiffaCheckSchema:
-        """Convert the merged count check to a DiffaCheckSchema"""
-
-        if not self.is_valid:
-            logger.info(
-                "Diff: "
-                f"Source Count: {self.source_count}, "
-                f"Target Count: {self.target_count}, "
-                f"Check Date: {self.check_date}, "
-                f"Is Valid: {self.is_valid} "
+        if count_check.has_checksum:
+            # A missing group sums no row hashes
+            merged_count_check_values["source_checksum"] = (
+                source.checksum if source else 0
+            )
+            merged_count_check_values["target_checksum"] = (
+                target.checksum if target else 0
             )
 
-        return DiffaCheckSchema(
-            source_database=source_database,
-            source_schema=source_schema,
-            source_table=source_table,
-            target_database=target_database,
-            target_schema=target_schema,
-            target_table=target_table,
-            check_date=self.check_date,
-            source_count=self.source_count,
-            target_count=self.target_count,
-            is_valid=self.is_valid,
-            diff_count=self.target_count - self.source_count,
-        )
+        return cls(**merged_count_check_values)
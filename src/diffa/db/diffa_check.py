@@ -1,30 +1,57 @@
-from datetime import date
-from typing import Optional, List, Iterable
+import csv
+import io
+from datetime import date, datetime
+from itertools import batched
+from typing import Optional, List, Iterable, Tuple
 
-from sqlalchemy.sql.functions import now
+from sqlalchemy import and_, false, func, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
 
 from diffa.db.connect import DiffaConnection
-from diffa.config import DiffaConfig, ConfigManager, DIFFA_BEGIN_DATE
+from diffa.config import (
+    DiffaConfig,
+    ConfigManager,
+    DIFFA_BEGIN_DATE,
+    DEFAULT_GRANULARITY,
+)
 from diffa.db.data_models import (
     DiffaCheckSchema,
     DiffaCheck,
+    Granularity,
 )
 from diffa.utils import Logger
 
 logger = Logger(__name__)
 Base = declarative_base()
 
+DIFFA_CHECK_COLUMNS = tuple(DiffaCheckSchema.model_fields)
+DIFFA_CHECK_UPDATE_COLUMNS = (
+    "source_count",
+    "target_count",
+    "is_valid",
+    "diff_count",
+    "check_date",
+    "source_checksum",
+    "target_checksum",
+    "bucket_start",
+)
+# Nullable columns: their empty values are quoted by the CSV writer, but still NULLs
+DIFFA_CHECK_NULLABLE_COLUMNS = ("source_checksum", "target_checksum")
+STAGING_TABLE = "diffa_checks_staging"
+
 
 class DiffaCheckDatabase:
     """SQLAlchemy Database Adapter for Diffa state management"""
 
     def __init__(self, db_config: DiffaConfig):
         self.db_config = db_config
-        self.conn = DiffaConnection(self.db_config.get_db_config())
+        self.conn = DiffaConnection(
+            self.db_config.get_db_config(), self.db_config.get_pool_options()
+        )
 
-    def get_latest_check(
+    def get_check_state(
         self,
         source_database: str,
         source_schema: str,
@@ -32,70 +59,87 @@ class DiffaCheckDatabase:
         target_database: str,
         target_schema: str,
         target_table: str,
-    ) -> Optional[dict]:
-        """Get the latest invalid check. If not found, return None"""
-
-        with self.conn.db_session() as session:
-            diffa_check = (
-                session.query(DiffaCheck)
-                .filter(DiffaCheck.source_database == source_database)
-                .filter(DiffaCheck.source_schema == source_schema)
-                .filter(DiffaCheck.source_table == source_table)
-                .filter(DiffaCheck.target_database == target_database)
-                .filter(DiffaCheck.target_schema == target_schema)
-                .filter(DiffaCheck.target_table == target_table)
-                .order_by(DiffaCheck.check_date.desc())
-                .first()
+        granularity: str = DEFAULT_GRANULARITY,
+    ) -> Tuple[Optional[datetime], List[datetime]]:
+        """Get the start of the latest checked bucket (None if not found) and the starts
+        of the invalid buckets of the pair at the granularity, in a single round trip
+        """
+
+        pair_filter = and_(
+            DiffaCheck.source_database == source_database,
+            DiffaCheck.source_schema == source_schema,
+            DiffaCheck.source_table == source_table,
+            DiffaCheck.target_database == target_database,
+            DiffaCheck.target_schema == target_schema,
+            DiffaCheck.target_table == target_table,
+            DiffaCheck.granularity == granularity,
+        )
+        latest_check_date = (
+            select(func.max(DiffaCheck.bucket_start))
+            .where(pair_filter)
+            .scalar_subquery()
+        )
+        invalid_check_dates = (
+            select(
+                func.array_agg(
+                    aggregate_order_by(DiffaCheck.bucket_start, DiffaCheck.bucket_start)
+                )
             )
-        return (
-            DiffaCheckSchema.model_validate(diffa_check).model_dump()
-            if diffa_check
-            else None
+            .where(pair_filter, DiffaCheck.is_valid == false())
+            .scalar_subquery()
         )
 
-    def get_invalid_checks(
-        self,
-        source_database: str,
-        source_schema: str,
-        source_table: str,
-        target_database: str,
-        target_schema: str,
-        target_table: str,
-    ) -> List[DiffaCheckSchema]:
-
         with self.conn.db_session() as session:
-            invalid_checks = (
-                session.query(DiffaCheck)
-                .filter(DiffaCheck.source_database == source_database)
-                .filter(DiffaCheck.source_schema == source_schema)
-                .filter(DiffaCheck.source_table == source_table)
-                .filter(DiffaCheck.target_database == target_database)
-                .filter(DiffaCheck.target_schema == target_schema)
-                .filter(DiffaCheck.target_table == target_table)
-                .filter(DiffaCheck.is_valid == False)
-                .all()
-            )
-        for invalid_check in invalid_checks:
-            yield DiffaCheckSchema.model_validate(invalid_check).model_dump()
+            row = session.execute(
+                select(
+                    latest_check_date.label("latest_check_date"),
+                    invalid_check_dates.label("invalid_check_dates"),
+                )
+            ).one()
+        return row.latest_check_date, row.invalid_check_dates or []
 
-    def upsert_diffa_checks(self, diffa_checks: Iterable[dict]):
-        """Save a diff record"""
+    def upsert_diffa_checks(self, diffa_checks: Iterable[dict]) -> int:
+        """Save the diff records in chunks: each chunk is COPY-ed into a staging table,
+        merged into the checks table with a single INSERT ... ON CONFLICT and committed.
+        Returns the number of saved records.
+        """
 
+        upserted = 0
         with self.conn.db_session() as session:
-            with session.begin():
-                stmt = insert(DiffaCheck).values(diffa_checks)
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=[DiffaCheck.id],
-                    set_={
-                        "source_count": stmt.excluded.source_count,
-                        "target_count": stmt.excluded.target_count,
-                        "is_valid": stmt.excluded.is_valid,
-                        "diff_count": stmt.excluded.diff_count,
-                        "check_date": stmt.excluded.check_date,
-                        "updated_at": now(),
-                    },
-                )
-                session.execute(stmt)
+            for chunk in batched(diffa_checks, self.db_config.get_upsert_chunk_size()):
+                with session.begin():
+                    self._copy_upsert(session, chunk)
+                upserted += len(chunk)
+        return upserted
+
+    def _copy_upsert(self, session: Session, diffa_checks: Tuple[dict, ...]):
+        table = f"{DiffaCheck.metadata.schema}.{DiffaCheck.__tablename__}"
+        columns = ", ".join(DIFFA_CHECK_COLUMNS)
+        updates = ", ".join(
+            f"{column} = EXCLUDED.{column}" for column in DIFFA_CHECK_UPDATE_COLUMNS
+        )
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for diffa_check in diffa_checks:
+            writer.writerow([diffa_check[column] for column in DIFFA_CHECK_COLUMNS])
+        buffer.seek(0)
+
+        with session.connection().connection.cursor() as cursor:
+            # Rows of the staging table only live until the end of the transaction
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+                f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            cursor.copy_expert(
+                f"COPY {STAGING_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv, "
+                f"FORCE_NULL ({', '.join(DIFFA_CHECK_NULLABLE_COLUMNS)}))",
+                buffer,
+            )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {STAGING_TABLE} "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}, updated_at = now()"
+            )
 
 
 class DiffaCheckService:
@@ -104,64 +148,55 @@ class DiffaCheckService:
         self.config_manager = config_manager
         self.diffa_db = DiffaCheckDatabase(self.config_manager.diffa_check)
         self.is_full_diff = self.config_manager.diffa_check.is_full_diff()
+        self.granularity = Granularity(self.config_manager.source.get_granularity())
 
-    def get_last_check_date(self) -> date:
+    def get_check_state(self) -> Tuple[date, Optional[List[date]]]:
+        """Get the last check date (for the backfill mechanism) and
+        the invalid check dates (for the re-check mechanism), as buckets of the
+        pair's granularity (datetimes for hours, dates otherwise)
+        """
 
-        latest_check = self.diffa_db.get_latest_check(
+        latest_check_date, invalid_check_dates = self.diffa_db.get_check_state(
             source_database=self.config_manager.source.get_db_name(),
             source_schema=self.config_manager.source.get_db_schema(),
             source_table=self.config_manager.source.get_db_table(),
             target_database=self.config_manager.target.get_db_name(),
             target_schema=self.config_manager.target.get_db_schema(),
             target_table=self.config_manager.target.get_db_table(),
+            granularity=self.granularity.name,
         )
+        begin_date = self.granularity.truncate(DIFFA_BEGIN_DATE)
 
-        if not self.is_full_diff:
-            check_date = (
-                latest_check["check_date"] if latest_check else DIFFA_BEGIN_DATE
-            )
-            logger.info(f"Last check date: {check_date}")
-        else:
-            check_date = DIFFA_BEGIN_DATE
+        if self.is_full_diff:
             logger.info(
-                f"Full diff mode is enabled. Checking from the beginning. Last check date: {check_date}"
+                f"Full diff mode is enabled. Checking from the beginning. Last check date: {begin_date}"
             )
+            return begin_date, None
 
-        return check_date
-
-    def get_invalid_check_dates(self) -> Iterable[date]:
-
-        invalid_checks = self.diffa_db.get_invalid_checks(
-            source_database=self.config_manager.source.get_db_name(),
-            source_schema=self.config_manager.source.get_db_schema(),
-            source_table=self.config_manager.source.get_db_table(),
-            target_database=self.config_manager.target.get_db_name(),
-            target_schema=self.config_manager.target.get_db_schema(),
-            target_table=self.config_manager.target.get_db_table(),
+        check_date = (
+            self.granularity.truncate(latest_check_date)
+            if latest_check_date
+            else begin_date
         )
-
         invalid_check_dates = [
-            invalid_check["check_date"] for invalid_check in invalid_checks
+            self.granularity.truncate(bucket_start)
+            for bucket_start in invalid_check_dates
         ]
-        if self.is_full_diff:
-            return None
-        elif len(invalid_check_dates) > 0:
+        logger.info(f"Last check date: {check_date}")
+        if len(invalid_check_dates) > 0:
             logger.info(
                 f"The number of invalid check dates is: {len(invalid_check_dates)}"
             )
-            return invalid_check_dates
+            return check_date, invalid_check_dates
         else:
             logger.info("No invalid check dates found")
-            return None
+            return check_date, None
 
-    def save_diffa_checks(self, merged_count_check_schemas: Iterable[DiffaCheckSchema]):
-        """Upsert all the merged count checks to the diffa database"""
+    def save_diffa_checks(self, diffa_checks: Iterable[dict]):
+        """Upsert all the diffa check records (built by DiffaCheckFactory) to the diffa database"""
 
-        diffa_checks = [
-            diffa_check.model_dump() for diffa_check in merged_count_check_schemas
-        ]
-        if len(diffa_checks) > 0:
-            self.diffa_db.upsert_diffa_checks(diffa_checks)
-            logger.info(f"Upserted {len(diffa_checks)} records successfully!")
+        upserted = self.diffa_db.upsert_diffa_checks(diffa_checks)
+        if upserted > 0:
+            logger.info(f"Upserted {upserted} records successfully!")
         else:
             logger.info("No records to upsert")
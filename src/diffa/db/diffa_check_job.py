@@ -0,0 +1,170 @@
+from typing import Iterable, List, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.sql.functions import now
+from sqlalchemy.dialects.postgresql import insert
+
+from diffa.db.connect import DiffaConnection
+from diffa.config import DiffaConfig, ConfigManager
+from diffa.db.data_models import DiffaCheckJob, DiffaCheckJobSchema
+from diffa.utils import Logger
+
+logger = Logger(__name__)
+
+
+class DiffaCheckJobDatabase:
+    """SQLAlchemy Database Adapter for the distributed check queue"""
+
+    def __init__(self, db_config: DiffaConfig):
+        self.db_config = db_config
+        self.conn = DiffaConnection(
+            self.db_config.get_db_config(), self.db_config.get_pool_options()
+        )
+
+    def insert_jobs(self, jobs: List[DiffaCheckJobSchema]):
+        with self.conn.db_session() as session:
+            with session.begin():
+                session.execute(
+                    insert(DiffaCheckJob).values(
+                        [
+                            job.model_dump(include={"job_id", "check_options", "status"})
+                            for job in jobs
+                        ]
+                    )
+                )
+
+    @staticmethod
+    def _is_stale(job_ttl: int):
+        return and_(
+            DiffaCheckJob.status == "RUNNING",
+            DiffaCheckJob.heartbeat_at < now() - func.make_interval(0, 0, 0, 0, 0, 0, job_ttl),
+        )
+
+    def claim_job(
+        self, worker_id: str, job_ttl: int, max_attempts: int
+    ) -> Optional[DiffaCheckJobSchema]:
+        """Claim the oldest PENDING job, or a RUNNING job whose worker stopped sending
+        heartbeats for `job_ttl` seconds. Jobs locked by other workers are skipped.
+        """
+
+        claimable_job_id = (
+            select(DiffaCheckJob.job_id)
+            .where(
+                or_(DiffaCheckJob.status == "PENDING", self._is_stale(job_ttl)),
+                DiffaCheckJob.attempts < max_attempts,
+            )
+            .order_by(DiffaCheckJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        with self.conn.db_session() as session:
+            with session.begin():
+                claimed_job = session.execute(
+                    update(DiffaCheckJob)
+                    .where(DiffaCheckJob.job_id == claimable_job_id)
+                    .values(
+                        status="RUNNING",
+                        worker_id=worker_id,
+                        attempts=DiffaCheckJob.attempts + 1,
+                        heartbeat_at=now(),
+                        updated_at=now(),
+                    )
+                    .returning(
+                        DiffaCheckJob.job_id,
+                        DiffaCheckJob.check_options,
+                        DiffaCheckJob.status,
+                        DiffaCheckJob.attempts,
+                        DiffaCheckJob.worker_id,
+                    )
+                ).one_or_none()
+        return DiffaCheckJobSchema(**claimed_job._mapping) if claimed_job else None
+
+    def fail_abandoned_jobs(self, job_ttl: int, max_attempts: int) -> int:
+        """Mark as FAILED the stale RUNNING jobs that used all their attempts"""
+
+        with self.conn.db_session() as session:
+            with session.begin():
+                return session.execute(
+                    update(DiffaCheckJob)
+                    .where(self._is_stale(job_ttl), DiffaCheckJob.attempts >= max_attempts)
+                    .values(
+                        status="FAILED",
+                        result="FAILED",
+                        error="The job was abandoned by its workers",
+                        updated_at=now(),
+                    )
+                ).rowcount
+
+    def heartbeat(self, job_id: str, worker_id: str):
+        """Keep the job alive, unless another worker reclaimed it meanwhile: the
+        heartbeats of a stale worker must not hide the death of the new one.
+        """
+
+        with self.conn.db_session() as session:
+            with session.begin():
+                session.execute(
+                    update(DiffaCheckJob)
+                    .where(
+                        DiffaCheckJob.job_id == job_id,
+                        DiffaCheckJob.worker_id == worker_id,
+                    )
+                    .values(heartbeat_at=now())
+                )
+
+    def finish_job(
+        self, job_id: str, worker_id: str, status: str, result: str, error: Optional[str]
+    ):
+        """Record the outcome of a job, unless another worker reclaimed it meanwhile"""
+
+        with self.conn.db_session() as session:
+            with session.begin():
+                session.execute(
+                    update(DiffaCheckJob)
+                    .where(
+                        DiffaCheckJob.job_id == job_id,
+                        DiffaCheckJob.worker_id == worker_id,
+                    )
+                    .values(status=status, result=result, error=error, updated_at=now())
+                )
+
+
+class DiffaCheckJobService:
+
+    def __init__(self, config_manager: ConfigManager):
+        self.config_manager = config_manager
+        self.diffa_check_job_db = DiffaCheckJobDatabase(config_manager.diffa_check_job)
+
+    def enqueue_checks(self, checks: Iterable[dict]) -> List[DiffaCheckJobSchema]:
+        """Add a PENDING job per check (the data-diff options of a pair)"""
+
+        jobs = [DiffaCheckJobSchema(check_options=check) for check in checks]
+        if jobs:
+            self.diffa_check_job_db.insert_jobs(jobs)
+        logger.info(f"Enqueued {len(jobs)} check jobs")
+        return jobs
+
+    def claim_next_job(
+        self, worker_id: str, job_ttl: int, max_attempts: int
+    ) -> Optional[DiffaCheckJobSchema]:
+        if abandoned := self.diffa_check_job_db.fail_abandoned_jobs(job_ttl, max_attempts):
+            logger.warning(f"Marked {abandoned} abandoned check jobs as FAILED")
+        job = self.diffa_check_job_db.claim_job(worker_id, job_ttl, max_attempts)
+        if job:
+            logger.info(f"Claimed check job {job.job_id} (attempt {job.attempts})")
+        return job
+
+    def heartbeat_job(self, job: DiffaCheckJobSchema):
+        self.diffa_check_job_db.heartbeat(job.job_id, job.worker_id)
+
+    def finish_job(
+        self, job: DiffaCheckJobSchema, result: str, error: Optional[str] = None
+    ):
+        """Mark the job as COMPLETED with its check result (VALID/INVALID), or FAILED"""
+
+        job.status = "FAILED" if result == "FAILED" else "COMPLETED"
+        job.result, job.error = result, error
+        self.diffa_check_job_db.finish_job(
+            job.job_id, job.worker_id, job.status, job.result, job.error
+        )
+        logger.info(f"Check job {job.job_id} marked as {job.status} ({result})")
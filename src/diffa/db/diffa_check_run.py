@@ -1,91 +1,185 @@
-from typing import List
-from contextlib import contextmanager
+import hashlib
+from dataclasses import asdict
+from typing import List, Optional
 
-from sqlalchemy import update
+from sqlalchemy import and_, func, select, update
 from sqlalchemy.sql.functions import now
-from sqlalchemy.sql import text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
 
 from diffa.db.connect import DiffaConnection
 from diffa.config import DBConfig, ConfigManager
 from diffa.db.data_models import (
     DiffaCheckRunSchema,
     DiffaCheckRun,
+    DiffaCheckRunTiming,
 )
-from diffa.utils import Logger
+from diffa.timings import PhaseTiming
+from diffa.utils import Logger, RunningCheckRunsException
 
 logger = Logger(__name__)
 Base = declarative_base()
 
+PAIR_IDENTITY_COLUMNS = (
+    "source_database",
+    "source_schema",
+    "source_table",
+    "target_database",
+    "target_schema",
+    "target_table",
+)
+
 
 class DiffaCheckRunDatabase:
     """SQLAlchemy Database Adapter for Diffa running state management"""
 
     def __init__(self, db_config: DBConfig):
         self.db_config = db_config
-        self.conn = DiffaConnection(self.db_config.get_db_config())
+        self.conn = DiffaConnection(
+            self.db_config.get_db_config(), self.db_config.get_pool_options()
+        )
 
-    @contextmanager
-    def acquire_exclusive_lock(self, session):
-        """Aquire an exclusive lock on the diffa_check_run table"""
+    @staticmethod
+    def get_pair_lock_key(diffa_check_run_schema: DiffaCheckRunSchema) -> int:
+        """Advisory lock key (signed 64-bit) of the source/target pair of a check run"""
 
-        session.execute(
-            text(
-                f"LOCK TABLE {self.db_config.get_db_schema()}.{self.db_config.get_db_table()} IN EXCLUSIVE MODE;"
-            )
+        pair_identity = "\x1f".join(
+            getattr(diffa_check_run_schema, column) for column in PAIR_IDENTITY_COLUMNS
+        )
+        return int.from_bytes(
+            hashlib.blake2b(pair_identity.encode("utf-8"), digest_size=8).digest(),
+            byteorder="big",
+            signed=True,
         )
-        yield
+
+    def _try_acquire_pair_lock(self, session: Session, lock_key: int) -> bool:
+        """Try to take the transaction-level advisory lock of a pair, without waiting"""
+
+        return session.execute(
+            select(func.pg_try_advisory_xact_lock(lock_key))
+        ).scalar_one()
+
+    @staticmethod
+    def _is_pair_running(diffa_check_run_schema: DiffaCheckRunSchema):
+        return and_(
+            *(
+                getattr(DiffaCheckRun, column) == getattr(diffa_check_run_schema, column)
+                for column in PAIR_IDENTITY_COLUMNS
+            ),
+            DiffaCheckRun.status == "RUNNING",
+        )
+
+    def _reclaim_stale_runs(
+        self, session: Session, diffa_check_run_schema: DiffaCheckRunSchema, run_ttl: int
+    ) -> List[str]:
+        """Mark as FAILED the RUNNING runs of the pair without heartbeat for `run_ttl` seconds"""
+
+        return [
+            str(run_id)
+            for run_id in session.execute(
+                update(DiffaCheckRun)
+                .where(
+                    self._is_pair_running(diffa_check_run_schema),
+                    DiffaCheckRun.heartbeat_at
+                    < now() - func.make_interval(0, 0, 0, 0, 0, 0, run_ttl),
+                )
+                .values(status="FAILED", updated_at=now())
+                .returning(DiffaCheckRun.run_id)
+            ).scalars()
+        ]
+
+    def _get_running_run_ids(
+        self, session: Session, diffa_check_run_schema: DiffaCheckRunSchema
+    ) -> List[str]:
+        return [
+            str(run_id)
+            for run_id in session.execute(
+                select(DiffaCheckRun.run_id).where(
+                    self._is_pair_running(diffa_check_run_schema)
+                )
+            ).scalars()
+        ]
+
+    def _insert_run(self, session: Session, diffa_check_run_schema: DiffaCheckRunSchema):
+        session.execute(insert(DiffaCheckRun).values(diffa_check_run_schema.model_dump()))
 
     def create_diffa_check_run_record(
-        self, diffa_check_run_schema: DiffaCheckRunSchema
-    ):
-        """Create a new diffa check run record"""
+        self, diffa_check_run_schema: DiffaCheckRunSchema, run_ttl: Optional[int] = None
+    ) -> List[str]:
+        """Create a new diffa check run record, unless the pair already has a RUNNING run.
+
+        Runs of a pair are serialized by an advisory lock keyed by the pair, held until
+        the record is committed. Runs of other pairs are not blocked. With a `run_ttl`,
+        the RUNNING runs of the pair whose heartbeat is older are taken over first: they
+        are marked as FAILED, and their ids returned.
+        """
+
         with self.conn.db_session() as session:
             with session.begin():
-                with self.acquire_exclusive_lock(session):
-                    session.execute(
-                        insert(DiffaCheckRun).values(
-                            diffa_check_run_schema.model_dump()
-                        )
+                if not self._try_acquire_pair_lock(
+                    session, self.get_pair_lock_key(diffa_check_run_schema)
+                ):
+                    raise RunningCheckRunsException(
+                        [], "Another check run of the pair is starting."
                     )
+                reclaimed_run_ids = (
+                    self._reclaim_stale_runs(session, diffa_check_run_schema, run_ttl)
+                    if run_ttl is not None
+                    else []
+                )
+                running_run_ids = self._get_running_run_ids(
+                    session, diffa_check_run_schema
+                )
+                if running_run_ids:
+                    raise RunningCheckRunsException(
+                        running_run_ids, "There are other RUNNING checks"
+                    )
+                self._insert_run(session, diffa_check_run_schema)
+        return reclaimed_run_ids
 
-    def get_running_check_runs(
-        self,
-        source_database: str,
-        source_schema: str,
-        source_table: str,
-        target_database: str,
-        target_schema: str,
-        target_table: str,
-    ) -> List[DiffaCheckRunSchema]:
-
+    def heartbeat(self, run_id: str) -> bool:
+        """Record a heartbeat of a RUNNING run. Return False if the run is not RUNNING
+        anymore, e.g. it was taken over by another run of the pair.
+        """
         with self.conn.db_session() as session:
-            running_check_runs = (
-                session.query(DiffaCheckRun)
-                .filter(DiffaCheckRun.source_database == source_database)
-                .filter(DiffaCheckRun.source_schema == source_schema)
-                .filter(DiffaCheckRun.source_table == source_table)
-                .filter(DiffaCheckRun.target_database == target_database)
-                .filter(DiffaCheckRun.target_schema == target_schema)
-                .filter(DiffaCheckRun.target_table == target_table)
-                .filter(DiffaCheckRun.status == "RUNNING")
-                .all()
-            )
-
-        for running_check_run in running_check_runs:
-            yield DiffaCheckRunSchema.model_validate(running_check_run)
+            with session.begin():
+                return bool(
+                    session.execute(
+                        update(DiffaCheckRun)
+                        .where(
+                            DiffaCheckRun.run_id == run_id,
+                            DiffaCheckRun.status == "RUNNING",
+                        )
+                        .values(heartbeat_at=now())
+                    ).rowcount
+                )
 
-    def update_diffa_check_run_record_with_status(self, run_id: str, status: str):
-        """Update a diffa check run record"""
+    def insert_timings(self, run_id: str, timings: List[PhaseTiming]):
         with self.conn.db_session() as session:
             with session.begin():
-                with self.acquire_exclusive_lock(session):
+                session.execute(
+                    insert(DiffaCheckRunTiming)
+                    .values([{"run_id": run_id, **asdict(timing)} for timing in timings])
+                    .on_conflict_do_nothing()
+                )
+
+    def update_diffa_check_run_record_with_status(self, run_id: str, status: str) -> bool:
+        """Set the final status of a RUNNING run. Return False if the run is not RUNNING
+        anymore: the status of a run taken over by another run is left as is.
+        """
+        with self.conn.db_session() as session:
+            with session.begin():
+                return bool(
                     session.execute(
                         update(DiffaCheckRun)
-                        .where(DiffaCheckRun.run_id == run_id)
+                        .where(
+                            DiffaCheckRun.run_id == run_id,
+                            DiffaCheckRun.status == "RUNNING",
+                        )
                         .values(status=status, updated_at=now())
-                    )
+                    ).rowcount
+                )
 
 
 class DiffaCheckRunService:
@@ -94,36 +188,55 @@ class DiffaCheckRunService:
         self.config_manager = config_manager
         self.diffa_check_run_db = DiffaCheckRunDatabase(config_manager.diffa_check_run)
 
-    def getting_running_check_runs(self) -> list[str]:
-        """Check if there are any running check runs. Return all run_ids of RUNNING check runs."""
-
-        running_check_run_ids = []
+    def create_new_check_run(self, diffa_check_run_schema: DiffaCheckRunSchema):
+        """Create a new check run. Raise RunningCheckRunsException if the pair is already running"""
 
-        checking_runs = self.diffa_check_run_db.get_running_check_runs(
-            source_database=self.config_manager.source.get_db_name(),
-            source_schema=self.config_manager.source.get_db_schema(),
-            source_table=self.config_manager.source.get_db_table(),
-            target_database=self.config_manager.target.get_db_name(),
-            target_schema=self.config_manager.target.get_db_schema(),
-            target_table=self.config_manager.target.get_db_table(),
+        reclaimed_run_ids = self.diffa_check_run_db.create_diffa_check_run_record(
+            diffa_check_run_schema, self.config_manager.diffa_check_run.get_run_ttl()
         )
-        for running_check_run in checking_runs:
-            running_check_run_ids.append(str(running_check_run.run_id))
-
-        return running_check_run_ids
+        if reclaimed_run_ids:
+            logger.warning(
+                f"Marked stale check runs as FAILED: {', '.join(reclaimed_run_ids)}"
+            )
+        logger.info(f"Created new check run with id: {diffa_check_run_schema.run_id}")
 
-    def create_new_check_run(self, diffa_check_run_schema: DiffaCheckRunSchema):
-        """Create a new check run"""
+    def heartbeat_check_run(self, diffa_check_run_schema: DiffaCheckRunSchema) -> bool:
+        """Record a heartbeat of the run. Return False if it was taken over"""
 
-        self.diffa_check_run_db.create_diffa_check_run_record(diffa_check_run_schema)
-        logger.info(f"Created new check run with id: {diffa_check_run_schema.run_id}")
+        if not self.diffa_check_run_db.heartbeat(diffa_check_run_schema.run_id):
+            logger.warning(
+                f"Check run {diffa_check_run_schema.run_id} is not RUNNING anymore, it was taken over by another run"
+            )
+            return False
+        return True
 
     def update_check_run_as_status(
         self, diffa_check_run_schema: DiffaCheckRunSchema, status: str
-    ):
-        """Mark a check run as completed"""
+    ) -> bool:
+        """Set the final status of a check run. Return False if it was taken over"""
 
-        diffa_check_run_schema.status = status
-        self.diffa_check_run_db.update_diffa_check_run_record_with_status(
+        if not self.diffa_check_run_db.update_diffa_check_run_record_with_status(
             diffa_check_run_schema.run_id, status
-        )
+        ):
+            logger.warning(
+                f"Check run {diffa_check_run_schema.run_id} was taken over by another run, its status is left as is"
+            )
+            return False
+        diffa_check_run_schema.status = status
+        return True
+
+    def save_check_run_timings(
+        self, diffa_check_run_schema: DiffaCheckRunSchema, timings: List[PhaseTiming]
+    ):
+        """Save the phase timings of a check run. Timings are not critical: a failure
+        is only logged.
+        """
+
+        if not timings:
+            return
+        try:
+            self.diffa_check_run_db.insert_timings(diffa_check_run_schema.run_id, timings)
+        except Exception as e:
+            logger.warning(
+                f"Failed to save the timings of the check run {diffa_check_run_schema.run_id}: {e}"
+            )
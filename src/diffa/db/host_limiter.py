@@ -0,0 +1,109 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from diffa.config import SourceConfig
+from diffa.utils import Logger
+
+logger = Logger(__name__)
+
+HOST_BUSY_POLL_SECONDS = 5  # Delay between two load checks of a busy host
+HOST_BUSY_MAX_WAIT_SECONDS = 300  # Queries go ahead after waiting this long
+HOST_LOAD_SQL = """
+    SELECT
+        (
+            SELECT COUNT(*)
+            FROM pg_stat_activity
+            WHERE state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()
+        ) AS active_queries,
+        CASE WHEN pg_is_in_recovery()
+            THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            ELSE 0
+        END AS replica_lag
+"""
+
+
+class HostLimiter:
+    """Limits the load put on a database host (host, port) by all the checks and shards
+    of the process: at most `max_concurrency` concurrent round trips (statement executions
+    and fetches), and optionally no new query while the host has too many active queries
+    or its replica lag is too high.
+
+    The slots are not held between two fetches, so the open server-side cursors of a host
+    are not capped: a stream holding its slot would deadlock a consumer merging two
+    streams of the same host.
+    """
+
+    _limiters: Dict[Tuple[str, int], "HostLimiter"] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, host: str, port: int, max_concurrency: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.semaphore = (
+            threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        )
+
+    @classmethod
+    def for_db_config(cls, db_config: SourceConfig) -> "HostLimiter":
+        """Get the limiter of the host of the DB. The first config of a host sets its
+        concurrency limit.
+        """
+
+        db_info = db_config.get_db_config()
+        host_key = (db_info["host"], db_info["port"])
+        with cls._lock:
+            if host_key not in cls._limiters:
+                cls._limiters[host_key] = cls(
+                    *host_key, max_concurrency=db_config.get_max_host_concurrency()
+                )
+            return cls._limiters[host_key]
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the concurrent round-trip slots of the host"""
+
+        if self.semaphore is None:
+            yield
+            return
+        with self.semaphore:
+            yield
+
+    def wait_until_not_busy(
+        self,
+        conn,
+        max_active_queries: Optional[int] = None,
+        max_replica_lag: Optional[float] = None,
+    ):
+        """Delay a new query while the host is busy, up to HOST_BUSY_MAX_WAIT_SECONDS"""
+
+        if max_active_queries is None and max_replica_lag is None:
+            return
+
+        started_at = time.monotonic()
+        while True:
+            with self.slot(), conn.cursor() as cursor:
+                cursor.execute(HOST_LOAD_SQL)
+                active_queries, replica_lag = cursor.fetchone()
+
+            busy_reasons = []
+            if max_active_queries is not None and active_queries > max_active_queries:
+                busy_reasons.append(f"{active_queries} active queries")
+            if max_replica_lag is not None and replica_lag > max_replica_lag:
+                busy_reasons.append(f"{replica_lag:.0f}s of replica lag")
+            if not busy_reasons:
+                return
+
+            waited = time.monotonic() - started_at
+            if waited >= HOST_BUSY_MAX_WAIT_SECONDS:
+                logger.warning(
+                    f"{self.host}:{self.port} is still busy ({', '.join(busy_reasons)}) "
+                    f"after {waited:.0f}s. Running the query anyway."
+                )
+                return
+            logger.info(
+                f"{self.host}:{self.port} is busy ({', '.join(busy_reasons)}). "
+                f"Delaying the query by {HOST_BUSY_POLL_SECONDS}s..."
+            )
+            time.sleep(HOST_BUSY_POLL_SECONDS)
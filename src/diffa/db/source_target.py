@@ -1,56 +1,406 @@
-from datetime import date
-from typing import List, Iterable, Optional
+import time
+import uuid
+import queue
+import threading
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, time as datetime_time, timedelta
+from typing import Any, Callable, List, Iterable, Iterator, NamedTuple, Optional, Tuple
 from functools import partial
+from itertools import islice, starmap
 
-import psycopg2.extras
+import psycopg2
 
-from diffa.utils import Logger
-from diffa.db.connect import PostgresConnection
-from diffa.config import SourceConfig
-from diffa.db.data_models import CountCheck
+from diffa.utils import DiffaException, Logger
+from diffa.db.connect import PostgresConnectionRegistry
+from diffa.db.host_limiter import HostLimiter
+from diffa.config import SourceConfig, SHARD_SIZES
+from diffa.db.data_models import CountCheck, Granularity, KeySegment, ShardTiming
 from diffa.config import ConfigManager
+from diffa.timings import PhaseTimer, QueryStats
 
 logger = Logger(__name__)
 
+ROW_STREAM_BATCH_SIZE = 1000  # Rows handed over to the consumer at once
+ROW_STREAM_MAX_BATCHES = 8  # Batches buffered per stream before the producer blocks
+_END_OF_ROWS = object()
+INLINE_DATE_RANGES_LIMIT = 20  # Above this, date ranges are passed as array parameters
+CATCHUP_END_SQL = "CURRENT_DATE - INTERVAL '1 DAY'"  # Exclusive, i.e up to 2 days ago
+SHARD_MAX_ATTEMPTS = 2  # A shard is retried once, e.g on a statement timeout
+# Signed 64-bit hash of a row: the first 16 hex digits of the MD5 of its text (stable
+# across hosts and Postgres versions, unlike hashtext)
+ROW_HASH_SQL = "('x' || LEFT(MD5(ROW({columns})::TEXT), 16))::BIT(64)::BIGINT"
+# SUM(BIGINT) is a NUMERIC, wrapped back into the signed 64-bit range (see wrap_checksum)
+WRAPPED_SUM_SQL = (
+    "(MOD(MOD(SUM({expression}) + 9223372036854775808, 18446744073709551616)"
+    " + 18446744073709551616, 18446744073709551616) - 9223372036854775808)::BIGINT"
+)
+
+
+class BucketSql(NamedTuple):
+    """SQL of the time buckets of a granularity"""
+
+    bucket: str  # Bucket of a row, from its partition column
+    sql_type: str  # Type of the buckets
+    interval: str  # Size of a bucket
+    catchup_end: str  # Exclusive, i.e the current and previous buckets are left out
+
+
+BUCKET_SQLS = {
+    "hour": BucketSql(
+        "DATE_TRUNC('hour', {column})::TIMESTAMP",
+        "TIMESTAMP",
+        "INTERVAL '1 HOUR'",
+        "DATE_TRUNC('hour', LOCALTIMESTAMP) - INTERVAL '1 HOUR'",
+    ),
+    "day": BucketSql("{column}::DATE", "DATE", "INTERVAL '1 DAY'", CATCHUP_END_SQL),
+    "week": BucketSql(
+        "DATE_TRUNC('week', {column})::DATE",
+        "DATE",
+        "INTERVAL '1 WEEK'",
+        "DATE_TRUNC('week', CURRENT_DATE) - INTERVAL '1 WEEK'",
+    ),
+    "month": BucketSql(
+        "DATE_TRUNC('month', {column})::DATE",
+        "DATE",
+        "INTERVAL '1 MONTH'",
+        "DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '1 MONTH'",
+    ),
+}
+
+
+class _RowStreamError:
+    """Wrap an exception raised by the producer so it can be re-raised by the consumer"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class RowStream:
+    """Run a row producer (e.g. a count query) in its own worker thread.
+
+    Rows are handed over to the consumer in batches through a bounded queue, so the
+    producer can run ahead of the consumer without buffering the whole result set.
+    Errors raised by the producer are re-raised when the consumer reaches them.
+
+    A started stream must be closed (or used as a context manager), even if it is never
+    consumed: otherwise its producer blocks on the full queue and holds its connection.
+    """
+
+    def __init__(
+        self,
+        producer: Callable[[], Iterable[Any]],
+        name: str = "row-stream",
+        batch_size: int = ROW_STREAM_BATCH_SIZE,
+        max_batches: int = ROW_STREAM_MAX_BATCHES,
+    ):
+        self.producer = producer
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name=name, daemon=True)
+
+    def start(self) -> "RowStream":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Tell the producer to give up, e.g. when the consumer stops early"""
+        self._stopped.set()
+
+    def close(self):
+        """Stop the producer and wait for it to release its rows (and connection).
+        A query already running on the DB is waited for.
+        """
+
+        self.stop()
+        if self._thread.ident is None:
+            return
+        while self._thread.is_alive():
+            self._drain()
+            self._thread.join(timeout=0.1)
+        self._drain()
+
+    def _drain(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __enter__(self) -> "RowStream":
+        if self._thread.ident is None:
+            self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        rows = None
+        try:
+            rows = iter(self.producer())
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    if not self._put(batch):
+                        return
+                    batch = []
+            if batch and not self._put(batch):
+                return
+            self._put(_END_OF_ROWS)
+        except BaseException as e:
+            self._put(_RowStreamError(e))
+        finally:
+            # Release the query's cursor and connection right away when stopped early
+            if hasattr(rows, "close"):
+                rows.close()
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END_OF_ROWS:
+                    return
+                if isinstance(item, _RowStreamError):
+                    raise item.error
+                yield from item
+        finally:
+            self.stop()
+
 
 class SourceTargetDatabase:
     """Base class for the Source Target DB handling"""
 
     def __init__(self, db_config: SourceConfig) -> None:
         self.db_config = db_config
-        self.conn = PostgresConnection(self.db_config.get_db_config())
+        self.query_stats = QueryStats()
+
+    @contextmanager
+    def _checkout_connection(self):
+        # Idle connections are shared per DSN, one is checked out by each query
+        with PostgresConnectionRegistry.checkout(self.db_config.get_db_config()) as conn:
+            yield conn
+
+    def close(self):
+        """Close all the idle connections"""
+        PostgresConnectionRegistry.close_idle(self.db_config.get_db_config()["db_uri"])
+
+    def _execute_query(
+        self,
+        query: str,
+        sql_params: Optional[dict] = None,
+        server_side_cursor: Optional[bool] = None,
+    ):
+        """Run the query within the limits of its DB host: the statement and each fetch
+        hold one of the host's slots, and new queries wait while the host is busy.
+        Rows are yielded outside of the slots, so a slow consumer never holds one, and an
+        open server-side cursor holds none between two fetches.
+        The cursor mode of the config can be overridden with `server_side_cursor`.
+        """
+
+        if server_side_cursor is None:
+            server_side_cursor = self.db_config.use_server_side_cursor()
+
+        host_limiter = HostLimiter.for_db_config(self.db_config)
+        with self._checkout_connection() as conn:
+            try:
+                host_limiter.wait_until_not_busy(
+                    conn.connect(),
+                    max_active_queries=self.db_config.get_max_host_active_queries(),
+                    max_replica_lag=self.db_config.get_max_replica_lag(),
+                )
+                if server_side_cursor:
+                    yield from self._stream_query(
+                        conn.connect(), query, sql_params, host_limiter
+                    )
+                else:
+                    with conn.connect().cursor() as cursor:
+                        with host_limiter.slot():
+                            started_at = time.perf_counter()
+                            cursor.execute(query, sql_params)
+                            self.query_stats.add_query(time.perf_counter() - started_at)
+                        # The rows are already on the client, no slot is needed
+                        yield from self._fetch_rows(cursor)
+            except Exception as e:
+                logger.info("Error encountered. Closing the DB connection...")
+                conn.close()
+                raise e
 
-    def _execute_query(self, query: str, sql_params: tuple = None):
+    def _stream_query(
+        self,
+        conn,
+        query: str,
+        sql_params: Optional[dict] = None,
+        host_limiter: Optional[HostLimiter] = None,
+    ):
+        """Stream the rows through a named (server-side) cursor, fetching them in
+        batches of `fetch_size` rows, so the client never holds the full result set.
+        """
 
-        conn = self.conn.connect()
+        host_limiter = host_limiter or HostLimiter.for_db_config(self.db_config)
+        # Named cursors only live inside a transaction, which autocommit mode never opens
+        conn.autocommit = False
         try:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            with conn.cursor(name=f"diffa_{uuid.uuid4().hex}") as cursor:
+                started_at = time.perf_counter()
                 cursor.execute(query, sql_params)
-                for row in cursor:
-                    yield row
-        except Exception as e:
-            logger.info("Error encountered. Closing the DB connection...")
-            conn.close()
-            raise e
+                self.query_stats.add_query(time.perf_counter() - started_at)
+                yield from self._fetch_rows(cursor, host_limiter)
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+    def _fetch_rows(self, cursor, host_limiter: Optional[HostLimiter] = None):
+        """Fetch the rows in batches of `fetch_size` rows, each fetch holding a slot of
+        the host (if given), and count them in the query stats
+        """
+
+        fetch_size = self.db_config.get_fetch_size()
+        while True:
+            with host_limiter.slot() if host_limiter else nullcontext():
+                started_at = time.perf_counter()
+                rows = cursor.fetchmany(fetch_size)
+                fetch_seconds = time.perf_counter() - started_at
+            if not rows:
+                break
+            self.query_stats.add_rows(rows, fetch_seconds)
+            yield from rows
+
+    def get_granularity(self) -> Granularity:
+        return Granularity(self.db_config.get_granularity())
+
+    def get_bucket_sql(self) -> BucketSql:
+        return BUCKET_SQLS[self.db_config.get_granularity()]
+
+    @staticmethod
+    def _coalesce_date_ranges(
+        check_dates: Iterable[date], granularity: Granularity = Granularity()
+    ) -> List[Tuple[date, date]]:
+        """Merge the given dates (buckets of the granularity) into sorted half-open
+        [start, end) ranges.
+        E.g [2024-01-01, 2024-01-02, 2024-01-05] => [(01-01, 01-03), (01-05, 01-06)]
+        """
+
+        date_ranges = []
+        for check_date in sorted(set(check_dates)):
+            if date_ranges and date_ranges[-1][1] == check_date:
+                date_ranges[-1] = (
+                    date_ranges[-1][0],
+                    granularity.get_next_bucket(check_date),
+                )
+            else:
+                date_ranges.append((check_date, granularity.get_next_bucket(check_date)))
+        return date_ranges
+
+    @staticmethod
+    def plan_date_ranges(
+        latest_check_date: date,
+        invalid_check_dates: Optional[List[date]],
+        granularity: Granularity = Granularity(),
+    ) -> List[Tuple[date, Optional[date]]]:
+        """Plan the half-open [start, end) date ranges to count.
+        Re-check ranges (invalid buckets) come first, then the catch-up range which
+        starts at the bucket after the latest check. Its end is None: it's bounded by
+        the catch-up end of the granularity (see BUCKET_SQLS).
+        """
+
+        catchup_start = granularity.get_next_bucket(latest_check_date)
+        date_ranges = SourceTargetDatabase._coalesce_date_ranges(
+            invalid_check_dates or [], granularity
+        )
+        if date_ranges and date_ranges[-1][1] >= catchup_start:
+            catchup_start = min(catchup_start, date_ranges.pop()[0])
+        return date_ranges + [(catchup_start, None)]
 
     def _build_count_query(
         self,
         latest_check_date: date,
         invalid_check_dates: List[date],
         diff_dimension_cols: Optional[List[str]] = None,
-    ):
-        backfill_where_clause = (
-            f" (created_at::DATE IN ({','.join([f"'{date}'" for date in invalid_check_dates])})) OR"
-            if invalid_check_dates
-            else ""
-        )
-        catchup_where_clause = f"""(
-            created_at::DATE > '{latest_check_date}'
-            AND 
-            created_at::DATE <= CURRENT_DATE - INTERVAL '2 DAY' 
+        checksum_cols: Optional[List[str]] = None,
+    ) -> Tuple[str, dict]:
+        return self._build_date_ranges_count_query(
+            self.plan_date_ranges(
+                latest_check_date, invalid_check_dates, self.get_granularity()
+            ),
+            diff_dimension_cols,
+            checksum_cols,
         )
+
+    def _build_date_ranges_count_query(
+        self,
+        date_ranges: List[Tuple[date, Optional[date]]],
+        diff_dimension_cols: Optional[List[str]] = None,
+        checksum_cols: Optional[List[str]] = None,
+    ) -> Tuple[str, dict]:
+        """Build the count query and its parameters.
+
+        Rows are counted by bucket of their partition column (e.g `created_at::DATE`
+        for days), but filtered with half-open ranges on the raw column so Postgres can
+        use btree indexes and partition pruning.
+
+        With checksum columns, each group also sums a hash of the rows' checksum
+        columns, in the same scan. The sum doesn't depend on the rows order, so both
+        sides compare equal as long as they hold the same rows.
         """
+
+        partition_col = self.db_config.get_partition_col()
+        bucket_sql = self.get_bucket_sql()
+        bucket_clause = bucket_sql.bucket.format(column=partition_col)
+        bounded_ranges = [date_range for date_range in date_ranges if date_range[1]]
+        catchup_starts = [start for start, end in date_ranges if end is None]
+        sql_params = {"catchup_start": catchup_starts[0]} if catchup_starts else {}
+
+        if len(bounded_ranges) <= INLINE_DATE_RANGES_LIMIT:
+            range_predicates = []
+            for i, (range_start, range_end) in enumerate(bounded_ranges):
+                range_predicates.append(
+                    f"({partition_col} >= %(range_start_{i})s AND {partition_col} < %(range_end_{i})s)"
+                )
+                sql_params[f"range_start_{i}"] = range_start
+                sql_params[f"range_end_{i}"] = range_end
+            if catchup_starts:
+                range_predicates.append(
+                    f"({partition_col} >= %(catchup_start)s AND {partition_col} < {bucket_sql.catchup_end})"
+                )
+            where_clause = "\n                OR ".join(range_predicates)
+            filtered_table_clause = f"""{self.db_config.get_db_schema()}.{self.db_config.get_db_table()}
+            WHERE
+                {where_clause}"""
+        else:
+            # Too many ranges to inline: pass them as array parameters and join on them
+            sql_params["range_starts"] = [range_start for range_start, _ in bounded_ranges]
+            sql_params["range_ends"] = [range_end for _, range_end in bounded_ranges]
+            catchup_range_clause = (
+                f"""
+                UNION ALL
+                SELECT %(catchup_start)s::{bucket_sql.sql_type}, ({bucket_sql.catchup_end})::{bucket_sql.sql_type}"""
+                if catchup_starts
+                else ""
+            )
+            filtered_table_clause = f"""(
+                SELECT * FROM UNNEST(%(range_starts)s::{bucket_sql.sql_type}[], %(range_ends)s::{bucket_sql.sql_type}[]){catchup_range_clause}
+            ) AS diffa_check_ranges (range_start, range_end)
+            JOIN {self.db_config.get_db_schema()}.{self.db_config.get_db_table()}
+                ON {partition_col} >= diffa_check_ranges.range_start
+                AND {partition_col} < diffa_check_ranges.range_end"""
+
+        # Columns are selected in the CountCheck field order:
+        # (cnt, check_date, *sorted dimensions[, checksum])
+        diff_dimension_cols = sorted(diff_dimension_cols or [])
         group_by_diff_dimensions_clause = (
             f", {','.join(diff_dimension_cols)}" if diff_dimension_cols else ""
         )
@@ -59,83 +409,354 @@ class SourceTargetDatabase:
             if diff_dimension_cols
             else ""
         )
+        # Bytewise ordering, so the merge-join can compare the dimensions as Python strings
+        order_by_diff_dimensions = [f'{col}::text COLLATE "C"' for col in diff_dimension_cols]
+        order_by_diff_dimensions_clause = (
+            f", {','.join(order_by_diff_dimensions)}" if diff_dimension_cols else ""
+        )
+        select_checksum_clause = (
+            ", "
+            + WRAPPED_SUM_SQL.format(
+                expression=ROW_HASH_SQL.format(columns=", ".join(checksum_cols))
+            )
+            + " AS checksum"
+            if checksum_cols
+            else ""
+        )
 
         return f"""
-            SELECT 
-                created_at::DATE as check_date,
-                COUNT(*) AS cnt
+            SELECT
+                COUNT(*) AS cnt,
+                {bucket_clause} as check_date
                 {select_diff_dimensions_clause}
-            FROM {self.db_config.get_db_schema()}.{self.db_config.get_db_table()}
-            WHERE
-                {backfill_where_clause}
-                {catchup_where_clause}
-            GROUP BY created_at::DATE 
+                {select_checksum_clause}
+            FROM {filtered_table_clause}
+            GROUP BY {bucket_clause}
                 {group_by_diff_dimensions_clause}
-            ORDER BY created_at::DATE ASC
-        """
+            ORDER BY {bucket_clause} ASC
+                {order_by_diff_dimensions_clause}
+        """, sql_params
 
     def count(self, latest_check_date: date, invalid_check_dates: List[date]):
 
-        if self.db_config.get_diff_dimension_cols():
-            count_query = self._build_count_query(
-                latest_check_date,
-                invalid_check_dates,
-                self.db_config.get_diff_dimension_cols(),
+        return self.count_date_ranges(
+            self.plan_date_ranges(
+                latest_check_date, invalid_check_dates, self.get_granularity()
             )
+        )
+
+    def count_date_ranges(self, date_ranges: List[Tuple[date, Optional[date]]]):
+
+        if self.db_config.get_diff_dimension_cols():
             logger.warning(
                 "Diff dimensions are enabled. May impact the performance of the query"
             )
-        else:
-            count_query = self._build_count_query(
-                latest_check_date, invalid_check_dates
+        count_query, sql_params = self._build_date_ranges_count_query(
+            date_ranges,
+            self.db_config.get_diff_dimension_cols(),
+            self.db_config.get_checksum_cols(),
+        )
+        logger.info(
+            f"Executing the count query on {self.db_config.get_db_scheme()}: {count_query} "
+            f"with params: {sql_params}"
+        )
+        return self._execute_query(count_query, sql_params)
+
+    def _build_key_segments_clause(
+        self, key_col: str, segments: List[KeySegment]
+    ) -> Tuple[str, dict]:
+        """Join the rows of the table to the key segments of a bucket holding them"""
+
+        sql_params = {
+            "segment_dates": [segment.check_date for segment in segments],
+            "segment_starts": [segment.key_start for segment in segments],
+            "segment_ends": [segment.key_end for segment in segments],
+        }
+        partition_col = self.db_config.get_partition_col()
+        bucket_sql = self.get_bucket_sql()
+        return f"""UNNEST(%(segment_dates)s::{bucket_sql.sql_type}[], %(segment_starts)s, %(segment_ends)s)
+                WITH ORDINALITY AS diffa_segments (
+                    diffa_segment_date, diffa_segment_start, diffa_segment_end, diffa_segment
+                )
+            JOIN {self.db_config.get_db_schema()}.{self.db_config.get_db_table()} AS diffa_rows
+                ON diffa_rows.{partition_col} >= diffa_segments.diffa_segment_date
+                AND diffa_rows.{partition_col} < diffa_segments.diffa_segment_date + {bucket_sql.interval}
+                AND diffa_rows.{key_col} >= diffa_segments.diffa_segment_start
+                AND diffa_rows.{key_col} < diffa_segments.diffa_segment_end""", sql_params
+
+    def get_key_bounds(self, key_col: str, check_dates: List[date]) -> Iterable[tuple]:
+        """Smallest and largest key of each bucket, as rows of (check_date, min, max)"""
+
+        partition_col = self.db_config.get_partition_col()
+        bucket_sql = self.get_bucket_sql()
+        query = f"""
+            SELECT
+                diffa_days.diffa_check_date,
+                MIN(diffa_rows.{key_col}),
+                MAX(diffa_rows.{key_col})
+            FROM UNNEST(%(check_dates)s::{bucket_sql.sql_type}[]) AS diffa_days (diffa_check_date)
+            JOIN {self.db_config.get_db_schema()}.{self.db_config.get_db_table()} AS diffa_rows
+                ON diffa_rows.{partition_col} >= diffa_days.diffa_check_date
+                AND diffa_rows.{partition_col} < diffa_days.diffa_check_date + {bucket_sql.interval}
+            GROUP BY diffa_days.diffa_check_date
+        """
+        return self._execute_query(query, {"check_dates": check_dates})
+
+    def count_key_segments(
+        self, key_col: str, segments: List[KeySegment]
+    ) -> Iterable[tuple]:
+        """Count the rows of the key segments (with their checksum if enabled), as rows
+        of (segment index, cnt[, checksum]). Empty segments are left out.
+        """
+
+        segments_clause, sql_params = self._build_key_segments_clause(key_col, segments)
+        checksum_cols = self.db_config.get_checksum_cols()
+        select_checksum_clause = (
+            ", "
+            + WRAPPED_SUM_SQL.format(
+                expression=ROW_HASH_SQL.format(columns=", ".join(checksum_cols))
             )
+            if checksum_cols
+            else ""
+        )
+        query = f"""
+            SELECT diffa_segment - 1, COUNT(*){select_checksum_clause}
+            FROM {segments_clause}
+            GROUP BY diffa_segment
+        """
+        return self._execute_query(query, sql_params)
+
+    def get_segment_keys(self, key_col: str, segments: List[KeySegment]) -> Iterable[tuple]:
+        """Keys of the rows of the key segments (with their row hash if checksums are
+        enabled), as rows of (segment index, key[, row hash]) ordered by segment and key
+        """
+
+        segments_clause, sql_params = self._build_key_segments_clause(key_col, segments)
+        checksum_cols = self.db_config.get_checksum_cols()
+        select_row_hash_clause = (
+            ", " + ROW_HASH_SQL.format(columns=", ".join(checksum_cols))
+            if checksum_cols
+            else ""
+        )
+        query = f"""
+            SELECT diffa_segment - 1, diffa_rows.{key_col}{select_row_hash_clause}
+            FROM {segments_clause}
+            ORDER BY diffa_segment, diffa_rows.{key_col}
+        """
+        return self._execute_query(query, sql_params)
+
+    def stream_keys(self, pk_col: str, check_dates: List[date]) -> Iterable[tuple]:
+        """Stream the primary keys of the buckets through a server-side cursor, as rows
+        of (check_date, key as text) ordered bytewise, so that they compare like Python
+        strings in a merge-join
+        """
+
+        partition_col = self.db_config.get_partition_col()
+        bucket_sql = self.get_bucket_sql()
+        query = f"""
+            SELECT diffa_days.diffa_check_date, diffa_rows.{pk_col}::TEXT
+            FROM UNNEST(%(check_dates)s::{bucket_sql.sql_type}[]) AS diffa_days (diffa_check_date)
+            JOIN {self.db_config.get_db_schema()}.{self.db_config.get_db_table()} AS diffa_rows
+                ON diffa_rows.{partition_col} >= diffa_days.diffa_check_date
+                AND diffa_rows.{partition_col} < diffa_days.diffa_check_date + {bucket_sql.interval}
+            WHERE diffa_rows.{pk_col} IS NOT NULL
+            ORDER BY diffa_days.diffa_check_date, diffa_rows.{pk_col}::TEXT COLLATE "C"
+        """
         logger.info(
-            f"Executing the count query on {self.db_config.get_db_scheme()}: {count_query}"
+            f"Streaming the keys of {len(check_dates)} days on {self.db_config.get_db_scheme()}: {query}"
+        )
+        return self._execute_query(
+            query, {"check_dates": check_dates}, server_side_cursor=True
         )
-        return self._execute_query(count_query)
+
+
+def split_into_shards(
+    date_ranges: List[Tuple[date, Optional[date]]],
+    shard_size: str,
+    horizon: date,
+) -> List[List[Tuple[date, Optional[date]]]]:
+    """Split the planned date ranges along week/month boundaries.
+    Each shard holds the pieces of the ranges falling into one week/month, in date order.
+    An open-ended range (catch-up) is split up to the horizon, its last piece stays open.
+    Ranges of hourly buckets (datetimes) are split at midnight of the boundaries.
+    """
+
+    def next_boundary(start: date) -> date:
+        day = start.date() if isinstance(start, datetime) else start
+        if shard_size == "week":
+            boundary = day - timedelta(days=day.weekday()) + timedelta(weeks=1)
+        else:
+            boundary = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+        if isinstance(start, datetime):
+            return datetime.combine(boundary, datetime_time())
+        return boundary
+
+    shards = {}
+    for range_start, range_end in date_ranges:
+        piece_start = range_start
+        while True:
+            boundary = next_boundary(piece_start)
+            shard = shards.setdefault(boundary, [])
+            if (range_end is not None and boundary >= range_end) or (
+                range_end is None and boundary > horizon
+            ):
+                shard.append((piece_start, range_end))
+                break
+            shard.append((piece_start, boundary))
+            piece_start = boundary
+
+    return list(shards.values())
 
 
 class SourceTargetService:
 
-    def __init__(self, config_manager: ConfigManager):
+    def __init__(
+        self, config_manager: ConfigManager, phase_timer: Optional[PhaseTimer] = None
+    ):
         self.source_db = SourceTargetDatabase(config_manager.source)
         self.target_db = SourceTargetDatabase(config_manager.target)
+        self.phase_timer = phase_timer or PhaseTimer()
+        self.phase_timer.set_query_stats("source_query", self.source_db.query_stats)
+        self.phase_timer.set_query_stats("target_query", self.target_db.query_stats)
+        self.parallelism = config_manager.source.get_parallelism()
+        self.shard_size = config_manager.source.get_shard_size()
+        self.granularity = Granularity(config_manager.source.get_granularity())
+        if self.shard_size and self.granularity.name in SHARD_SIZES and (
+            self.shard_size != self.granularity.name
+        ):
+            # Week buckets straddle months, and month buckets weeks
+            raise DiffaException(
+                f"{self.granularity.name} buckets can't be split into {self.shard_size} "
+                f"shards, use --shard-size {self.granularity.name}"
+            )
+        self.shard_timings: List[ShardTiming] = []
+        self._row_streams: List[RowStream] = []
 
-    def get_counts(
-        self, last_check_date: date, invalid_check_dates: Iterable[date]
-    ) -> Iterable[CountCheck]:
-        def to_count_check(
-            count_dict: dict, diff_dimension_cols: Optional[List[str]] = None
-        ) -> CountCheck:
-            if diff_dimension_cols:
-                return CountCheck.create_with_dimensions(diff_dimension_cols)(
-                    **count_dict
-                )
-            else:
-                return CountCheck(**count_dict)
+    def close(self):
+        """Stop the count queries of both sides, consumed or not"""
 
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_source_count = executor.submit(
-                self.source_db.count, last_check_date, invalid_check_dates
-            )
-            future_target_count = executor.submit(
-                self.target_db.count, last_check_date, invalid_check_dates
-            )
+        while self._row_streams:
+            self._row_streams.pop().close()
 
-        source_counts, target_counts = (
-            future_source_count.result(),
-            future_target_count.result(),
-        )
-        return map(
+    def get_count_rows(
+        self, last_check_date: date, invalid_check_dates: Iterable[date]
+    ) -> Tuple[Iterable[tuple], Iterable[tuple]]:
+        """Raw count rows of both sides, as tuples of
+        (cnt, check_date, *sorted dimensions[, checksum]).
+        The queries run until consumed or until `close()`, which callers must call.
+        """
+
+        # Each side runs its query in its own worker, so both queries overlap in time
+        source_rows = RowStream(
             partial(
-                to_count_check,
-                diff_dimension_cols=self.source_db.db_config.get_diff_dimension_cols(),
+                self._count, self.source_db, "source", last_check_date, invalid_check_dates
             ),
-            source_counts,
-        ), map(
+            name="diffa-source-count",
+        ).start()
+        target_rows = RowStream(
             partial(
-                to_count_check,
-                diff_dimension_cols=self.target_db.db_config.get_diff_dimension_cols(),
+                self._count, self.target_db, "target", last_check_date, invalid_check_dates
             ),
-            target_counts,
+            name="diffa-target-count",
+        ).start()
+        self._row_streams.extend((source_rows, target_rows))
+        # The check's time waiting for the rows of a side counts as its query phase
+        return self.phase_timer.timed_iter(
+            "source_query", source_rows
+        ), self.phase_timer.timed_iter("target_query", target_rows)
+
+    def get_counts(
+        self, last_check_date: date, invalid_check_dates: Iterable[date]
+    ) -> Tuple[Iterable[CountCheck], Iterable[CountCheck]]:
+        source_rows, target_rows = self.get_count_rows(
+            last_check_date, invalid_check_dates
         )
+
+        # Rows are plain tuples in the CountCheck field order, decoded with one shared type
+        return starmap(
+            CountCheck.create_with_dimensions(
+                self.source_db.db_config.get_diff_dimension_cols(),
+                with_checksum=bool(self.source_db.db_config.get_checksum_cols()),
+            ),
+            source_rows,
+        ), starmap(
+            CountCheck.create_with_dimensions(
+                self.target_db.db_config.get_diff_dimension_cols(),
+                with_checksum=bool(self.target_db.db_config.get_checksum_cols()),
+            ),
+            target_rows,
+        )
+
+    def _count(
+        self,
+        db: SourceTargetDatabase,
+        side: str,
+        last_check_date: date,
+        invalid_check_dates: Optional[List[date]],
+    ) -> Iterable[tuple]:
+        if not self.shard_size:
+            return db.count(last_check_date, invalid_check_dates)
+
+        shards = split_into_shards(
+            db.plan_date_ranges(last_check_date, invalid_check_dates, self.granularity),
+            self.shard_size,
+            horizon=self.granularity.truncate(date.today() - timedelta(days=1)),
+        )
+        logger.info(
+            f"Counting {len(shards)} {self.shard_size} shards on the {side} "
+            f"with {self.parallelism} connections"
+        )
+        return self._count_by_shards(db, side, shards)
+
+    def _count_by_shards(
+        self,
+        db: SourceTargetDatabase,
+        side: str,
+        shards: List[List[Tuple[date, Optional[date]]]],
+    ) -> Iterator[tuple]:
+        """Run the shards across the worker pool and yield their rows in shard order"""
+
+        def count_shard(date_ranges: List[Tuple[date, Optional[date]]]) -> List[tuple]:
+            for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+                started_at = time.perf_counter()
+                try:
+                    rows = list(db.count_date_ranges(date_ranges))
+                except psycopg2.OperationalError as e:
+                    if attempt == SHARD_MAX_ATTEMPTS:
+                        raise
+                    logger.warning(
+                        f"Shard {date_ranges[0][0]} on the {side} failed ({e}). Retrying..."
+                    )
+                    continue
+                shard_timing = ShardTiming(
+                    side=side,
+                    shard_start=date_ranges[0][0],
+                    shard_end=date_ranges[-1][1],
+                    row_count=len(rows),
+                    elapsed_seconds=time.perf_counter() - started_at,
+                    attempts=attempt,
+                )
+                self.shard_timings.append(shard_timing)
+                logger.info(f"Finished {shard_timing}")
+                return rows
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.parallelism, thread_name_prefix=f"diffa-{side}-shard"
+        )
+        try:
+            # Shards run concurrently, but are handed over in order (ORDER BY check_date).
+            # At most `parallelism` shards are in flight or waiting to be consumed: the
+            # next shard is only submitted once the oldest one is handed over, so the
+            # buffered rows stay bounded when the consumer is slower than the queries.
+            pending_shards = iter(shards)
+            in_flight = deque(
+                executor.submit(count_shard, date_ranges)
+                for date_ranges in islice(pending_shards, self.parallelism)
+            )
+            while in_flight:
+                rows = in_flight.popleft().result()
+                for date_ranges in islice(pending_shards, 1):
+                    in_flight.append(executor.submit(count_shard, date_ranges))
+                yield from rows
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,199 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+try:
+    import yaml
+except ImportError:  # Optional dependency, only needed by YAML manifests
+    yaml = None
+
+from diffa.config import ConfigManager, ExitCode
+from diffa.managers.check_manager import CheckManager
+from diffa.managers.run_manager import RunManager
+from diffa.metrics import export_check_metrics
+from diffa.utils import DiffaException, InvalidDiffException, Logger
+
+logger = Logger(__name__)
+
+
+def load_manifest(manifest_file: str) -> List[dict]:
+    """Load the checks of a manifest file: a `checks` list with the data-diff options of
+    each source/target pair, and optional `defaults` options shared by all the checks.
+    Manifests are YAML files, or JSON files when named *.json.
+    """
+
+    with open(manifest_file) as f:
+        if manifest_file.endswith(".json"):
+            manifest = json.load(f)
+        elif yaml is None:
+            raise DiffaException(
+                "YAML manifests require PyYAML. Install it with: pip install 'diffa[manifest]'"
+            )
+        else:
+            manifest = yaml.safe_load(f)
+
+    if not isinstance(manifest, dict) or not manifest.get("checks"):
+        raise DiffaException(f"The manifest {manifest_file} has no `checks` list")
+    defaults = manifest.get("defaults") or {}
+    return [defaults | check for check in manifest["checks"]]
+
+
+def build_config_manager(options: dict) -> ConfigManager:
+    """Build the config of a pair from its data-diff options"""
+
+    options = dict(options)
+    diff_dimensions = options.pop("diff_dimensions", None)
+    checksum_columns = options.pop("checksum_columns", None)
+    return ConfigManager().configure(
+        **options,
+        diff_dimension_cols=list(diff_dimensions) if diff_dimensions else None,
+        checksum_cols=list(checksum_columns) if checksum_columns else None,
+    )
+
+
+@dataclass(frozen=True)
+class PairResult:
+    """Outcome of the check of one source/target pair"""
+
+    pair: str
+    status: str  # VALID, INVALID or FAILED
+    elapsed_seconds: float
+    error: Optional[str] = None
+
+    def __str__(self):
+        result = f"{self.status:<7} {self.pair} ({self.elapsed_seconds:.1f}s)"
+        return f"{result}: {self.error}" if self.error else result
+
+
+class BatchManager:
+    """Run the checks of many source/target pairs in one process, at most
+    `max_concurrency` at a time. Connections are shared per DSN by all the checks.
+    """
+
+    def __init__(self, config_managers: List[ConfigManager], max_concurrency: int = 1):
+        self.config_managers = config_managers
+        self.max_concurrency = max_concurrency
+        self._running: set[RunManager] = set()
+        self._lock = threading.Lock()
+
+    def run(self) -> List[PairResult]:
+        """Run all the checks, returning their results in the manifest order"""
+
+        with self.handling_signals(), ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="diffa-check"
+        ) as executor:
+            results = list(executor.map(self.run_pair, self.config_managers))
+
+        logger.info(
+            "Checked %d pairs:\n%s", len(results), "\n".join(map(str, results))
+        )
+        return results
+
+    def run_pair(self, config_manager: ConfigManager) -> PairResult:
+        """Run the check of one pair, as `diffa data-diff` does for a single pair"""
+
+        started_at = time.perf_counter()
+        try:
+            pair = self.get_pair_name(config_manager)
+        except Exception as e:
+            # Invalid DB URI, reported with the raw table names
+            pair = f"{config_manager.source.db_table} -> {config_manager.target.db_table}"
+            return PairResult(pair=pair, status="FAILED", elapsed_seconds=0, error=str(e))
+
+        def result(status: str, error: Optional[Exception] = None) -> PairResult:
+            return PairResult(
+                pair=pair,
+                status=status,
+                elapsed_seconds=time.perf_counter() - started_at,
+                error=str(error) if error else None,
+            )
+
+        try:
+            run_manager = RunManager(config_manager=config_manager)
+            check_manager = CheckManager(
+                config_manager=config_manager, taken_over=run_manager.taken_over
+            )
+            run_manager.start_run()
+        except Exception as e:
+            logger.error(f"Failed to start the check of {pair}: {e}")
+            return result("FAILED", e)
+
+        with self._lock:
+            self._running.add(run_manager)
+        try:
+            check_manager.data_diff()
+            run_manager.complete_run(check_manager.get_timings())
+            pair_result = result("VALID")
+        except InvalidDiffException:
+            run_manager.complete_run(check_manager.get_timings())
+            pair_result = result("INVALID")
+        except Exception as e:
+            logger.error(f"The check of {pair} failed: {e}", exc_info=True)
+            run_manager.fail_run(check_manager.get_timings())
+            pair_result = result("FAILED", e)
+        finally:
+            with self._lock:
+                self._running.discard(run_manager)
+
+        export_check_metrics(run_manager, check_manager, pair_result.status)
+        return pair_result
+
+    @staticmethod
+    def get_pair_name(config_manager: ConfigManager) -> str:
+        source, target = config_manager.source, config_manager.target
+        return (
+            f"{source.get_db_name()}.{source.get_db_schema()}.{source.get_db_table()} -> "
+            f"{target.get_db_name()}.{target.get_db_schema()}.{target.get_db_table()}"
+        )
+
+    @staticmethod
+    def get_exit_code(results: List[PairResult]) -> int:
+        """Combined exit code: failures first, then invalid diffs"""
+
+        statuses = {result.status for result in results}
+        if "FAILED" in statuses:
+            return ExitCode.CHECK_FAILED.value
+        if "INVALID" in statuses:
+            return ExitCode.INVALID_DIFF.value
+        return 0
+
+    @contextmanager
+    def handling_signals(self):
+        """Install the SIGTERM/SIGINT handlers while in the context. Signal handlers can
+        only be set by the main thread, so the runs started by the worker threads are
+        failed from there.
+        """
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                previous_handlers[signal_number] = signal.signal(
+                    signal_number, self.handle_signal
+                )
+        try:
+            yield
+        finally:
+            for signal_number, handler in previous_handlers.items():
+                signal.signal(signal_number, handler)
+
+    def handle_signal(self, signal_number, frame):
+        """Handle SIGTERM/SIGINT: mark the running checks as FAILED and exit"""
+
+        logger.warning(
+            f"Received {signal.Signals(signal_number).name}. Marking the running checks as FAILED..."
+        )
+        with self._lock:
+            running = list(self._running)
+        for run_manager in running:
+            run_manager.fail_run()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # The in-flight queries of the workers can't be interrupted, don't wait for them
+        os._exit(1)
@@ -1,28 +1,78 @@
-from typing import Iterable
+import csv
+from contextlib import nullcontext
+import heapq
+from typing import Iterable, Iterator, List, Optional, Tuple
 from datetime import date
-from collections import defaultdict
-from functools import reduce
+from collections import Counter, defaultdict
+from itertools import groupby
+import threading
+from functools import cached_property
+from operator import attrgetter
 
-from diffa.db.data_models import CountCheck, MergedCountCheck
+from diffa.db.data_models import (
+    CountCheck,
+    KeyRangeDiff,
+    MergedCountCheck,
+    DiffaCheckFactory,
+    Granularity,
+    MERGED_COUNT_CHECK_BASE_FIELDS,
+    wrap_checksum,
+)
 from diffa.db.diffa_check import DiffaCheckService
 from diffa.db.source_target import SourceTargetService
-from diffa.config import ConfigManager
-from diffa.utils import Logger, InvalidDiffException
+from diffa.managers.columnar_merge import ColumnarMerge
+from diffa.managers.drilldown_manager import (
+    DrillDownManager,
+    DrillDownReport,
+    write_key_range_diffs,
+)
+from diffa.managers.pk_diff_manager import PkDiffManager
+from diffa.config import ConfigManager, DEFAULT_SUMMARY_TOP_K
+from diffa.profiling import CheckProfiler
+from diffa.timings import PhaseTimer, PhaseTiming, TimingsReport
+from diffa.utils import CheckRunTakenOverException, Logger, InvalidDiffException
 
 logger = Logger(__name__)
 
 
 class CheckManager:
 
-    def __init__(self, config_manager: ConfigManager):
+    def __init__(
+        self,
+        config_manager: ConfigManager,
+        taken_over: Optional[threading.Event] = None,
+    ):
         self.cm = config_manager
-        self.source_target_service = SourceTargetService(self.cm)
+        # Set by the run manager when another run of the pair took the run over
+        self.taken_over = taken_over or threading.Event()
+        profile_dir = self.cm.diffa_check.get_profile_dir()
+        self.profiler = (
+            CheckProfiler(
+                profile_dir,
+                f"{self.cm.source.get_db_schema()}.{self.cm.source.get_db_table()}",
+            )
+            if profile_dir
+            else None
+        )
+        self.phase_timer = self.profiler.phase_timer if self.profiler else PhaseTimer()
+        self.source_target_service = SourceTargetService(self.cm, self.phase_timer)
         self.diffa_check_service = DiffaCheckService(self.cm)
+        self.merged_by_date: dict[date, MergedCountCheck] = {}  # Days checked so far
+        self.key_range_diffs: List[KeyRangeDiff] = []  # Found by the drill-down
+        self.pk_diff_counts: Counter = Counter()  # Differing keys by kind
 
     def data_diff(self):
         """This will interupt the process when there are invalid diff found."""
 
-        if not self.compare_tables():
+        with self.profiler.profile() if self.profiler else nullcontext():
+            is_valid_diff = self.compare_tables()
+            if not is_valid_diff and self.cm.source.get_drill_down_key():
+                self._raise_if_taken_over()
+                self.drill_down()
+            if not is_valid_diff and self.cm.source.get_pk_col():
+                self._raise_if_taken_over()
+                self.pk_diff()
+        if not is_valid_diff:
             logger.error("❌ There is an invalid diff between source and target.")
             raise InvalidDiffException
         logger.info("✅ There is no invalid diff between source and target.")
@@ -38,39 +88,140 @@ class CheckManager:
         )
 
         # Step 1: Get the last check date (for backfill mechanism)
-        last_check_date = self.diffa_check_service.get_last_check_date()
-
         # Step 2: Get the invalid check dates (for re-check mechanism)
-        invalid_check_dates = self.diffa_check_service.get_invalid_check_dates()
+        with self.phase_timer.phase("state_lookup"):
+            last_check_date, invalid_check_dates = (
+                self.diffa_check_service.get_check_state()
+            )
 
         # Step 3: Compare and merge the counts from the source and target databases
-        source_counts, target_counts = self.source_target_service.get_counts(
-            last_check_date, invalid_check_dates
-        )
-        merged_count_checks = self._merge_count_checks(source_counts, target_counts)
-        merged_by_date = self._merge_by_check_date(merged_count_checks)
-
         # Step 4: Save the merged count checks to the diffa database
-        self.diffa_check_service.save_diffa_checks(
-            map(
-                lambda merged_count_check: merged_count_check.to_diffa_check_schema(
-                    source_database=self.cm.source.get_db_name(),
-                    source_schema=self.cm.source.get_db_schema(),
-                    source_table=self.cm.source.get_db_table(),
-                    target_database=self.cm.target.get_db_name(),
-                    target_schema=self.cm.target.get_db_schema(),
-                    target_table=self.cm.target.get_db_table(),
-                ),
-                merged_by_date.values(),
-            )
-        )
+        # The steps are pipelined, each one pulling from the previous one. The time spent
+        # pulling is counted for the pulled phase (see PhaseTimer).
+        # Both count queries are stopped if the merge or the upsert fails midway
+        try:
+            if self.cm.diffa_check.get_merge_engine() == "columnar":
+                # Built first: it fails without numpy, before any count query runs
+                columnar_merge = ColumnarMerge(
+                    self.cm.source.get_diff_dimension_cols(),
+                    with_checksum=bool(self.cm.source.get_checksum_cols()),
+                    granularity=Granularity(self.cm.source.get_granularity()),
+                )
+                source_rows, target_rows = self.source_target_service.get_count_rows(
+                    last_check_date, invalid_check_dates
+                )
+                with self.phase_timer.phase("merge"):
+                    merged_by_date, invalid_merged_count_checks = columnar_merge.merge(
+                        source_rows, target_rows
+                    )
+                self.merged_by_date = merged_by_date
+                with self.phase_timer.phase("upsert"):
+                    self.diffa_check_service.save_diffa_checks(
+                        map(self._to_diffa_check, merged_by_date.values())
+                    )
+            else:
+                source_counts, target_counts = self.source_target_service.get_counts(
+                    last_check_date, invalid_check_dates
+                )
+                merged_count_checks = self._merge_count_checks(
+                    source_counts, target_counts
+                )
+
+                # Days are saved as the merge finishes them. Only the groups of the
+                # invalid days are kept for the summary.
+                merged_by_date = self.merged_by_date
+                invalid_merged_count_checks = []
+
+                def finished_days():
+                    for day_check, day_checks in self._merge_days(merged_count_checks):
+                        merged_by_date[day_check.check_date] = day_check
+                        if not day_check.is_valid:
+                            invalid_merged_count_checks.extend(day_checks)
+                        yield self._to_diffa_check(day_check)
+
+                with self.phase_timer.phase("upsert"):
+                    self.diffa_check_service.save_diffa_checks(
+                        self.phase_timer.timed_iter("merge", finished_days())
+                    )
+        finally:
+            self.source_target_service.close()
 
         # Step 5: Build and log the check summary
-        self._build_check_summary(merged_count_checks, merged_by_date)
+        with self.phase_timer.phase("summary"):
+            self._build_check_summary(invalid_merged_count_checks, merged_by_date)
+        if self.cm.diffa_check.show_timings():
+            logger.info("%s", TimingsReport(self.get_timings()))
 
         # Return True if there is any invalid diff
         return self._check_if_valid_diff(merged_by_date.values())
 
+    def drill_down(self):
+        """Locate the differing key ranges of the invalid days. The days are already
+        saved: a failure is only logged, the check result stands.
+        """
+
+        invalid_check_dates = [
+            check_date
+            for check_date, day_check in self.merged_by_date.items()
+            if not day_check.is_valid
+        ]
+        drill_down_file = self.cm.diffa_check.get_drill_down_file()
+        with self.phase_timer.phase("drill_down"):
+            try:
+                self.key_range_diffs = DrillDownManager(self.cm).drill_down(
+                    invalid_check_dates
+                )
+            except Exception as e:
+                logger.error(f"Failed to drill down into the invalid days: {e}")
+                return
+            if drill_down_file:
+                write_key_range_diffs(drill_down_file, self.key_range_diffs)
+        logger.info("%s", DrillDownReport(self.key_range_diffs, drill_down_file))
+
+    def pk_diff(self):
+        """List the differing keys of the invalid days small enough to enumerate. The
+        days are already saved: a failure is only logged, the check result stands.
+        """
+
+        pk_diff_manager = PkDiffManager(self.cm)
+        with self.phase_timer.phase("pk_diff"):
+            try:
+                self.pk_diff_counts = pk_diff_manager.diff(
+                    pk_diff_manager.get_enumerable_dates(self.merged_by_date)
+                )
+            except Exception as e:
+                logger.error(f"Failed to diff the keys of the invalid days: {e}")
+
+    def get_timings(self) -> List[PhaseTiming]:
+        """Timings of the phases of the comparison run so far"""
+
+        return self.phase_timer.get_timings()
+
+    @cached_property
+    def diffa_check_factory(self) -> DiffaCheckFactory:
+        return DiffaCheckFactory(
+            granularity=self.cm.source.get_granularity(),
+            source_database=self.cm.source.get_db_name(),
+            source_schema=self.cm.source.get_db_schema(),
+            source_table=self.cm.source.get_db_table(),
+            target_database=self.cm.target.get_db_name(),
+            target_schema=self.cm.target.get_db_schema(),
+            target_table=self.cm.target.get_db_table(),
+        )
+
+    def _raise_if_taken_over(self):
+        """Stop checking once another run of the pair took the run over: its checks
+        would race the ones of the new run.
+        """
+        if self.taken_over.is_set():
+            raise CheckRunTakenOverException(
+                "The check run was taken over by another run of the pair."
+            )
+
+    def _to_diffa_check(self, day_check: MergedCountCheck) -> dict:
+        self._raise_if_taken_over()
+        return self.diffa_check_factory.from_merged_count_check(day_check)
+
     def _check_if_valid_diff(self, merged_by_date: list[MergedCountCheck]) -> bool:
         return all(mcc.is_valid for mcc in merged_by_date)
 
@@ -79,44 +230,75 @@ class CheckManager:
         merged_count_checks: Iterable[MergedCountCheck],
         merged_by_date: dict[date, MergedCountCheck],
     ):
-        stats_by_day = {
-            check_date: {
-                "detailed_msgs": self._get_check_messages(
-                    self._get_checks_by_date(merged_count_checks, check_date)
-                ),
-                "summary_msg": self._get_check_messages([mcc])[0],
-            }
-            for check_date, mcc in filter(
-                lambda x: not x[1].is_valid, merged_by_date.items()
-            )
-        }
+        checks_by_date = self._group_checks_by_date(merged_count_checks)
 
-        summary_lines = [
-            f"""
-            - {check_date}:
-                summary: 
-                    {stats['summary_msg']}
-                detailed: 
-                    {stats['detailed_msgs']}
-            """
-            for check_date, stats in stats_by_day.items()
-        ]
-        stats_summary = (
-            "\n".join(summary_lines)
-            if summary_lines
-            else "No failed days stats available"
-        )
+        summary_file = self.cm.diffa_check.get_summary_file()
+        if summary_file:
+            self._write_check_breakdown(summary_file, checks_by_date)
 
+        # The summary is only rendered if the log record is emitted
         logger.info(
-            f"""
-                Data-diff comparison result:
-                Summary:
-                - Total days checked: {len(merged_by_date)}
-                - Stats by failed days:
-                    {stats_summary}
-            """
+            "%s",
+            CheckSummary(
+                merged_by_date,
+                checks_by_date,
+                top_k=self.cm.diffa_check.get_summary_top_k(),
+                summary_file=summary_file,
+            ),
         )
 
+    @staticmethod
+    def _write_check_breakdown(
+        summary_file: str, checks_by_date: dict[date, list[MergedCountCheck]]
+    ):
+        """Write the full per-group breakdown of the failed days as CSV"""
+
+        dimension_names = sorted(
+            {
+                name
+                for day_checks in checks_by_date.values()
+                for mcc in day_checks
+                for name in mcc.__dict__
+                if name not in MERGED_COUNT_CHECK_BASE_FIELDS
+            }
+        )
+        checksum_fields = (
+            ["source_checksum", "target_checksum"]
+            if any(
+                mcc.source_checksum is not None
+                for day_checks in checks_by_date.values()
+                for mcc in day_checks
+            )
+            else []
+        )
+        with open(summary_file, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "check_date",
+                    *dimension_names,
+                    "source_count",
+                    "target_count",
+                    "diff_count",
+                    *checksum_fields,
+                    "is_valid",
+                ]
+            )
+            for check_date, day_checks in checks_by_date.items():
+                for mcc in day_checks:
+                    writer.writerow(
+                        [
+                            check_date,
+                            *(getattr(mcc, name, None) for name in dimension_names),
+                            mcc.source_count,
+                            mcc.target_count,
+                            mcc.target_count - mcc.source_count,
+                            *(getattr(mcc, name) for name in checksum_fields),
+                            mcc.is_valid,
+                        ]
+                    )
+        logger.info(f"Full breakdown of the failed days written to {summary_file}")
+
     @staticmethod
     def _get_check_messages(merged_count_checks: Iterable[MergedCountCheck]):
         return [
@@ -125,10 +307,13 @@ class CheckManager:
         ]
 
     @staticmethod
-    def _get_checks_by_date(
-        merged_count_checks: Iterable[MergedCountCheck], check_date: date
-    ) -> list[MergedCountCheck]:
-        return [mcc for mcc in merged_count_checks if mcc.check_date == check_date]
+    def _group_checks_by_date(
+        merged_count_checks: Iterable[MergedCountCheck],
+    ) -> dict[date, list[MergedCountCheck]]:
+        checks_by_date = defaultdict(list)
+        for mcc in merged_count_checks:
+            checks_by_date[mcc.check_date].append(mcc)
+        return checks_by_date
 
     @staticmethod
     def _merge_by_check_date(
@@ -143,37 +328,131 @@ class CheckManager:
             entry["target_count"] += mcc.target_count
             entry["is_valid"] &= mcc.is_valid
             entry["check_date"] = mcc.check_date
+            if mcc.source_checksum is not None:
+                # Sums of row hashes, so the day checksum is the sum of its groups'
+                for side in ("source_checksum", "target_checksum"):
+                    entry[side] = wrap_checksum(entry.get(side, 0) + getattr(mcc, side))
 
         return {cd: MergedCountCheck(**data) for cd, data in merged.items()}
 
+    @classmethod
+    def _merge_days(
+        cls, merged_count_checks: Iterable[MergedCountCheck]
+    ) -> Iterator[Tuple[MergedCountCheck, List[MergedCountCheck]]]:
+        """Roll up the merged count checks (ordered by check_date) day by day.
+        Yields the day check together with the merged count checks of that day.
+        """
+
+        for check_date, day_checks in groupby(
+            merged_count_checks, key=attrgetter("check_date")
+        ):
+            day_checks = list(day_checks)
+            yield cls._merge_by_check_date(day_checks)[check_date], day_checks
+
     def _merge_count_checks(
         self, source_counts: Iterable[CountCheck], target_counts: Iterable[CountCheck]
-    ) -> Iterable[MergedCountCheck]:
+    ) -> Iterator[MergedCountCheck]:
         """
-        Merging source and target counts.
-        The algorithm is based on the following logic:
+        Merging source and target counts, both ordered by (check_date, dimensions).
+        The algorithm is a streaming merge-join, consuming both sides in one pass:
          Input: Iterable A: [1,2,5,6]
                 Iterable B: [2,4,5,7]
          Output [(1,0), (2,2), (0,4), (5,5), (6,0), (0,7)]
         """
 
-        source_dict = {}
-        for count_check in source_counts:
-            source_dict.update(count_check.to_flatten_dimension_format())
+        sources = self._ordered_by_sort_key(source_counts, "source")
+        targets = self._ordered_by_sort_key(target_counts, "target")
+        source_key, source = next(sources, (None, None))
+        target_key, target = next(targets, (None, None))
+
+        while source is not None or target is not None:
+            if target is None or (source is not None and source_key < target_key):
+                yield MergedCountCheck.from_counts(source, None)
+                source_key, source = next(sources, (None, None))
+            elif source is None or target_key < source_key:
+                yield MergedCountCheck.from_counts(None, target)
+                target_key, target = next(targets, (None, None))
+            else:
+                yield MergedCountCheck.from_counts(source, target)
+                source_key, source = next(sources, (None, None))
+                target_key, target = next(targets, (None, None))
+
+    @staticmethod
+    def _ordered_by_sort_key(
+        count_checks: Iterable[CountCheck], side: str
+    ) -> Iterator[Tuple[tuple, CountCheck]]:
+        """Pair each count check with its sort key, making sure the input is ordered"""
+
+        previous_key = None
+        for count_check in count_checks:
+            key = count_check.get_sort_key()
+            if previous_key is not None and key <= previous_key:
+                raise ValueError(
+                    f"The {side} counts are not ordered by (check_date, dimensions): "
+                    f"{count_check} came after {previous_key}"
+                )
+            previous_key = key
+            yield key, count_check
+
 
-        target_dict = {}
-        for count_check in target_counts:
-            target_dict.update(count_check.to_flatten_dimension_format())
+class CheckSummary:
+    """Lazily rendered summary of a data-diff comparison.
+    Only the top-K worst groups of each failed day are detailed.
+    """
 
-        all_dims = set(source_dict.keys()) | set(target_dict.keys())
+    def __init__(
+        self,
+        merged_by_date: dict[date, MergedCountCheck],
+        checks_by_date: dict[date, list[MergedCountCheck]],
+        top_k: int = DEFAULT_SUMMARY_TOP_K,
+        summary_file: Optional[str] = None,
+    ):
+        self.merged_by_date = merged_by_date
+        self.checks_by_date = checks_by_date
+        self.top_k = top_k
+        self.summary_file = summary_file
+
+    def get_worst_checks(self, check_date: date) -> list[MergedCountCheck]:
+        """Invalid groups first, then the largest missing counts in the target"""
+
+        return heapq.nsmallest(
+            self.top_k,
+            self.checks_by_date.get(check_date, []),
+            key=lambda mcc: (mcc.is_valid, mcc.target_count - mcc.source_count),
+        )
 
-        merged_count_checks = []
-        for dim in all_dims:
-            source_count = source_dict.get(dim)
-            target_count = target_dict.get(dim)
-            merged_count_check = MergedCountCheck.from_counts(
-                source_count, target_count
+    def _get_day_lines(self, check_date: date, mcc: MergedCountCheck) -> str:
+        n_groups = len(self.checks_by_date.get(check_date, []))
+        detailed_msgs = CheckManager._get_check_messages(self.get_worst_checks(check_date))
+        if n_groups > self.top_k:
+            detailed_msgs.append(
+                f"... {n_groups - self.top_k} more groups"
+                + (f" in {self.summary_file}" if self.summary_file else "")
             )
-            merged_count_checks.append(merged_count_check)
+        return f"""
+            - {check_date}:
+                summary:
+                    {CheckManager._get_check_messages([mcc])[0]}
+                detailed:
+                    {detailed_msgs}
+            """
 
-        return sorted(merged_count_checks, key=lambda x: x.check_date)
+    def __str__(self):
+        summary_lines = [
+            self._get_day_lines(check_date, mcc)
+            for check_date, mcc in self.merged_by_date.items()
+            if not mcc.is_valid
+        ]
+        stats_summary = (
+            "\n".join(summary_lines)
+            if summary_lines
+            else "No failed days stats available"
+        )
+
+        return f"""
+                Data-diff comparison result:
+                Summary:
+                - Total days checked: {len(self.merged_by_date)}
+                - Stats by failed days:
+                    {stats_summary}
+            """
@@ -0,0 +1,285 @@
+import csv
+import math
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from diffa.config import ConfigManager
+from diffa.db.data_models import KeyRangeDiff, KeySegment
+from diffa.db.source_target import SourceTargetDatabase
+from diffa.utils import DiffaException, Logger
+
+logger = Logger(__name__)
+
+DRILL_DOWN_REPORT_LIMIT = 20  # Key ranges listed in the log, the file has all of them
+
+
+def get_key_after(key: Any) -> Any:
+    """Smallest key greater than the given one, i.e the exclusive end of a key range"""
+
+    if isinstance(key, int):
+        return key + 1
+    if isinstance(key, datetime):
+        return key + timedelta(microseconds=1)
+    if isinstance(key, date):
+        return key + timedelta(days=1)
+    if isinstance(key, Decimal):
+        return key.next_plus()
+    if isinstance(key, float):
+        return math.nextafter(key, math.inf)
+    raise DiffaException(
+        f"The drill-down key must be a number, a date or a timestamp, got {type(key).__name__}"
+    )
+
+
+def split_key_segment(segment: KeySegment) -> Optional[Tuple[KeySegment, KeySegment]]:
+    """Split the segment into two halves, None if it can't be split any further"""
+
+    start, end = segment.key_start, segment.key_end
+    if isinstance(start, int):
+        middle = start + (end - start) // 2
+    else:
+        middle = start + (end - start) / 2
+    if not start < middle < end:
+        return None
+    return (
+        KeySegment(segment.check_date, start, middle),
+        KeySegment(segment.check_date, middle, end),
+    )
+
+
+class DrillDownManager:
+    """Locate the rows behind the invalid days by recursive bisection of a key column.
+
+    The key range of each invalid day is split in two halves, whose counts (and
+    checksums) are compared on both sides. Only the halves that differ are split again,
+    until they hold less than `threshold` rows: their keys are then compared one by one
+    and coalesced into ranges of missing, extra or changed keys. All the segments of a
+    level are counted with a single query per side, so the cost grows with the number of
+    differences and the depth of the bisection, not with the size of the table.
+    """
+
+    def __init__(
+        self,
+        config_manager: ConfigManager,
+        source_db: Optional[SourceTargetDatabase] = None,
+        target_db: Optional[SourceTargetDatabase] = None,
+    ):
+        self.cm = config_manager
+        self.source_db = source_db or SourceTargetDatabase(self.cm.source)
+        self.target_db = target_db or SourceTargetDatabase(self.cm.target)
+        self.key_col = self.cm.source.get_drill_down_key()
+        self.threshold = self.cm.diffa_check.get_drill_down_threshold()
+        self.queries = 0
+
+    def drill_down(self, check_dates: List[date]) -> List[KeyRangeDiff]:
+        """Key ranges that differ within the given days, in (check_date, key) order"""
+
+        segments = self._get_day_segments(check_dates)
+        leaves = []
+        levels = 0
+        while segments:
+            levels += 1
+            source_stats, target_stats = (
+                self._by_first_column(rows)
+                for rows in self._on_both_sides(
+                    lambda db: db.count_key_segments(self.key_col, segments)
+                )
+            )
+            next_segments = []
+            for i, segment in enumerate(segments):
+                # (cnt[, checksum]) of the segment on each side
+                source_segment_stats = source_stats.get(i, (0,))
+                target_segment_stats = target_stats.get(i, (0,))
+                if source_segment_stats == target_segment_stats:
+                    continue
+                halves = (
+                    split_key_segment(segment)
+                    if max(source_segment_stats[0], target_segment_stats[0])
+                    > self.threshold
+                    else None
+                )
+                if halves:
+                    next_segments.extend(halves)
+                else:
+                    leaves.append(segment)
+            segments = next_segments
+
+        key_range_diffs = self._diff_keys(leaves)
+        logger.info(
+            f"Drill-down of {len(check_dates)} days on {self.key_col}: {levels} levels, "
+            f"{len(leaves)} segments compared key by key, {self.queries} queries"
+        )
+        return key_range_diffs
+
+    def _on_both_sides(
+        self, query: Callable[[SourceTargetDatabase], Iterable[tuple]]
+    ) -> Tuple[List[tuple], List[tuple]]:
+        """Run the query on both sides at the same time"""
+
+        with ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="diffa-drill-down"
+        ) as executor:
+            source_rows, target_rows = executor.map(
+                lambda db: list(query(db)), (self.source_db, self.target_db)
+            )
+        self.queries += 2
+        return source_rows, target_rows
+
+    @staticmethod
+    def _by_first_column(rows: List[tuple]) -> Dict[Any, tuple]:
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def _get_day_segments(self, check_dates: List[date]) -> List[KeySegment]:
+        """A segment per day, covering the keys of both sides"""
+
+        if not check_dates:
+            return []
+        source_bounds, target_bounds = (
+            self._by_first_column(rows)
+            for rows in self._on_both_sides(
+                lambda db: db.get_key_bounds(self.key_col, check_dates)
+            )
+        )
+        segments = []
+        for check_date in sorted(check_dates):
+            bounds = [
+                day_bounds
+                for day_bounds in (
+                    source_bounds.get(check_date),
+                    target_bounds.get(check_date),
+                )
+                if day_bounds and day_bounds[0] is not None
+            ]
+            if bounds:
+                segments.append(
+                    KeySegment(
+                        check_date,
+                        min(key_start for key_start, _ in bounds),
+                        get_key_after(max(key_end for _, key_end in bounds)),
+                    )
+                )
+        return segments
+
+    def _diff_keys(self, segments: List[KeySegment]) -> List[KeyRangeDiff]:
+        """Compare the keys of the segments, and coalesce the consecutive keys with the
+        same kind of difference into ranges. A range goes on across adjacent segments,
+        but stops at any key matching on both sides.
+        """
+
+        if not segments:
+            return []
+        source_keys, target_keys = (
+            self._group_by_segment(rows)
+            for rows in self._on_both_sides(
+                lambda db: db.get_segment_keys(self.key_col, segments)
+            )
+        )
+        key_range_diffs = []
+        previous_segment, previous_key = None, None
+        for i, segment in sorted(
+            enumerate(segments), key=lambda item: (item[1].check_date, item[1].key_start)
+        ):
+            if previous_segment is None or (
+                previous_segment.check_date,
+                previous_segment.key_end,
+            ) != (segment.check_date, segment.key_start):
+                previous_key = None
+            for key, kind, rows in self._diff_segment_keys(
+                source_keys.get(i, {}), target_keys.get(i, {})
+            ):
+                previous = key_range_diffs[-1] if key_range_diffs else None
+                if kind and previous and (previous.kind, previous.key_end) == (
+                    kind,
+                    previous_key,
+                ):
+                    key_range_diffs[-1] = KeyRangeDiff(
+                        segment.check_date, kind, previous.key_start, key, previous.rows + rows
+                    )
+                elif kind:
+                    key_range_diffs.append(
+                        KeyRangeDiff(segment.check_date, kind, key, key, rows)
+                    )
+                previous_key = key
+            previous_segment = segment
+        return key_range_diffs
+
+    @staticmethod
+    def _group_by_segment(rows: Iterable[tuple]) -> Dict[int, Dict[Any, List[Any]]]:
+        """Row hashes (None without checksums) of each key, by segment"""
+
+        keys_by_segment = defaultdict(lambda: defaultdict(list))
+        for segment, key, *row_hash in rows:
+            keys_by_segment[segment][key].append(row_hash[0] if row_hash else None)
+        return keys_by_segment
+
+    @staticmethod
+    def _diff_segment_keys(
+        source_keys: Dict[Any, List[Any]], target_keys: Dict[Any, List[Any]]
+    ) -> Iterator[Tuple[Any, Optional[str], int]]:
+        """Kind of difference (None if the key matches) and number of differing rows of
+        each key of a segment, in key order
+        """
+
+        for key in sorted(source_keys.keys() | target_keys.keys()):
+            source_hashes = Counter(source_keys.get(key, []))
+            target_hashes = Counter(target_keys.get(key, []))
+            missing, extra = source_hashes - target_hashes, target_hashes - source_hashes
+            if missing and extra:
+                yield key, "changed", max(missing.total(), extra.total())
+            elif missing:
+                yield key, "missing", missing.total()
+            elif extra:
+                yield key, "extra", extra.total()
+            else:
+                yield key, None, 0
+
+
+class DrillDownReport:
+    """Lazily rendered list of the key ranges found by the drill-down"""
+
+    def __init__(
+        self, key_range_diffs: List[KeyRangeDiff], drill_down_file: Optional[str] = None
+    ):
+        self.key_range_diffs = key_range_diffs
+        self.drill_down_file = drill_down_file
+
+    def __str__(self):
+        rows_by_kind = Counter()
+        for key_range_diff in self.key_range_diffs:
+            rows_by_kind[key_range_diff.kind] += key_range_diff.rows
+        lines = [
+            str(key_range_diff)
+            for key_range_diff in self.key_range_diffs[:DRILL_DOWN_REPORT_LIMIT]
+        ]
+        if len(self.key_range_diffs) > DRILL_DOWN_REPORT_LIMIT:
+            lines.append(
+                f"... {len(self.key_range_diffs) - DRILL_DOWN_REPORT_LIMIT} more key ranges"
+                + (f" in {self.drill_down_file}" if self.drill_down_file else "")
+            )
+        totals = ", ".join(
+            f"{rows} {kind}" for kind, rows in sorted(rows_by_kind.items())
+        )
+        return (
+            f"Drill-down found {len(self.key_range_diffs)} key ranges "
+            f"({totals or 'no rows'}):\n" + "\n".join(f"    - {line}" for line in lines)
+        )
+
+
+def write_key_range_diffs(drill_down_file: str, key_range_diffs: List[KeyRangeDiff]):
+    with open(drill_down_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["check_date", "kind", "key_start", "key_end", "rows"])
+        for key_range_diff in key_range_diffs:
+            writer.writerow(
+                [
+                    key_range_diff.check_date,
+                    key_range_diff.kind,
+                    key_range_diff.key_start,
+                    key_range_diff.key_end,
+                    key_range_diff.rows,
+                ]
+            )
+    logger.info(f"Key ranges of the drill-down written to {drill_down_file}")
@@ -0,0 +1,133 @@
+import csv
+from collections import Counter
+from datetime import date
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from diffa.config import ConfigManager
+from diffa.db.data_models import MergedCountCheck
+from diffa.db.source_target import RowStream, SourceTargetDatabase
+from diffa.utils import Logger
+
+logger = Logger(__name__)
+
+
+def merge_sorted_keys(
+    source_keys: Iterable[tuple], target_keys: Iterable[tuple]
+) -> Iterator[Tuple[date, str, str]]:
+    """Merge-join the (check_date, key) rows of both sides, both ordered, in one pass.
+    Yields the (check_date, kind, key) of the keys missing in the target (`missing`) or
+    only in the target (`extra`). A key duplicated on one side only is reported once
+    per extra copy.
+    """
+
+    sources = _ordered(source_keys, "source")
+    targets = _ordered(target_keys, "target")
+    source = next(sources, None)
+    target = next(targets, None)
+
+    while source is not None or target is not None:
+        if target is None or (source is not None and source < target):
+            yield source[0], "missing", source[1]
+            source = next(sources, None)
+        elif source is None or target < source:
+            yield target[0], "extra", target[1]
+            target = next(targets, None)
+        else:
+            source = next(sources, None)
+            target = next(targets, None)
+
+
+def _ordered(keys: Iterable[tuple], side: str) -> Iterator[tuple]:
+    """Make sure the keys are ordered, as the merge-join relies on it"""
+
+    previous = None
+    for row in keys:
+        row = tuple(row)
+        if previous is not None and row < previous:
+            raise ValueError(
+                f"The {side} keys are not ordered by (check_date, key): "
+                f"{row} came after {previous}"
+            )
+        previous = row
+        yield row
+
+
+class PkDiffManager:
+    """List the primary keys missing in the target or extra in the target, for the
+    invalid days small enough to enumerate.
+
+    The keys of both sides are streamed through server-side cursors, each in its own
+    worker, and merge-joined as they arrive: memory stays flat whatever the number of
+    keys, and the differing keys are written to the output file as they are found.
+    """
+
+    def __init__(
+        self,
+        config_manager: ConfigManager,
+        source_db: Optional[SourceTargetDatabase] = None,
+        target_db: Optional[SourceTargetDatabase] = None,
+    ):
+        self.cm = config_manager
+        self.source_db = source_db or SourceTargetDatabase(self.cm.source)
+        self.target_db = target_db or SourceTargetDatabase(self.cm.target)
+        self.pk_col = self.cm.source.get_pk_col()
+        self.max_rows = self.cm.diffa_check.get_pk_diff_max_rows()
+
+    def get_pk_diff_file(self) -> str:
+        return (
+            self.cm.diffa_check.get_pk_diff_file()
+            or f"{self.cm.source.get_db_schema()}.{self.cm.source.get_db_table()}.pk_diff.csv"
+        )
+
+    def get_enumerable_dates(
+        self, merged_by_date: Dict[date, MergedCountCheck]
+    ) -> List[date]:
+        """The invalid days small enough to list their keys. The others are logged"""
+
+        invalid_day_checks = [
+            day_check for day_check in merged_by_date.values() if not day_check.is_valid
+        ]
+        enumerable_dates = [
+            day_check.check_date
+            for day_check in invalid_day_checks
+            if day_check.source_count + day_check.target_count <= self.max_rows
+        ]
+        if skipped := len(invalid_day_checks) - len(enumerable_dates):
+            logger.warning(
+                f"{skipped} invalid days hold more than {self.max_rows} rows, their keys "
+                "are not listed (see --pk-diff-max-rows, or --drill-down-key)"
+            )
+        return sorted(enumerable_dates)
+
+    def diff(self, check_dates: List[date]) -> Counter:
+        """Write the differing keys of the days to the PK diff file.
+        Returns the number of keys by kind of difference.
+        """
+
+        pk_diff_file = self.get_pk_diff_file()
+        keys_by_kind = Counter()
+        if not check_dates:
+            return keys_by_kind
+
+        # The file is opened first: the key queries only start once it can be written,
+        # and both are stopped however the diff ends
+        with open(pk_diff_file, "w", encoding="utf-8", newline="") as f, RowStream(
+            partial(self.source_db.stream_keys, self.pk_col, check_dates),
+            name="diffa-source-keys",
+        ) as source_keys, RowStream(
+            partial(self.target_db.stream_keys, self.pk_col, check_dates),
+            name="diffa-target-keys",
+        ) as target_keys:
+            writer = csv.writer(f)
+            writer.writerow(["check_date", "kind", self.pk_col])
+            for check_date, kind, key in merge_sorted_keys(source_keys, target_keys):
+                writer.writerow([check_date, kind, key])
+                keys_by_kind[kind] += 1
+
+        logger.info(
+            f"PK diff of {len(check_dates)} invalid days on {self.pk_col}: "
+            f"{keys_by_kind['missing']} keys missing in the target, "
+            f"{keys_by_kind['extra']} extra keys in the target, written to {pk_diff_file}"
+        )
+        return keys_by_kind
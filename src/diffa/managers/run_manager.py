@@ -1,10 +1,14 @@
 import sys
 import signal
+import threading
+import time
+from typing import List, Optional
 
 from diffa.db.data_models import DiffaCheckRunSchema
 from diffa.db.diffa_check_run import DiffaCheckRunService
 from diffa.config import ConfigManager
-from diffa.utils import Logger, RunningCheckRunsException
+from diffa.timings import PhaseTiming
+from diffa.utils import Heartbeat, Logger
 
 logger = Logger(__name__)
 
@@ -23,32 +27,60 @@ class RunManager:
             target_table=self.cm.target.get_db_table(),
             status="RUNNING",
         )
+        self._heartbeat = None
+        self._started_at = None
+        # Set when another run of the pair took this one over: the check must stop
+        self.taken_over = threading.Event()
 
     def start_run(self):
-
-        running_check_runs = self.diffa_check_run_service.getting_running_check_runs()
-        if len(running_check_runs) > 0:
-            raise RunningCheckRunsException(
-                running_check_runs, "There are other RUNNING checks"
-            )
+        """Create the check run, taking over the stale RUNNING runs of the pair. Raise
+        RunningCheckRunsException if the pair is still running.
+        """
 
         self.diffa_check_run_service.create_new_check_run(self.current_run)
+        self._started_at = time.monotonic()
+
+        # Keep the run alive while checking. Without heartbeats (e.g. the process was
+        # killed), the run is taken over by the next run of the pair after the run TTL.
+        self._heartbeat = Heartbeat(
+            self._heartbeat_run,
+            self.cm.diffa_check_run.get_run_heartbeat_interval(),
+            name=f"diffa-run-heartbeat-{self.current_run.run_id}",
+        ).start()
+
+        # Register signal handlers. Only the main thread can, runs started by the
+        # workers of a manifest are failed by the BatchManager's handlers instead.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.handle_sigterm)
+            signal.signal(signal.SIGINT, self.handle_sigint)
+
+    def _heartbeat_run(self):
+        if not self.diffa_check_run_service.heartbeat_check_run(self.current_run):
+            self.taken_over.set()
 
-        # Register signal handlers
-        signal.signal(signal.SIGTERM, self.handle_sigterm)
-        signal.signal(signal.SIGINT, self.handle_sigint)
+    def get_run_duration(self) -> float:
+        """Seconds since the run started"""
+        return time.monotonic() - self._started_at if self._started_at else 0.0
 
-    def complete_run(self):
-        self.diffa_check_run_service.update_check_run_as_status(
+    def _stop_heartbeat(self):
+        if self._heartbeat:
+            self._heartbeat.stop()
+
+    def complete_run(self, timings: Optional[List[PhaseTiming]] = None):
+        self._stop_heartbeat()
+        self.diffa_check_run_service.save_check_run_timings(self.current_run, timings)
+        if self.diffa_check_run_service.update_check_run_as_status(
             self.current_run, "COMPLETED"
-        )
-        logger.info(f"Check run {self.current_run.run_id} marked as COMPLETED")
+        ):
+            logger.info(f"Check run {self.current_run.run_id} marked as COMPLETED")
 
-    def fail_run(self):
-        self.diffa_check_run_service.update_check_run_as_status(
+    def fail_run(self, timings: Optional[List[PhaseTiming]] = None):
+        self._stop_heartbeat()
+        self.diffa_check_run_service.save_check_run_timings(self.current_run, timings)
+        if self.diffa_check_run_service.update_check_run_as_status(
             self.current_run, "FAILED"
-        )
-        logger.info(f"Check run {self.current_run.run_id} marked as FAILED")
+        ):
+            logger.info(f"Check run {self.current_run.run_id} marked as FAILED")
 
     def handle_sigterm(self, signal_number, frame):
         """Handle SIGTERM and clean up"""
@@ -0,0 +1,108 @@
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from diffa.config import (
+    ConfigManager,
+    DEFAULT_WORKER_POLL_INTERVAL,
+    DEFAULT_HEARTBEAT_INTERVAL,
+    DEFAULT_JOB_TTL,
+    DEFAULT_MAX_ATTEMPTS,
+)
+from diffa.db.data_models import DiffaCheckJobSchema
+from diffa.db.diffa_check_job import DiffaCheckJobService
+from diffa.managers.batch_manager import BatchManager, PairResult, build_config_manager
+from diffa.utils import Heartbeat, Logger
+
+logger = Logger(__name__)
+
+
+class WorkerManager:
+    """Claim and run the check jobs of the queue in the Diffa DB.
+
+    Any number of workers (threads, processes or nodes) can share the queue: a job is
+    claimed by a single worker (FOR UPDATE SKIP LOCKED), which sends heartbeats while
+    running it. A job whose worker stops sending heartbeats is reclaimed by another one.
+    Checks run as in a manifest, and save their results through the DiffaCheckService.
+    """
+
+    def __init__(
+        self,
+        config_manager: ConfigManager,
+        max_concurrency: int = 1,
+        poll_interval: float = DEFAULT_WORKER_POLL_INTERVAL,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        job_ttl: int = DEFAULT_JOB_TTL,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        exit_when_empty: bool = False,
+    ):
+        self.cm = config_manager
+        self.diffa_check_job_service = DiffaCheckJobService(self.cm)
+        self.batch_manager = BatchManager([], max_concurrency=max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.job_ttl = job_ttl
+        self.max_attempts = max_attempts
+        self.exit_when_empty = exit_when_empty
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.results: List[PairResult] = []
+        self._stopped = threading.Event()
+
+    def run(self) -> List[PairResult]:
+        """Run the jobs until stopped (or until the queue is empty with `exit_when_empty`)"""
+
+        logger.info(
+            f"Worker {self.worker_id} started with {self.max_concurrency} concurrent checks"
+        )
+        # Stale jobs of a killed worker are reclaimed by the others after the job TTL
+        with self.batch_manager.handling_signals(), ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="diffa-worker"
+        ) as executor:
+            for future in [
+                executor.submit(self._work) for _ in range(self.max_concurrency)
+            ]:
+                future.result()
+        return self.results
+
+    def stop(self):
+        self._stopped.set()
+
+    def _work(self):
+        while not self._stopped.is_set():
+            job = self.diffa_check_job_service.claim_next_job(
+                self.worker_id, self.job_ttl, self.max_attempts
+            )
+            if job is None:
+                if self.exit_when_empty:
+                    return
+                self._stopped.wait(self.poll_interval)
+                continue
+            self.results.append(self.run_job(job))
+
+    def run_job(self, job: DiffaCheckJobSchema) -> PairResult:
+        with Heartbeat(
+            lambda: self.diffa_check_job_service.heartbeat_job(job),
+            self.heartbeat_interval,
+            name=f"diffa-heartbeat-{job.job_id}",
+        ):
+            try:
+                config_manager = build_config_manager(
+                    job.check_options
+                    | {
+                        "diffa_db_uri": job.check_options.get("diffa_db_uri")
+                        or self.cm.diffa_check_job.get_db_uri()
+                    }
+                )
+            except Exception as e:
+                logger.error(f"Invalid options in the check job {job.job_id}: {e}")
+                result = PairResult(
+                    pair=str(job.job_id), status="FAILED", elapsed_seconds=0, error=str(e)
+                )
+            else:
+                result = self.batch_manager.run_pair(config_manager)
+
+        self.diffa_check_job_service.finish_job(job, result.status, result.error)
+        return result
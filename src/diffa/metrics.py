@@ -0,0 +1,182 @@
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from diffa.timings import PhaseTiming
+from diffa.utils import Logger
+
+logger = Logger(__name__)
+
+CHECK_STATUSES = ("VALID", "INVALID", "FAILED")
+PAIR_LABELS = (
+    "source_database",
+    "source_schema",
+    "source_table",
+    "target_database",
+    "target_schema",
+    "target_table",
+)
+METRICS = {
+    "diffa_check_status": "Status of the last check run of the pair (1 for the current status).",
+    "diffa_check_run_duration_seconds": "Duration of the last check run of the pair.",
+    "diffa_check_run_timestamp_seconds": "End time of the last check run of the pair.",
+    "diffa_check_phase_seconds": "Time spent in each phase of the last check run.",
+    "diffa_check_query_seconds": "Time spent waiting on the count queries (execute and fetches).",
+    "diffa_check_fetched_rows": "Rows fetched by the count queries.",
+    "diffa_check_counted_rows": "Rows counted over the checked days.",
+    "diffa_check_checked_days": "Days checked by the last check run.",
+    "diffa_check_invalid_days": "Days with an invalid diff in the last check run.",
+}
+
+
+@dataclass(frozen=True)
+class CheckMetrics:
+    """Metrics of the last check run of a pair"""
+
+    pair_labels: Tuple[Tuple[str, str], ...]
+    status: str
+    duration_seconds: float
+    finished_at: float
+    timings: List[PhaseTiming] = field(default_factory=list)
+    checked_days: int = 0
+    invalid_days: int = 0
+    counted_rows: Dict[str, int] = field(default_factory=dict)  # By side
+
+    @classmethod
+    def from_check(cls, run_manager, check_manager, status: str) -> "CheckMetrics":
+        run = run_manager.current_run
+        day_checks = check_manager.merged_by_date.values()
+        return cls(
+            pair_labels=tuple((label, getattr(run, label)) for label in PAIR_LABELS),
+            status=status,
+            duration_seconds=run_manager.get_run_duration(),
+            finished_at=time.time(),
+            timings=check_manager.get_timings(),
+            checked_days=len(day_checks),
+            invalid_days=sum(not day_check.is_valid for day_check in day_checks),
+            counted_rows={
+                "source": sum(day_check.source_count for day_check in day_checks),
+                "target": sum(day_check.target_count for day_check in day_checks),
+            },
+        )
+
+    def get_samples(self) -> Dict[str, List[Tuple[dict, float]]]:
+        """Samples of each metric, as (extra labels, value)"""
+
+        query_timings = {
+            timing.phase.removesuffix("_query"): timing
+            for timing in self.timings
+            if timing.rows is not None
+        }
+        return {
+            "diffa_check_status": [
+                ({"status": status}, int(status == self.status))
+                for status in CHECK_STATUSES
+            ],
+            "diffa_check_run_duration_seconds": [({}, self.duration_seconds)],
+            "diffa_check_run_timestamp_seconds": [({}, self.finished_at)],
+            "diffa_check_phase_seconds": [
+                ({"phase": timing.phase}, timing.elapsed_seconds) for timing in self.timings
+            ],
+            "diffa_check_query_seconds": [
+                ({"side": side}, timing.execute_seconds + timing.fetch_seconds)
+                for side, timing in query_timings.items()
+            ],
+            "diffa_check_fetched_rows": [
+                ({"side": side}, timing.rows) for side, timing in query_timings.items()
+            ],
+            "diffa_check_counted_rows": [
+                ({"side": side}, rows) for side, rows in self.counted_rows.items()
+            ],
+            "diffa_check_checked_days": [({}, self.checked_days)],
+            "diffa_check_invalid_days": [({}, self.invalid_days)],
+        }
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n")
+
+
+def _format_labels(labels: dict) -> str:
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def format_metrics(checks: List[CheckMetrics]) -> str:
+    """Render the metrics of the checks in the OpenMetrics text format"""
+
+    lines = []
+    samples = [(check, check.get_samples()) for check in checks]
+    for name, help_text in METRICS.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"# HELP {name} {help_text}")
+        for check, check_samples in samples:
+            for extra_labels, value in check_samples[name]:
+                labels = dict(check.pair_labels) | extra_labels
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Export the metrics of the checks of the process to an OpenMetrics textfile,
+    e.g. for the node-exporter textfile collector. The file holds the last run of each
+    pair checked by the process, and is rewritten atomically after each run.
+    """
+
+    _exporters: Dict[str, "MetricsExporter"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, metrics_file: str):
+        self.metrics_file = metrics_file
+        self._checks: Dict[tuple, CheckMetrics] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, metrics_file: str) -> "MetricsExporter":
+        metrics_file = os.path.abspath(metrics_file)
+        with cls._registry_lock:
+            if metrics_file not in cls._exporters:
+                cls._exporters[metrics_file] = cls(metrics_file)
+            return cls._exporters[metrics_file]
+
+    def export(self, check_metrics: CheckMetrics):
+        with self._lock:
+            self._checks[check_metrics.pair_labels] = check_metrics
+            content = format_metrics(list(self._checks.values()))
+            # Scrapers never see a partially written file
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.metrics_file), prefix=".diffa-metrics-"
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, self.metrics_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+
+def export_check_metrics(run_manager, check_manager, status: str):
+    """Export the metrics of a check run if a metrics file is configured. A failure is
+    only logged, it never fails the check.
+    """
+
+    metrics_file = check_manager.cm.diffa_check.get_metrics_file()
+    if not metrics_file:
+        return
+    try:
+        MetricsExporter.for_file(metrics_file).export(
+            CheckMetrics.from_check(run_manager, check_manager, status)
+        )
+    except Exception as e:
+        logger.warning(f"Failed to export the check metrics to {metrics_file}: {e}")
@@ -0,0 +1,66 @@
+"""add diffa checks lookup indexes
+
+Revision ID: 5b8e2c41d7a3
+Revises: 1396d5cfd6d4
+Create Date: 2026-10-17 00:30:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from diffa.config import ConfigManager
+
+# revision identifiers, used by Alembic.
+revision: str = "5b8e2c41d7a3"
+down_revision: Union[str, None] = "1396d5cfd6d4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+config_manager = ConfigManager()
+diffa_schema = config_manager.diffa_check.get_db_schema()
+diffa_table = config_manager.diffa_check.get_db_table()
+
+PAIR_IDENTITY_COLUMNS = [
+    "source_database",
+    "source_schema",
+    "source_table",
+    "target_database",
+    "target_schema",
+    "target_table",
+]
+
+
+def upgrade() -> None:
+    """
+    Index the state lookups of a source/target pair: the latest check date
+    and the invalid check dates.
+    """
+    op.create_index(
+        f"ix_{diffa_table}_pair_check_date",
+        diffa_table,
+        PAIR_IDENTITY_COLUMNS + ["check_date"],
+        schema=diffa_schema,
+    )
+    op.create_index(
+        f"ix_{diffa_table}_pair_invalid_check_date",
+        diffa_table,
+        PAIR_IDENTITY_COLUMNS + ["check_date"],
+        schema=diffa_schema,
+        postgresql_where=sa.text("is_valid = false"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        f"ix_{diffa_table}_pair_invalid_check_date",
+        table_name=diffa_table,
+        schema=diffa_schema,
+    )
+    op.drop_index(
+        f"ix_{diffa_table}_pair_check_date",
+        table_name=diffa_table,
+        schema=diffa_schema,
+    )
@@ -0,0 +1,64 @@
+"""create diffa check jobs table
+
+Revision ID: 8c4f0d9a6e12
+Revises: 5b8e2c41d7a3
+Create Date: 2026-10-17 01:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from diffa.config import ConfigManager
+
+# revision identifiers, used by Alembic.
+revision: str = "8c4f0d9a6e12"
+down_revision: Union[str, None] = "5b8e2c41d7a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+config_manager = ConfigManager()
+
+
+def upgrade() -> None:
+    op.create_table(
+        f"{config_manager.diffa_check_job.get_db_table()}",
+        sa.Column("job_id", sa.UUID, primary_key=True),
+        sa.Column("check_options", JSONB, nullable=False),
+        sa.Column("status", sa.String, nullable=False),
+        sa.Column("result", sa.String, nullable=True),
+        sa.Column("error", sa.Text, nullable=True),
+        sa.Column("attempts", sa.Integer, server_default="0", nullable=False),
+        sa.Column("worker_id", sa.String, nullable=True),
+        sa.Column("heartbeat_at", sa.DateTime, nullable=True),
+        sa.Column(
+            "created_at", sa.DateTime, server_default=sa.func.now(), nullable=False
+        ),
+        sa.Column(
+            "updated_at", sa.DateTime, server_default=sa.func.now(), nullable=False
+        ),
+        schema=config_manager.diffa_check_job.get_db_schema(),
+    )
+    op.create_index(
+        "idx_claimable_check_jobs",
+        table_name=f"{config_manager.diffa_check_job.get_db_table()}",
+        columns=["status", "created_at"],
+        schema=config_manager.diffa_check_job.get_db_schema(),
+        postgresql_where=sa.text("status IN ('PENDING', 'RUNNING')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "idx_claimable_check_jobs",
+        table_name=f"{config_manager.diffa_check_job.get_db_table()}",
+        schema=config_manager.diffa_check_job.get_db_schema(),
+        if_exists=True,
+    )
+    op.drop_table(
+        f"{config_manager.diffa_check_job.get_db_table()}",
+        schema=config_manager.diffa_check_job.get_db_schema(),
+    )
@@ -0,0 +1,111 @@
+"""add diffa checks buckets
+
+Revision ID: a4d8e2f6c1b3
+Revises: f29c1d6b8e47
+Create Date: 2026-10-17 08:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from diffa.config import ConfigManager
+
+# revision identifiers, used by Alembic.
+revision: str = "a4d8e2f6c1b3"
+down_revision: Union[str, None] = "f29c1d6b8e47"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+config_manager = ConfigManager()
+diffa_schema = config_manager.diffa_check.get_db_schema()
+diffa_table = config_manager.diffa_check.get_db_table()
+
+PAIR_IDENTITY_COLUMNS = [
+    "source_database",
+    "source_schema",
+    "source_table",
+    "target_database",
+    "target_schema",
+    "target_table",
+]
+
+
+def upgrade() -> None:
+    """
+    Store the checks by time bucket (see --granularity): the granularity and the start
+    of the bucket. The existing checks are daily ones, starting at their check date.
+    The state lookups now run on the buckets of a granularity.
+    """
+    op.add_column(
+        diffa_table,
+        sa.Column("granularity", sa.String, server_default="day", nullable=False),
+        schema=diffa_schema,
+    )
+    op.add_column(
+        diffa_table,
+        sa.Column("bucket_start", sa.DateTime, nullable=True),
+        schema=diffa_schema,
+    )
+    op.execute(
+        f"UPDATE {diffa_schema}.{diffa_table} SET bucket_start = check_date::TIMESTAMP"
+    )
+    op.alter_column(
+        diffa_table, "bucket_start", nullable=False, schema=diffa_schema
+    )
+
+    op.create_index(
+        f"ix_{diffa_table}_pair_bucket_start",
+        diffa_table,
+        PAIR_IDENTITY_COLUMNS + ["granularity", "bucket_start"],
+        schema=diffa_schema,
+    )
+    op.create_index(
+        f"ix_{diffa_table}_pair_invalid_bucket_start",
+        diffa_table,
+        PAIR_IDENTITY_COLUMNS + ["granularity", "bucket_start"],
+        schema=diffa_schema,
+        postgresql_where=sa.text("is_valid = false"),
+    )
+    op.drop_index(
+        f"ix_{diffa_table}_pair_invalid_check_date",
+        table_name=diffa_table,
+        schema=diffa_schema,
+    )
+    op.drop_index(
+        f"ix_{diffa_table}_pair_check_date",
+        table_name=diffa_table,
+        schema=diffa_schema,
+    )
+
+
+def downgrade() -> None:
+    op.create_index(
+        f"ix_{diffa_table}_pair_check_date",
+        diffa_table,
+        PAIR_IDENTITY_COLUMNS + ["check_date"],
+        schema=diffa_schema,
+    )
+    op.create_index(
+        f"ix_{diffa_table}_pair_invalid_check_date",
+        diffa_table,
+        PAIR_IDENTITY_COLUMNS + ["check_date"],
+        schema=diffa_schema,
+        postgresql_where=sa.text("is_valid = false"),
+    )
+    op.drop_index(
+        f"ix_{diffa_table}_pair_invalid_bucket_start",
+        table_name=diffa_table,
+        schema=diffa_schema,
+    )
+    op.drop_index(
+        f"ix_{diffa_table}_pair_bucket_start",
+        table_name=diffa_table,
+        schema=diffa_schema,
+    )
+    # Only the daily checks fit in the check date column
+    op.execute(f"DELETE FROM {diffa_schema}.{diffa_table} WHERE granularity <> 'day'")
+    op.drop_column(diffa_table, "bucket_start", schema=diffa_schema)
+    op.drop_column(diffa_table, "granularity", schema=diffa_schema)
@@ -0,0 +1,42 @@
+"""add diffa check runs heartbeat
+
+Revision ID: d3a7e5f19b20
+Revises: 8c4f0d9a6e12
+Create Date: 2026-10-17 02:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from diffa.config import ConfigManager
+
+# revision identifiers, used by Alembic.
+revision: str = "d3a7e5f19b20"
+down_revision: Union[str, None] = "8c4f0d9a6e12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+config_manager = ConfigManager()
+diffa_schema = config_manager.diffa_check_run.get_db_schema()
+diffa_check_runs_table = config_manager.diffa_check_run.get_db_table()
+
+
+def upgrade() -> None:
+    """
+    Record the last heartbeat of the check runs. Existing RUNNING runs get the
+    current time, so that they become reclaimable after the run TTL.
+    """
+    op.add_column(
+        diffa_check_runs_table,
+        sa.Column(
+            "heartbeat_at", sa.DateTime, server_default=sa.func.now(), nullable=False
+        ),
+        schema=diffa_schema,
+    )
+
+
+def downgrade() -> None:
+    op.drop_column(diffa_check_runs_table, "heartbeat_at", schema=diffa_schema)
@@ -0,0 +1,56 @@
+"""create diffa check run timings table
+
+Revision ID: e61b2f4c8a95
+Revises: d3a7e5f19b20
+Create Date: 2026-10-17 03:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from diffa.config import ConfigManager, DIFFA_CHECK_RUN_TIMINGS_TABLE
+
+# revision identifiers, used by Alembic.
+revision: str = "e61b2f4c8a95"
+down_revision: Union[str, None] = "d3a7e5f19b20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+config_manager = ConfigManager()
+diffa_schema = config_manager.diffa_check_run.get_db_schema()
+diffa_check_runs_table = config_manager.diffa_check_run.get_db_table()
+diffa_check_run_timings_table = DIFFA_CHECK_RUN_TIMINGS_TABLE
+
+
+def upgrade() -> None:
+    """
+    Store the phase timings of each check run, one row per phase.
+    """
+    op.create_table(
+        diffa_check_run_timings_table,
+        sa.Column(
+            "run_id",
+            sa.UUID,
+            sa.ForeignKey(
+                f"{diffa_schema}.{diffa_check_runs_table}.run_id", ondelete="CASCADE"
+            ),
+            primary_key=True,
+        ),
+        sa.Column("phase", sa.String, primary_key=True),
+        sa.Column("elapsed_seconds", sa.Float, nullable=False),
+        sa.Column("rows", sa.BigInteger, nullable=True),
+        sa.Column("bytes", sa.BigInteger, nullable=True),
+        sa.Column("execute_seconds", sa.Float, nullable=True),
+        sa.Column("fetch_seconds", sa.Float, nullable=True),
+        sa.Column(
+            "created_at", sa.DateTime, server_default=sa.func.now(), nullable=False
+        ),
+        schema=diffa_schema,
+    )
+
+
+def downgrade() -> None:
+    op.drop_table(diffa_check_run_timings_table, schema=diffa_schema)
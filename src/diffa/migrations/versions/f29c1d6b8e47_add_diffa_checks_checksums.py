@@ -0,0 +1,42 @@
+"""add diffa checks checksums
+
+Revision ID: f29c1d6b8e47
+Revises: e61b2f4c8a95
+Create Date: 2026-10-17 04:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from diffa.config import ConfigManager
+
+# revision identifiers, used by Alembic.
+revision: str = "f29c1d6b8e47"
+down_revision: Union[str, None] = "e61b2f4c8a95"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+config_manager = ConfigManager()
+diffa_schema = config_manager.diffa_check.get_db_schema()
+diffa_checks_table = config_manager.diffa_check.get_db_table()
+
+
+def upgrade() -> None:
+    """
+    Store the checksums of the checked days (see --checksum-columns). They are NULL
+    for the days checked on counts only.
+    """
+    for column in ("source_checksum", "target_checksum"):
+        op.add_column(
+            diffa_checks_table,
+            sa.Column(column, sa.BigInteger, nullable=True),
+            schema=diffa_schema,
+        )
+
+
+def downgrade() -> None:
+    for column in ("source_checksum", "target_checksum"):
+        op.drop_column(diffa_checks_table, column, schema=diffa_schema)
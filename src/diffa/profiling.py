@@ -0,0 +1,102 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict
+
+from diffa.timings import PhaseTimer
+from diffa.utils import Logger
+
+logger = Logger(__name__)
+
+HOTSPOTS_LIMIT = 40  # Functions listed per sort order in the hotspot report
+
+
+class MemoryPhaseTimer(PhaseTimer):
+    """Phase timer also recording the peak of the traced memory in each phase, while
+    tracemalloc is tracing. Like the timings, the peaks are exclusive of nested phases.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.peaks: Dict[str, int] = {}
+
+    def _record_peak(self, name: str):
+        if not tracemalloc.is_tracing():
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name: str):
+        stack = self._local.__dict__.get("stack")
+        if stack:
+            self._record_peak(stack[-1][0])
+        elif tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        with super().phase(name):
+            try:
+                yield
+            finally:
+                self._record_peak(name)
+
+
+class CheckProfiler:
+    """Profile a check with cProfile and tracemalloc, and write to `out_dir`:
+        - <name>.pstats: the cProfile dump, e.g. for `python -m pstats` or snakeviz
+        - <name>.hotspots.txt: the top functions by cumulative and by own time
+        - <name>.memory.txt: the peak of the traced memory per phase of the check
+
+    cProfile sees all the threads (e.g. the source/target query workers), but only one
+    profiler can be active at a time: the profiled checks of a process run one by one.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, out_dir: str, name: str):
+        self.out_dir = out_dir
+        self.name = f"{name}-{datetime.now():%Y%m%dT%H%M%S}"
+        self.phase_timer = MemoryPhaseTimer()
+
+    def _get_path(self, suffix: str) -> str:
+        return os.path.join(self.out_dir, f"{self.name}.{suffix}")
+
+    @contextmanager
+    def profile(self):
+        with self._lock:
+            os.makedirs(self.out_dir, exist_ok=True)
+            started_tracemalloc = not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start()
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                self._write_reports(profiler)
+
+    def _write_reports(self, profiler: cProfile.Profile):
+        profiler.dump_stats(self._get_path("pstats"))
+
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        for sort_key in (pstats.SortKey.CUMULATIVE, pstats.SortKey.TIME):
+            report.write(f"Top {HOTSPOTS_LIMIT} functions by {sort_key.value} time\n")
+            stats.sort_stats(sort_key).print_stats(HOTSPOTS_LIMIT)
+        with open(self._get_path("hotspots.txt"), "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+        with open(self._get_path("memory.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{'phase':<14}{'peak_mib':>10}\n")
+            for phase, peak in self.phase_timer.peaks.items():
+                f.write(f"{phase:<14}{peak / 2**20:>10.2f}\n")
+
+        logger.info(f"Profile of the check written to {self._get_path('*')}")
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+CHECK_PHASES = (
+    "state_lookup",
+    "source_query",
+    "target_query",
+    "merge",
+    "upsert",
+    "summary",
+    "drill_down",
+    "pk_diff",
+)
+ROW_SIZE_SAMPLES = 16  # Rows of a fetched batch measured to estimate its size
+
+
+@dataclass
+class QueryStats:
+    """Cumulative statistics of the queries run on one side (source/target). Queries
+    of the shards run in several threads, hence the lock.
+    """
+
+    queries: int = 0
+    rows: int = 0
+    bytes: int = 0
+    execute_seconds: float = 0.0  # Waiting on cursor.execute
+    fetch_seconds: float = 0.0  # Waiting on the cursor fetches
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def add_query(self, execute_seconds: float):
+        with self._lock:
+            self.queries += 1
+            self.execute_seconds += execute_seconds
+
+    def add_rows(self, rows: Sequence[tuple], fetch_seconds: float = 0.0):
+        """Count a batch of fetched rows. Their size in bytes is estimated from the text
+        representation of a sample of them, as sent by the server.
+        """
+
+        n_rows = len(rows)
+        n_bytes = estimate_rows_size(rows) if n_rows else 0
+        with self._lock:
+            self.rows += n_rows
+            self.bytes += n_bytes
+            self.fetch_seconds += fetch_seconds
+
+
+def estimate_rows_size(rows: Sequence[tuple]) -> int:
+    step = max(1, len(rows) // ROW_SIZE_SAMPLES)
+    samples = rows[::step]
+    sampled_size = sum(
+        len(str(value)) for row in samples for value in row if value is not None
+    )
+    return round(sampled_size * len(rows) / len(samples))
+
+
+@dataclass(frozen=True)
+class PhaseTiming:
+    """Time spent by a check in one of its phases, with the statistics of its queries"""
+
+    phase: str
+    elapsed_seconds: float
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    execute_seconds: Optional[float] = None
+    fetch_seconds: Optional[float] = None
+
+
+class PhaseTimer:
+    """Time the phases of a check.
+
+    The phases of a check are pipelined (the merge pulls the rows of the queries, the
+    upsert pulls the merged days), so a phase is timed exclusively: the time spent in a
+    phase nested in another one only counts for the nested phase. The phases then add
+    up to the duration of the check, and a query phase is the time the check waited
+    for the rows of that side.
+    """
+
+    def __init__(self):
+        self._elapsed: Dict[str, float] = defaultdict(float)
+        self._query_stats: Dict[str, QueryStats] = {}
+        self._local = threading.local()
+
+    @contextmanager
+    def phase(self, name: str):
+        stack = self._local.__dict__.setdefault("stack", [])
+        now = time.perf_counter()
+        if stack:
+            outer_name, outer_started_at = stack[-1]
+            self._elapsed[outer_name] += now - outer_started_at
+        stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, started_at = stack.pop()
+            self._elapsed[name] += now - started_at
+            if stack:
+                stack[-1] = (stack[-1][0], now)
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """Count the time spent getting each item of the iterable in the phase"""
+
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.phase(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            # Stop the underlying generator too when the consumer stops early
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def set_query_stats(self, name: str, query_stats: QueryStats):
+        self._query_stats[name] = query_stats
+
+    def get_timings(self) -> List[PhaseTiming]:
+        """Timings of the phases run so far, in the check phases order"""
+
+        names = [name for name in CHECK_PHASES if name in self._elapsed] + [
+            name for name in self._elapsed if name not in CHECK_PHASES
+        ]
+        timings = []
+        for name in names:
+            query_stats = self._query_stats.get(name)
+            timings.append(
+                PhaseTiming(
+                    phase=name,
+                    elapsed_seconds=self._elapsed[name],
+                    **(
+                        dict(
+                            rows=query_stats.rows,
+                            bytes=query_stats.bytes,
+                            execute_seconds=query_stats.execute_seconds,
+                            fetch_seconds=query_stats.fetch_seconds,
+                        )
+                        if query_stats
+                        else {}
+                    ),
+                )
+            )
+        return timings
+
+
+class TimingsReport:
+    """Lazily rendered table of the phase timings of a check"""
+
+    def __init__(self, timings: List[PhaseTiming]):
+        self.timings = timings
+
+    def __str__(self):
+        total_seconds = sum(timing.elapsed_seconds for timing in self.timings)
+        lines = [
+            f"{'phase':<14}{'seconds':>10}{'share':>8}{'rows':>12}{'bytes':>14}{'execute_s':>11}{'fetch_s':>10}"
+        ]
+        for timing in self.timings:
+            share = timing.elapsed_seconds / total_seconds if total_seconds else 0
+            line = f"{timing.phase:<14}{timing.elapsed_seconds:>10.3f}{share:>8.1%}"
+            if timing.rows is not None:
+                line += (
+                    f"{timing.rows:>12}{timing.bytes:>14}"
+                    f"{timing.execute_seconds:>11.3f}{timing.fetch_seconds:>10.3f}"
+                )
+            lines.append(line)
+        lines.append(f"{'total':<14}{total_seconds:>10.3f}")
+        return "Check timings:\n" + "\n".join(lines)
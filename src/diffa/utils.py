@@ -1,5 +1,6 @@
 import logging
-from typing import Iterable
+import threading
+from typing import Callable, Iterable
 
 class Logger:
     def __init__(self, name: str):
@@ -33,12 +34,55 @@ class RunningCheckRunsException(DiffaException):
     """Raised when there are other running check runs."""
 
     def __init__(self, run_ids: Iterable[str], message: str = None):
-        self.run_ids = run_ids
-        self.message = f"{message} Run IDs: {', '.join(self.run_ids)}"
+        self.run_ids = list(run_ids)
+        self.message = (
+            f"{message} Run IDs: {', '.join(self.run_ids)}" if self.run_ids else message
+        )
         super().__init__(self.message)
 
     
     def get_running_run_ids(self):
         """Return the IDs of the running records"""
 
-        return self.run_ids
\ No newline at end of file
+        return self.run_ids
+
+
+class CheckRunTakenOverException(DiffaException):
+    """Raised when the check run was taken over (marked FAILED) by another run of the pair."""
+
+
+logger = Logger(__name__)
+
+
+class Heartbeat:
+    """Context manager calling `beat` every `interval` seconds from a background thread,
+    e.g. to show that a long-running job is still alive. Failed beats are logged, not raised.
+    """
+
+    def __init__(self, beat: Callable[[], None], interval: float, name: str = "heartbeat"):
+        self.beat = beat
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.beat()
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
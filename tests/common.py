@@ -45,4 +45,5 @@ def get_test_config_manager(db_scheme: str = "postgresql"):
         target_config=get_source_target_test_configs(db_scheme)["target"],
         diffa_check_config=get_diffa_test_config(db_scheme),
         diffa_check_run_config=get_diffa_test_config(db_scheme),
+        diffa_check_job_config=get_diffa_test_config(db_scheme),
     )
@@ -205,3 +205,24 @@ def test_config_manager_configure(mock_open_file, mock_mkdirs, mock_path_exists)
         db_schema=DIFFA_DB_SCHEMA,
         db_table=DIFFA_CHECK_RUNS_TABLE,
     )
+
+
+def test_db_config_parses_the_db_info_once_until_changed():
+    config = SourceConfig(db_uri=TEST_POSTGRESQL_CONN_STRING, db_schema="public", db_table="users")
+
+    with patch.object(SourceConfig, "_parse_db_info", wraps=config._parse_db_info) as parse:
+        db_info = config.get_db_config()
+        assert config.get_db_name() == "postgres"
+        assert config.get_db_table() == "users"
+        assert config.get_db_config() is db_info
+        assert parse.call_count == 1
+
+        config.update(db_table="orders")
+        assert config.get_db_table() == "orders"
+        config.db_schema = "sales"
+        assert config.get_db_schema() == "sales"
+        assert parse.call_count == 3
+
+    with pytest.raises(TypeError):
+        db_info["table"] = "orders"
+    assert config == SourceConfig(db_uri=TEST_POSTGRESQL_CONN_STRING, db_schema="sales", db_table="orders")
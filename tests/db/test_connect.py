@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import text
+
+from diffa.db.connect import DiffaConnection, EngineRegistry
+from common import get_test_config_manager
+
+
+@pytest.fixture(autouse=True)
+def engine_registry():
+    yield EngineRegistry
+    EngineRegistry.dispose_all()
+
+
+def test_get_engine_is_shared_per_uri(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'a.db'}"
+
+    engine = EngineRegistry.get_engine(db_uri)
+
+    assert EngineRegistry.get_engine(db_uri) is engine
+    assert EngineRegistry.get_engine(f"sqlite:///{tmp_path / 'b.db'}") is not engine
+
+
+def test_get_engine_applies_pool_options(tmp_path):
+    engine = EngineRegistry.get_engine(
+        f"sqlite:///{tmp_path / 'a.db'}", pool_size=2, pool_recycle=60, pool_pre_ping=False
+    )
+
+    assert engine.pool.size() == 2
+    assert engine.pool._recycle == 60
+    assert engine.pool._pre_ping is False
+
+
+def test_get_pool_metrics_counts_checkouts(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'a.db'}"
+    engine = EngineRegistry.get_engine(db_uri)
+
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    with engine.connect(), engine.connect():
+        in_use = EngineRegistry.get_pool_metrics(db_uri).checked_out
+
+    metrics = EngineRegistry.get_pool_metrics(db_uri)
+    assert in_use == 2
+    assert metrics.checkouts == metrics.checkins == 5
+    assert metrics.checked_out == 0
+    assert metrics.max_checked_out == 2
+    # Connections are reused from the pool
+    assert metrics.connects == 2
+
+
+def test_dispose_all_clears_the_registry(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'a.db'}"
+    engine = EngineRegistry.get_engine(db_uri)
+
+    EngineRegistry.dispose_all()
+
+    assert EngineRegistry.get_pool_metrics(db_uri) is None
+    assert EngineRegistry.get_engine(db_uri) is not engine
+
+
+def test_diffa_connections_share_the_engine():
+    diffa_config = get_test_config_manager().diffa_check.update(pool_size=3)
+    first = DiffaConnection(diffa_config.get_db_config(), diffa_config.get_pool_options())
+    second = DiffaConnection(diffa_config.get_db_config(), diffa_config.get_pool_options())
+
+    with first.db_session() as first_session, second.db_session() as second_session:
+        assert first_session.get_bind() is second_session.get_bind()
+        assert first_session.get_bind().pool.size() == 3
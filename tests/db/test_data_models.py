@@ -0,0 +1,194 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+
+from diffa.db.data_models import (
+    CountCheck,
+    DiffaCheckFactory,
+    DiffaCheckSchema,
+    Granularity,
+    MergedCountCheck,
+    wrap_checksum,
+)
+from diffa.utils import DiffaException
+
+
+def test_count_check_create_with_dimensions_is_cached_per_signature():
+    row_type = CountCheck.create_with_dimensions(["status", "country"])
+
+    assert CountCheck.create_with_dimensions(["country", "status"]) is row_type
+    assert CountCheck.create_with_dimensions(["status"]) is not row_type
+    assert CountCheck.create_with_dimensions([]) is CountCheck
+    assert not hasattr(row_type(1, date(2024, 1, 1), "US", "True"), "__dict__")
+
+
+def test_count_check_decodes_rows_in_field_order():
+    row_type = CountCheck.create_with_dimensions(["status", "country"])
+    count_check = row_type(100, date(2024, 1, 1), "US", "True")
+
+    assert count_check == row_type(
+        cnt=100, check_date=date(2024, 1, 1), country="US", status="True"
+    )
+    assert count_check.get_dimension_fields() == [("country", str), ("status", str)]
+    assert count_check.to_flatten_dimension_format() == {
+        (("country", "US"), ("status", "True"), ("check_date", date(2024, 1, 1))): count_check
+    }
+
+
+def test_count_check_decodes_the_checksum_after_the_dimensions():
+    row_type = CountCheck.create_with_dimensions(["status"], with_checksum=True)
+    count_check = row_type(100, date(2024, 1, 1), "US", -42)
+
+    assert row_type.has_checksum and not CountCheck.has_checksum
+    assert count_check.checksum == -42
+    assert count_check.get_dimension_values() == {
+        "status": "US",
+        "check_date": date(2024, 1, 1),
+    }
+    assert CountCheck.create_with_dimensions([], with_checksum=True) is not CountCheck
+
+
+@pytest.mark.parametrize(
+    "source_count, target_count, source_checksum, target_checksum, expected_is_valid",
+    [
+        # Case 1: Same rows on both sides
+        (10, 10, 123, 123, True),
+        # Case 2: A row changed in place
+        (10, 10, 123, 456, False),
+        # Case 3: More rows in the target, the checksums can't tell more
+        (10, 11, 123, 456, True),
+        # Case 4: Missing rows in the target
+        (10, 9, 123, 123, False),
+        # Case 5: Checksums not checked
+        (10, 10, None, None, True),
+    ],
+)
+def test_merged_count_check_compares_the_checksums_of_equal_counts(
+    source_count, target_count, source_checksum, target_checksum, expected_is_valid
+):
+    merged_count_check = MergedCountCheck(
+        source_count=source_count,
+        target_count=target_count,
+        check_date=date(2024, 1, 1),
+        source_checksum=source_checksum,
+        target_checksum=target_checksum,
+    )
+
+    assert merged_count_check.is_valid == expected_is_valid
+
+
+def test_wrap_checksum_matches_int64_overflow():
+    assert wrap_checksum(2**63 - 1) == 2**63 - 1
+    assert wrap_checksum(2**63) == -(2**63)
+    assert wrap_checksum(-(2**63) - 1) == 2**63 - 1
+    assert wrap_checksum(3 * 2**64 + 5) == 5
+
+
+PAIR_IDENTITY = {
+    "source_database": "db1",
+    "source_schema": "schema1",
+    "source_table": "table1",
+    "target_database": "db2",
+    "target_schema": "schema2",
+    "target_table": "t\u00e4ble2",
+}
+
+
+@pytest.mark.parametrize("days", range(0, 4000, 397))
+def test_diffa_check_factory_matches_the_validated_schema(days):
+    check_date = date(2020, 1, 1) + timedelta(days=days)
+    merged_count_check = MergedCountCheck(
+        source_count=100, target_count=90 + days % 20, check_date=check_date
+    )
+
+    diffa_check = DiffaCheckFactory(**PAIR_IDENTITY).from_merged_count_check(
+        merged_count_check
+    )
+
+    assert diffa_check == DiffaCheckSchema(
+        **PAIR_IDENTITY,
+        check_date=check_date,
+        source_count=merged_count_check.source_count,
+        target_count=merged_count_check.target_count,
+        is_valid=merged_count_check.is_valid,
+        diff_count=merged_count_check.target_count - merged_count_check.source_count,
+    ).model_dump()
+    assert list(diffa_check) == list(DiffaCheckSchema.model_fields)
+
+
+@pytest.mark.parametrize(
+    "granularity, check_date",
+    [
+        ("hour", datetime(2024, 1, 1, 13)),
+        ("week", date(2024, 1, 1)),
+        ("month", date(2024, 2, 1)),
+    ],
+)
+def test_diffa_check_factory_matches_the_validated_schema_of_buckets(
+    granularity, check_date
+):
+    merged_count_check = MergedCountCheck(
+        source_count=100, target_count=90, check_date=check_date
+    )
+
+    diffa_check = DiffaCheckFactory(
+        granularity=granularity, **PAIR_IDENTITY
+    ).from_merged_count_check(merged_count_check)
+
+    assert diffa_check == DiffaCheckSchema(
+        **PAIR_IDENTITY,
+        check_date=Granularity(granularity).get_bucket_start(check_date).date(),
+        source_count=100,
+        target_count=90,
+        is_valid=False,
+        diff_count=-10,
+        granularity=granularity,
+        bucket_start=Granularity(granularity).get_bucket_start(check_date),
+    ).model_dump()
+    # Buckets of other sizes starting on the same day are stored apart from the day
+    assert diffa_check["id"] != DiffaCheckFactory(**PAIR_IDENTITY).create(
+        check_date, 100, 90, False
+    )["id"]
+
+
+def test_diffa_check_factory_keeps_the_ids_of_the_daily_checks():
+    diffa_check = DiffaCheckFactory(**PAIR_IDENTITY).create(
+        date(2024, 1, 1), 100, 100, True
+    )
+
+    assert diffa_check["id"] == DiffaCheckSchema.create_id(
+        *PAIR_IDENTITY.values(), "2024-01-01"
+    )
+    assert diffa_check["bucket_start"] == datetime(2024, 1, 1)
+
+
+@pytest.mark.parametrize(
+    "granularity, value, expected_bucket, expected_next_bucket",
+    [
+        ("hour", datetime(2024, 1, 1, 13, 45), datetime(2024, 1, 1, 13), datetime(2024, 1, 1, 14)),
+        ("hour", date(2024, 1, 1), datetime(2024, 1, 1), datetime(2024, 1, 1, 1)),
+        ("day", datetime(2024, 1, 31, 23), date(2024, 1, 31), date(2024, 2, 1)),
+        ("week", date(2024, 1, 3), date(2024, 1, 1), date(2024, 1, 8)),
+        ("month", date(2024, 1, 31), date(2024, 1, 1), date(2024, 2, 1)),
+        ("month", date(2024, 12, 15), date(2024, 12, 1), date(2025, 1, 1)),
+    ],
+)
+def test_granularity_buckets(granularity, value, expected_bucket, expected_next_bucket):
+    granularity = Granularity(granularity)
+    bucket = granularity.truncate(value)
+
+    assert bucket == expected_bucket
+    assert granularity.get_next_bucket(bucket) == expected_next_bucket
+    assert granularity.from_ordinal(granularity.to_ordinal(bucket)) == bucket
+    assert granularity.to_ordinal(bucket) < granularity.to_ordinal(expected_next_bucket)
+
+
+def test_granularity_rejects_unknown_names():
+    with pytest.raises(DiffaException):
+        Granularity("minute")
+
+
+def test_diffa_check_factory_validates_the_pair_identity():
+    with pytest.raises(ValidationError):
+        DiffaCheckFactory(**(PAIR_IDENTITY | {"source_database": None}))
@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+from datetime import date, datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from diffa.config import DIFFA_BEGIN_DATE
+from diffa.db.connect import DiffaConnection
+from diffa.db.diffa_check import DiffaCheckDatabase, DiffaCheckService
+from common import get_test_config_manager
+
+
+@pytest.mark.parametrize(
+    "full_diff, check_state, expected_check_state",
+    [
+        # Case 1: No checks yet
+        (False, (None, []), (DIFFA_BEGIN_DATE, None)),
+        # Case 2: Latest check date and invalid check dates, from the bucket starts
+        (
+            False,
+            (datetime(2024, 1, 31), [datetime(2024, 1, 2), datetime(2024, 1, 5)]),
+            (date(2024, 1, 31), [date(2024, 1, 2), date(2024, 1, 5)]),
+        ),
+        # Case 3: Full diff ignores the state
+        (
+            True,
+            (datetime(2024, 1, 31), [datetime(2024, 1, 2)]),
+            (DIFFA_BEGIN_DATE, None),
+        ),
+    ],
+)
+def test_get_check_state(full_diff, check_state, expected_check_state):
+    config_manager = get_test_config_manager()
+    config_manager.diffa_check.update(full_diff=full_diff)
+    service = DiffaCheckService(config_manager)
+
+    with patch.object(
+        DiffaCheckDatabase, "get_check_state", return_value=check_state
+    ) as get_check_state:
+        assert service.get_check_state() == expected_check_state
+
+    get_check_state.assert_called_once_with(
+        source_database="postgres",
+        source_schema="public_source",
+        source_table="test",
+        target_database="postgres",
+        target_schema="public_target",
+        target_table="test",
+        granularity="day",
+    )
+
+
+def test_get_check_state_of_hourly_buckets():
+    config_manager = get_test_config_manager()
+    config_manager.source.update(granularity="hour")
+    service = DiffaCheckService(config_manager)
+
+    with patch.object(
+        DiffaCheckDatabase,
+        "get_check_state",
+        return_value=(datetime(2024, 1, 31, 23), [datetime(2024, 1, 2, 5)]),
+    ) as get_check_state:
+        assert service.get_check_state() == (
+            datetime(2024, 1, 31, 23),
+            [datetime(2024, 1, 2, 5)],
+        )
+    assert get_check_state.call_args.kwargs["granularity"] == "hour"
+
+    with patch.object(
+        DiffaCheckDatabase, "get_check_state", return_value=(None, [])
+    ):
+        assert service.get_check_state() == (datetime(2020, 6, 1), None)
+
+
+def test_upsert_diffa_checks_commits_in_chunks():
+    config_manager = get_test_config_manager()
+    diffa_db = DiffaCheckDatabase(config_manager.diffa_check.update(upsert_chunk_size=2))
+    session = MagicMock()
+
+    @contextmanager
+    def fake_db_session(self):
+        yield session
+
+    with patch.object(DiffaConnection, "db_session", fake_db_session), patch.object(
+        DiffaCheckDatabase, "_copy_upsert"
+    ) as copy_upsert:
+        upserted = diffa_db.upsert_diffa_checks({"id": i} for i in range(5))
+
+    assert upserted == 5
+    assert [call.args[1] for call in copy_upsert.call_args_list] == [
+        ({"id": 0}, {"id": 1}),
+        ({"id": 2}, {"id": 3}),
+        ({"id": 4},),
+    ]
+    assert session.begin.call_count == 3
@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from diffa.db.connect import DiffaConnection
+from diffa.db.diffa_check_job import DiffaCheckJobDatabase
+from common import get_test_config_manager
+
+
+class FakeJobsSession:
+    """Applies the UPDATEs to in-memory job rows, filtering on their equality criteria"""
+
+    def __init__(self, jobs: list):
+        self.jobs = jobs
+
+    @contextmanager
+    def begin(self):
+        yield
+
+    def execute(self, statement):
+        criteria = {
+            criterion.left.key: criterion.right.value
+            for criterion in statement._where_criteria
+        }
+        matched = [
+            job
+            for job in self.jobs
+            if all(job[column] == value for column, value in criteria.items())
+        ]
+        for job in matched:
+            job["heartbeat_at"] = datetime.now()
+        return MagicMock(rowcount=len(matched))
+
+
+def test_heartbeat_only_touches_the_jobs_of_the_worker():
+    diffa_check_job_db = DiffaCheckJobDatabase(get_test_config_manager().diffa_check_job)
+    # The job was reclaimed by worker-2 after worker-1 stopped sending heartbeats
+    job = {"job_id": "job-1", "worker_id": "worker-2", "heartbeat_at": None}
+    session = FakeJobsSession([job])
+
+    @contextmanager
+    def fake_db_session(self):
+        yield session
+
+    with patch.object(DiffaConnection, "db_session", fake_db_session):
+        diffa_check_job_db.heartbeat("job-1", "worker-1")
+        assert job["heartbeat_at"] is None
+
+        diffa_check_job_db.heartbeat("job-1", "worker-2")
+        assert job["heartbeat_at"] is not None
@@ -0,0 +1,231 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from diffa.db.connect import DiffaConnection
+from diffa.db.data_models import DiffaCheckRunSchema
+from diffa.db.diffa_check_run import DiffaCheckRunDatabase, DiffaCheckRunService
+from diffa.utils import RunningCheckRunsException
+from common import get_test_config_manager
+
+
+class FakeDiffaDB:
+    """In-memory stand-in of the Diffa DB: transaction-level advisory locks and run records"""
+
+    def __init__(self, n_inserting_pairs: int):
+        self.lock = threading.Lock()
+        self.advisory_locks = defaultdict(threading.Lock)
+        self.runs = []
+        self.stale_run_ids = set()  # Runs whose heartbeat is older than the run TTL
+        # Passes only when the runs of distinct pairs are created at the same time
+        self.concurrent_inserts = threading.Barrier(n_inserting_pairs, timeout=5)
+
+    @contextmanager
+    def db_session(self):
+        yield FakeSession(self)
+
+    def try_acquire_pair_lock(self, session, lock_key):
+        with self.lock:
+            advisory_lock = self.advisory_locks[lock_key]
+        if not advisory_lock.acquire(blocking=False):
+            return False
+        session.held_locks.append(advisory_lock)
+        return True
+
+    def get_running_run_ids(self, session, diffa_check_run_schema):
+        with self.lock:
+            return [
+                str(run.run_id)
+                for run in self.runs
+                if run.source_table == diffa_check_run_schema.source_table
+                and run.status == "RUNNING"
+            ]
+
+    def reclaim_stale_runs(self, session, diffa_check_run_schema, run_ttl):
+        with self.lock:
+            stale_runs = [
+                run
+                for run in self.runs
+                if run.source_table == diffa_check_run_schema.source_table
+                and run.status == "RUNNING"
+                and run.run_id in self.stale_run_ids
+            ]
+        for run in stale_runs:
+            run.status = "FAILED"
+        return [str(run.run_id) for run in stale_runs]
+
+    def insert_run(self, session, diffa_check_run_schema):
+        self.concurrent_inserts.wait()
+        session.pending.append(diffa_check_run_schema)
+
+
+class FakeSession:
+    def __init__(self, db: FakeDiffaDB):
+        self.db = db
+        self.held_locks = []
+        self.pending = []
+
+    @contextmanager
+    def begin(self):
+        try:
+            yield
+            with self.db.lock:
+                self.db.runs.extend(self.pending)
+        finally:
+            # Transaction-level advisory locks are released at commit/rollback
+            for advisory_lock in self.held_locks:
+                advisory_lock.release()
+
+
+def make_run(pair: int) -> DiffaCheckRunSchema:
+    return DiffaCheckRunSchema(
+        source_database="db",
+        source_schema="public",
+        source_table=f"table_{pair}",
+        target_database="db",
+        target_schema="public",
+        target_table=f"table_{pair}",
+        status="RUNNING",
+    )
+
+
+def test_create_diffa_check_run_record_coordinates_runs_per_pair():
+    n_pairs, n_workers_per_pair = 10, 4
+    fake_db = FakeDiffaDB(n_inserting_pairs=n_pairs)
+    diffa_check_run_db = DiffaCheckRunDatabase(get_test_config_manager().diffa_check_run)
+    start = threading.Barrier(n_pairs * n_workers_per_pair, timeout=5)
+
+    def worker(pair: int):
+        start.wait()
+        try:
+            diffa_check_run_db.create_diffa_check_run_record(make_run(pair))
+            return pair, True
+        except RunningCheckRunsException:
+            return pair, False
+
+    with patch.object(DiffaConnection, "db_session", fake_db.db_session), patch.object(
+        DiffaCheckRunDatabase, "_try_acquire_pair_lock", fake_db.try_acquire_pair_lock
+    ), patch.object(
+        DiffaCheckRunDatabase, "_get_running_run_ids", fake_db.get_running_run_ids
+    ), patch.object(
+        DiffaCheckRunDatabase, "_insert_run", fake_db.insert_run
+    ):
+        with ThreadPoolExecutor(max_workers=n_pairs * n_workers_per_pair) as executor:
+            results = list(
+                executor.map(worker, [pair for pair in range(n_pairs)] * n_workers_per_pair)
+            )
+
+    created_pairs = sorted(pair for pair, created in results if created)
+    assert created_pairs == list(range(n_pairs))
+    assert sorted(run.source_table for run in fake_db.runs) == sorted(
+        f"table_{pair}" for pair in range(n_pairs)
+    )
+
+
+def test_create_diffa_check_run_record_rejects_running_pair():
+    fake_db = FakeDiffaDB(n_inserting_pairs=1)
+    diffa_check_run_db = DiffaCheckRunDatabase(get_test_config_manager().diffa_check_run)
+    running_run = make_run(0)
+    fake_db.runs.append(running_run)
+
+    with patch.object(DiffaConnection, "db_session", fake_db.db_session), patch.object(
+        DiffaCheckRunDatabase, "_try_acquire_pair_lock", fake_db.try_acquire_pair_lock
+    ), patch.object(
+        DiffaCheckRunDatabase, "_get_running_run_ids", fake_db.get_running_run_ids
+    ):
+        with pytest.raises(RunningCheckRunsException) as exc_info:
+            diffa_check_run_db.create_diffa_check_run_record(make_run(0))
+
+    assert exc_info.value.get_running_run_ids() == [str(running_run.run_id)]
+    assert fake_db.runs == [running_run]
+
+
+def test_create_diffa_check_run_record_rejects_starting_pair():
+    fake_db = FakeDiffaDB(n_inserting_pairs=1)
+    diffa_check_run_db = DiffaCheckRunDatabase(get_test_config_manager().diffa_check_run)
+    starting_run = make_run(0)
+    # The pair lock is held by a run of the pair being created
+    fake_db.advisory_locks[diffa_check_run_db.get_pair_lock_key(starting_run)].acquire()
+
+    with patch.object(DiffaConnection, "db_session", fake_db.db_session), patch.object(
+        DiffaCheckRunDatabase, "_try_acquire_pair_lock", fake_db.try_acquire_pair_lock
+    ):
+        with pytest.raises(RunningCheckRunsException) as exc_info:
+            diffa_check_run_db.create_diffa_check_run_record(make_run(0))
+
+    assert exc_info.value.get_running_run_ids() == []
+    assert str(exc_info.value) == "Another check run of the pair is starting."
+    assert fake_db.runs == []
+
+
+@pytest.mark.parametrize("updated", [True, False])
+def test_update_check_run_as_status_leaves_taken_over_runs(updated):
+    diffa_check_run_service = DiffaCheckRunService(get_test_config_manager())
+    diffa_check_run_service.diffa_check_run_db = MagicMock(spec=DiffaCheckRunDatabase)
+    diffa_check_run_service.diffa_check_run_db.update_diffa_check_run_record_with_status.return_value = (
+        updated
+    )
+    run = make_run(0)
+
+    assert diffa_check_run_service.update_check_run_as_status(run, "COMPLETED") == updated
+
+    # A run taken over by another run of the pair keeps the status set by the takeover
+    assert run.status == ("COMPLETED" if updated else "RUNNING")
+
+
+def test_get_pair_lock_key_is_stable_and_distinct_per_pair():
+    lock_key = DiffaCheckRunDatabase.get_pair_lock_key(make_run(0))
+
+    assert lock_key == DiffaCheckRunDatabase.get_pair_lock_key(make_run(0))
+    assert lock_key != DiffaCheckRunDatabase.get_pair_lock_key(make_run(1))
+    assert -(2**63) <= lock_key < 2**63
+
+
+@pytest.mark.parametrize(
+    "run_ttl, stale, expected_created",
+    [
+        # Case 1: No TTL, the running run blocks the pair
+        (None, True, False),
+        # Case 2: The running run is still alive
+        (600, False, False),
+        # Case 3: The running run is stale, it is taken over
+        (600, True, True),
+    ],
+)
+def test_create_diffa_check_run_record_takes_over_stale_runs(run_ttl, stale, expected_created):
+    fake_db = FakeDiffaDB(n_inserting_pairs=1)
+    diffa_check_run_db = DiffaCheckRunDatabase(get_test_config_manager().diffa_check_run)
+    running_run = make_run(0)
+    fake_db.runs.append(running_run)
+    if stale:
+        fake_db.stale_run_ids.add(running_run.run_id)
+    new_run = make_run(0)
+
+    with patch.object(DiffaConnection, "db_session", fake_db.db_session), patch.object(
+        DiffaCheckRunDatabase, "_try_acquire_pair_lock", fake_db.try_acquire_pair_lock
+    ), patch.object(
+        DiffaCheckRunDatabase, "_reclaim_stale_runs", fake_db.reclaim_stale_runs
+    ), patch.object(
+        DiffaCheckRunDatabase, "_get_running_run_ids", fake_db.get_running_run_ids
+    ), patch.object(
+        DiffaCheckRunDatabase, "_insert_run", fake_db.insert_run
+    ):
+        if expected_created:
+            reclaimed_run_ids = diffa_check_run_db.create_diffa_check_run_record(
+                new_run, run_ttl
+            )
+        else:
+            with pytest.raises(RunningCheckRunsException):
+                diffa_check_run_db.create_diffa_check_run_record(new_run, run_ttl)
+
+    if expected_created:
+        assert reclaimed_run_ids == [str(running_run.run_id)]
+        assert running_run.status == "FAILED"
+        assert fake_db.runs == [running_run, new_run]
+    else:
+        assert running_run.status == "RUNNING"
+        assert fake_db.runs == [running_run]
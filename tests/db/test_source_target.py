@@ -0,0 +1,449 @@
+import time
+import threading
+from datetime import date, datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from diffa.db.data_models import CountCheck, Granularity, KeySegment
+from diffa.db.host_limiter import HostLimiter
+from diffa.db.source_target import (
+    RowStream,
+    SourceTargetDatabase,
+    SourceTargetService,
+    split_into_shards,
+)
+from diffa.utils import DiffaException
+from common import get_test_config_manager
+
+
+@pytest.fixture
+def source_target_service():
+    return SourceTargetService(get_test_config_manager())
+
+
+def test_get_counts_runs_source_and_target_queries_concurrently(source_target_service):
+    # Both queries must be in flight at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_count(self, latest_check_date, invalid_check_dates):
+        barrier.wait()
+        yield (100, date(2024, 1, 1))
+
+    with patch.object(SourceTargetDatabase, "count", fake_count):
+        source_counts, target_counts = source_target_service.get_counts(
+            date(2023, 12, 31), None
+        )
+        assert list(source_counts) == [CountCheck(cnt=100, check_date=date(2024, 1, 1))]
+        assert list(target_counts) == [CountCheck(cnt=100, check_date=date(2024, 1, 1))]
+
+
+def test_row_stream_keeps_order_across_batches():
+    rows = list(RowStream(lambda: iter(range(25)), batch_size=4, max_batches=2).start())
+
+    assert rows == list(range(25))
+
+
+def test_row_stream_bounds_buffered_rows():
+    produced = []
+
+    def producer():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    stream = RowStream(producer, batch_size=5, max_batches=2).start()
+    rows = iter(stream)
+    assert next(rows) == 0
+
+    # Producer can be at most one batch ahead of the queue capacity
+    stream._thread.join(timeout=0.5)
+    assert len(produced) <= 5 * (2 + 2)
+    assert list(rows) == list(range(1, 100))
+
+
+def test_row_stream_close_stops_a_producer_never_consumed():
+    closed = threading.Event()
+
+    def producer():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.set()
+
+    stream = RowStream(producer, batch_size=5, max_batches=2).start()
+    time.sleep(0.2)  # The producer fills the queue, then blocks
+    assert stream._thread.is_alive()
+
+    stream.close()
+
+    assert not stream._thread.is_alive()
+    assert closed.is_set()  # The producer's rows (e.g. its cursor) are released
+    assert stream._queue.empty()
+
+
+def test_row_stream_as_context_manager_closes_on_errors():
+    with pytest.raises(ValueError):
+        with RowStream(lambda: iter(range(100)), batch_size=1, max_batches=1) as stream:
+            raise ValueError
+
+    assert not stream._thread.is_alive()
+
+
+def test_get_count_rows_queries_are_stopped_by_close(source_target_service):
+    def fake_count(self, latest_check_date, invalid_check_dates):
+        yield from ((1, date(2024, 1, 1)) for _ in range(100000))
+
+    with patch.object(SourceTargetDatabase, "count", fake_count):
+        source_target_service.get_count_rows(date(2023, 12, 31), None)
+        streams = list(source_target_service._row_streams)
+        source_target_service.close()
+
+    assert len(streams) == 2
+    assert not any(stream._thread.is_alive() for stream in streams)
+    assert source_target_service._row_streams == []
+
+
+def test_row_stream_reraises_producer_errors():
+    def producer():
+        yield 1
+        raise RuntimeError("query failed")
+
+    with pytest.raises(RuntimeError, match="query failed"):
+        list(RowStream(producer).start())
+
+
+@pytest.fixture
+def source_db():
+    return SourceTargetDatabase(get_test_config_manager().source)
+
+
+@pytest.mark.parametrize(
+    "check_dates, expected_ranges",
+    [
+        # Case 1: No dates
+        ([], []),
+        # Case 2: Consecutive dates are merged into a single range
+        (
+            [date(2024, 1, 2), date(2024, 1, 1), date(2024, 1, 3)],
+            [(date(2024, 1, 1), date(2024, 1, 4))],
+        ),
+        # Case 3: Gaps split the ranges, duplicates are ignored
+        (
+            [date(2024, 1, 1), date(2024, 1, 1), date(2024, 1, 5), date(2024, 1, 6)],
+            [
+                (date(2024, 1, 1), date(2024, 1, 2)),
+                (date(2024, 1, 5), date(2024, 1, 7)),
+            ],
+        ),
+    ],
+)
+def test__coalesce_date_ranges(check_dates, expected_ranges):
+    assert SourceTargetDatabase._coalesce_date_ranges(check_dates) == expected_ranges
+
+
+def test__build_count_query_uses_half_open_ranges(source_db):
+    query, sql_params = source_db._build_count_query(
+        date(2024, 2, 1), [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 10)]
+    )
+
+    assert "created_at::DATE IN" not in query
+    assert "created_at::DATE >" not in query
+    assert "created_at >= %(range_start_0)s AND created_at < %(range_end_0)s" in query
+    assert "created_at >= %(range_start_1)s AND created_at < %(range_end_1)s" in query
+    assert "range_start_2" not in query
+    assert sql_params == {
+        "catchup_start": date(2024, 2, 2),
+        "range_start_0": date(2024, 1, 1),
+        "range_end_0": date(2024, 1, 3),
+        "range_start_1": date(2024, 1, 10),
+        "range_end_1": date(2024, 1, 11),
+    }
+
+
+def test__build_count_query_merges_backfill_into_catchup_range(source_db):
+    query, sql_params = source_db._build_count_query(
+        date(2024, 1, 31), [date(2024, 1, 30), date(2024, 1, 31)]
+    )
+
+    assert "range_start_0" not in query
+    assert sql_params == {"catchup_start": date(2024, 1, 30)}
+
+
+def test__build_count_query_passes_many_ranges_as_arrays(source_db):
+    invalid_check_dates = [date(2023, 1, 1 + 2 * i) for i in range(15)] + [
+        date(2023, 2, 1 + 2 * i) for i in range(14)
+    ]
+    query, sql_params = source_db._build_count_query(date(2024, 1, 1), invalid_check_dates)
+
+    assert "UNNEST(%(range_starts)s::DATE[], %(range_ends)s::DATE[])" in query
+    assert len(sql_params["range_starts"]) == len(invalid_check_dates)
+    assert sql_params["range_ends"][0] == date(2023, 1, 2)
+    assert sql_params["catchup_start"] == date(2024, 1, 2)
+
+
+def test__build_count_query_buckets_the_partition_column(source_db):
+    source_db.db_config.update(partition_col="event_time", granularity="hour")
+    query, sql_params = source_db._build_count_query(
+        datetime(2024, 1, 31, 23), [datetime(2024, 1, 2, 5), datetime(2024, 1, 2, 6)]
+    )
+
+    assert "created_at" not in query
+    assert "DATE_TRUNC('hour', event_time)::TIMESTAMP as check_date" in query
+    assert "ORDER BY DATE_TRUNC('hour', event_time)::TIMESTAMP ASC" in query
+    assert (
+        "event_time >= %(catchup_start)s AND "
+        "event_time < DATE_TRUNC('hour', LOCALTIMESTAMP) - INTERVAL '1 HOUR'"
+    ) in query
+    # An invalid hour re-checks that hour only
+    assert sql_params == {
+        "catchup_start": datetime(2024, 2, 1),
+        "range_start_0": datetime(2024, 1, 2, 5),
+        "range_end_0": datetime(2024, 1, 2, 7),
+    }
+
+
+def test__build_count_query_passes_many_bucket_ranges_as_arrays(source_db):
+    source_db.db_config.update(granularity="hour")
+    invalid_check_dates = [datetime(2024, 1, 1, 2 * i) for i in range(12)] + [
+        datetime(2024, 1, 2, 2 * i) for i in range(12)
+    ]
+    query, sql_params = source_db._build_count_query(
+        datetime(2024, 1, 31), invalid_check_dates
+    )
+
+    assert "UNNEST(%(range_starts)s::TIMESTAMP[], %(range_ends)s::TIMESTAMP[])" in query
+    assert "SELECT %(catchup_start)s::TIMESTAMP" in query
+    assert sql_params["range_ends"][0] == datetime(2024, 1, 1, 1)
+
+
+@pytest.mark.parametrize(
+    "granularity, latest_check_date, invalid_check_dates, expected_ranges",
+    [
+        (
+            "week",
+            date(2024, 1, 29),
+            [date(2024, 1, 1), date(2024, 1, 8)],
+            [(date(2024, 1, 1), date(2024, 1, 15)), (date(2024, 2, 5), None)],
+        ),
+        (
+            "month",
+            date(2023, 12, 1),
+            [date(2023, 12, 1)],
+            [(date(2023, 12, 1), None)],
+        ),
+    ],
+)
+def test_plan_date_ranges_of_buckets(
+    granularity, latest_check_date, invalid_check_dates, expected_ranges
+):
+    assert (
+        SourceTargetDatabase.plan_date_ranges(
+            latest_check_date, invalid_check_dates, Granularity(granularity)
+        )
+        == expected_ranges
+    )
+
+
+def test__build_count_query_sums_a_checksum_of_the_rows_last(source_db):
+    query, _ = source_db._build_count_query(
+        date(2024, 2, 1), [], diff_dimension_cols=["status"], checksum_cols=["id", "amount"]
+    )
+    select_clause = query[: query.index("FROM")]
+
+    assert "MD5(ROW(id, amount)::TEXT)" in select_clause
+    assert select_clause.index("status::text") < select_clause.index("AS checksum")
+    assert "%" not in select_clause  # Would be taken for a query parameter
+    assert "checksum" not in source_db._build_count_query(date(2024, 2, 1), [])[0]
+
+
+def test_count_key_segments_joins_the_rows_to_the_segments_of_their_day(source_db):
+    source_db.db_config.update(checksum_cols=["amount"])
+    segments = [KeySegment(date(2024, 1, 1), 0, 50), KeySegment(date(2024, 1, 2), 7, 9)]
+
+    with patch.object(SourceTargetDatabase, "_execute_query") as execute_query:
+        source_db.count_key_segments("id", segments)
+    query, sql_params = execute_query.call_args.args
+
+    assert "diffa_rows.id >= diffa_segments.diffa_segment_start" in query
+    assert "MD5(ROW(amount)::TEXT)" in query
+    assert sql_params == {
+        "segment_dates": [date(2024, 1, 1), date(2024, 1, 2)],
+        "segment_starts": [0, 7],
+        "segment_ends": [50, 9],
+    }
+
+
+def test_stream_keys_always_uses_a_server_side_cursor(source_db):
+    source_db.db_config.update(server_side_cursor=False)
+
+    with patch.object(SourceTargetDatabase, "_execute_query") as execute_query:
+        source_db.stream_keys("id", [date(2024, 1, 1)])
+    query, sql_params = execute_query.call_args.args
+
+    assert 'ORDER BY diffa_days.diffa_check_date, diffa_rows.id::TEXT COLLATE "C"' in query
+    assert sql_params == {"check_dates": [date(2024, 1, 1)]}
+    assert execute_query.call_args.kwargs == {"server_side_cursor": True}
+
+
+@pytest.mark.parametrize(
+    "date_ranges, shard_size, expected_shards",
+    [
+        # Case 1: Weekly shards are aligned on Mondays, the catch-up range stays open-ended
+        (
+            [(date(2024, 1, 3), date(2024, 1, 4)), (date(2024, 1, 5), None)],
+            "week",
+            [
+                [(date(2024, 1, 3), date(2024, 1, 4)), (date(2024, 1, 5), date(2024, 1, 8))],
+                [(date(2024, 1, 8), date(2024, 1, 15))],
+                [(date(2024, 1, 15), None)],
+            ],
+        ),
+        # Case 2: Monthly shards
+        (
+            [(date(2023, 12, 20), date(2024, 2, 3))],
+            "month",
+            [
+                [(date(2023, 12, 20), date(2024, 1, 1))],
+                [(date(2024, 1, 1), date(2024, 2, 1))],
+                [(date(2024, 2, 1), date(2024, 2, 3))],
+            ],
+        ),
+        # Case 3: Ranges of hourly buckets are split at midnight
+        (
+            [(datetime(2024, 1, 14, 5), datetime(2024, 1, 15, 2))],
+            "week",
+            [
+                [(datetime(2024, 1, 14, 5), datetime(2024, 1, 15))],
+                [(datetime(2024, 1, 15), datetime(2024, 1, 15, 2))],
+            ],
+        ),
+    ],
+)
+def test_split_into_shards(date_ranges, shard_size, expected_shards):
+    assert (
+        split_into_shards(date_ranges, shard_size, horizon=date(2024, 1, 17))
+        == expected_shards
+    )
+
+
+def test_shards_must_not_split_the_buckets():
+    config_manager = get_test_config_manager()
+    config_manager.source.update(granularity="week", shard_size="month")
+
+    with pytest.raises(DiffaException, match="--shard-size week"):
+        SourceTargetService(config_manager)
+
+    config_manager.source.update(granularity="hour")
+    assert SourceTargetService(config_manager).shard_size == "month"
+
+
+def test_get_counts_by_shards_keeps_shard_order_and_records_timings():
+    config_manager = get_test_config_manager()
+    config_manager.source.update(parallelism=3, shard_size="month")
+    config_manager.target.update(parallelism=3, shard_size="month")
+    service = SourceTargetService(config_manager)
+
+    def fake_count_date_ranges(self, date_ranges):
+        # Later shards finish first
+        time.sleep(0.01 * (12 - date_ranges[0][0].month))
+        yield (1, date_ranges[0][0])
+
+    with patch.object(SourceTargetDatabase, "count_date_ranges", fake_count_date_ranges):
+        source_counts, _ = service.get_counts(date(2023, 12, 31), None)
+        check_dates = [count_check.check_date for count_check in source_counts]
+
+    assert check_dates == sorted(check_dates)
+    assert check_dates[:3] == [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)]
+    source_timings = [t for t in service.shard_timings if t.side == "source"]
+    assert len(source_timings) == len(check_dates)
+    assert all(t.row_count == 1 for t in source_timings)
+
+
+def test_stream_query_holds_no_host_slot_between_fetches():
+    db = SourceTargetDatabase(get_test_config_manager().source.update(fetch_size=1))
+    # A single slot for the host of both streams, e.g. the source and target of a merge
+    host_limiter = HostLimiter("localhost", 5432, max_concurrency=1)
+
+    def make_conn(rows):
+        conn = MagicMock(closed=0)
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchmany.side_effect = [[row] for row in rows] + [[]]
+        return conn
+
+    source_rows = db._stream_query(make_conn([(1,), (2,)]), "SELECT 1", {}, host_limiter)
+    target_rows = db._stream_query(make_conn([(3,), (4,)]), "SELECT 1", {}, host_limiter)
+
+    assert next(source_rows) == (1,)
+    # The source cursor stays open, the slot is free for the target fetches
+    assert host_limiter.semaphore.acquire(blocking=False)
+    host_limiter.semaphore.release()
+    assert [next(target_rows), next(source_rows)] == [(3,), (2,)]
+    assert list(target_rows) == [(4,)]
+    assert list(source_rows) == []
+
+
+def test_count_by_shards_keeps_at_most_parallelism_shards_in_flight():
+    config_manager = get_test_config_manager()
+    config_manager.source.update(parallelism=3, shard_size="month")
+    service = SourceTargetService(config_manager)
+    shards = [[(date(2024, month, 1), date(2024, month + 1, 1))] for month in range(1, 12)]
+    counted_shards = []
+
+    def fake_count_date_ranges(date_ranges):
+        counted_shards.append(date_ranges)
+        return [(1, date_ranges[0][0])]
+
+    db = MagicMock(count_date_ranges=fake_count_date_ranges)
+    rows = service._count_by_shards(db, "source", shards)
+    first_row = next(rows)
+    # The consumer is stalled: the finished shards must not pile up
+    time.sleep(0.1)
+    n_counted_shards = len(counted_shards)
+    rest = list(rows)
+
+    assert first_row == (1, date(2024, 1, 1))
+    assert n_counted_shards == 3 + 1
+    assert [first_row] + rest == [(1, shard[0][0]) for shard in shards]
+
+
+@pytest.mark.parametrize(
+    "diff_dimension_cols, server_side_cursor, expected_server_side_cursor",
+    [
+        # Case 1: Client-side cursor by default without dimensions
+        ([], None, False),
+        # Case 2: Server-side cursor by default with dimensions
+        (["status"], None, True),
+        # Case 3: Explicitly disabled with dimensions
+        (["status"], False, False),
+        # Case 4: Explicitly enabled without dimensions
+        ([], True, True),
+    ],
+)
+def test__execute_query_cursor_mode(
+    diff_dimension_cols, server_side_cursor, expected_server_side_cursor
+):
+    config = get_test_config_manager().source.update(
+        diff_dimension_cols=diff_dimension_cols,
+        server_side_cursor=server_side_cursor,
+        fetch_size=500,
+    )
+    db = SourceTargetDatabase(config)
+    conn = MagicMock(closed=0)
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchmany.side_effect = [[(1, date(2024, 1, 1)), (2, date(2024, 1, 2))], []]
+
+    with patch("diffa.db.connect.PostgresConnection.connect", return_value=conn):
+        rows = list(db._execute_query("SELECT 1", {}))
+
+    assert rows == [(1, date(2024, 1, 1)), (2, date(2024, 1, 2))]
+    cursor.fetchmany.assert_called_with(500)
+    assert (db.query_stats.queries, db.query_stats.rows) == (1, 2)
+    assert db.query_stats.bytes == len("1" "2024-01-01" "2" "2024-01-02")
+    if expected_server_side_cursor:
+        assert conn.cursor.call_args.kwargs["name"].startswith("diffa_")
+        conn.rollback.assert_called_once()
+        assert conn.autocommit is True
+    else:
+        assert "name" not in conn.cursor.call_args.kwargs
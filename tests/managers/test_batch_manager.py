@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from diffa.managers.batch_manager import BatchManager, PairResult, load_manifest
+from diffa.utils import DiffaException, InvalidDiffException, RunningCheckRunsException
+from common import get_test_config_manager
+
+
+def test_load_manifest_applies_defaults(tmp_path):
+    manifest_file = tmp_path / "checks.json"
+    manifest_file.write_text(
+        json.dumps(
+            {
+                "defaults": {"source_schema": "src", "target_schema": "tgt"},
+                "checks": [
+                    {"source_table": "a", "target_table": "a"},
+                    {"source_table": "b", "target_table": "b", "target_schema": "dwh"},
+                ],
+            }
+        )
+    )
+
+    assert load_manifest(str(manifest_file)) == [
+        {"source_schema": "src", "target_schema": "tgt", "source_table": "a", "target_table": "a"},
+        {"source_schema": "src", "target_schema": "dwh", "source_table": "b", "target_table": "b"},
+    ]
+
+
+def test_load_manifest_reads_yaml(tmp_path):
+    pytest.importorskip("yaml")
+    manifest_file = tmp_path / "checks.yaml"
+    manifest_file.write_text(
+        "checks:\n"
+        "  - source_table: a\n"
+        "    target_table: a\n"
+        "    diff_dimensions: [status, country]\n"
+    )
+
+    assert load_manifest(str(manifest_file)) == [
+        {"source_table": "a", "target_table": "a", "diff_dimensions": ["status", "country"]}
+    ]
+
+
+def test_load_manifest_without_checks(tmp_path):
+    manifest_file = tmp_path / "checks.json"
+    manifest_file.write_text(json.dumps({"checks": []}))
+
+    with pytest.raises(DiffaException, match="no `checks` list"):
+        load_manifest(str(manifest_file))
+
+
+@pytest.mark.parametrize(
+    "statuses, expected_exit_code",
+    [
+        # Case 1: All the pairs are valid
+        (["VALID", "VALID"], 0),
+        # Case 2: Invalid diffs
+        (["VALID", "INVALID"], 4),
+        # Case 3: Failures take precedence over invalid diffs
+        (["INVALID", "FAILED", "VALID"], 1),
+    ],
+)
+def test_get_exit_code(statuses, expected_exit_code):
+    results = [PairResult(pair="pair", status=status, elapsed_seconds=0) for status in statuses]
+
+    assert BatchManager.get_exit_code(results) == expected_exit_code
+
+
+def make_config_managers(n_pairs: int):
+    config_managers = []
+    for i in range(n_pairs):
+        config_manager = get_test_config_manager()
+        config_manager.source.update(db_table=f"table_{i}")
+        config_managers.append(config_manager)
+    return config_managers
+
+
+def test_run_reports_each_pair_in_order():
+    outcomes = {
+        "table_0": None,
+        "table_1": InvalidDiffException(),
+        "table_2": RuntimeError("query failed"),
+    }
+
+    def fake_data_diff(check_manager):
+        if outcome := outcomes[check_manager.cm.source.get_db_table()]:
+            raise outcome
+
+    with patch("diffa.managers.batch_manager.RunManager") as run_manager_cls, patch(
+        "diffa.managers.check_manager.CheckManager.data_diff", fake_data_diff
+    ):
+        results = BatchManager(make_config_managers(3), max_concurrency=2).run()
+
+    assert [result.status for result in results] == ["VALID", "INVALID", "FAILED"]
+    assert results[2].error == "query failed"
+    assert results[0].pair == "postgres.public_source.table_0 -> postgres.public_target.test"
+    run_manager = run_manager_cls.return_value
+    assert run_manager.complete_run.call_count == 2
+    run_manager.fail_run.assert_called_once()
+
+
+def test_run_fails_pairs_already_running():
+    with patch("diffa.managers.batch_manager.RunManager") as run_manager_cls:
+        run_manager_cls.return_value.start_run.side_effect = RunningCheckRunsException(
+            ["run-1"], "There are other RUNNING checks"
+        )
+        (result,) = BatchManager(make_config_managers(1)).run()
+
+    assert result.status == "FAILED"
+    assert "run-1" in result.error
+    run_manager_cls.return_value.fail_run.assert_not_called()
+
+
+def test_run_bounds_the_concurrent_checks():
+    running, max_running = 0, 0
+    lock = threading.Lock()
+
+    def fake_data_diff(check_manager):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+
+    with patch("diffa.managers.batch_manager.RunManager"), patch(
+        "diffa.managers.check_manager.CheckManager.data_diff", fake_data_diff
+    ):
+        results = BatchManager(make_config_managers(8), max_concurrency=3).run()
+
+    assert all(result.status == "VALID" for result in results)
+    assert max_running == 3
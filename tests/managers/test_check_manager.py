@@ -1,9 +1,11 @@
-from datetime import datetime
+from datetime import date, datetime
+from unittest.mock import patch
 
 import pytest
 
-from diffa.managers.check_manager import CheckManager
+from diffa.managers.check_manager import CheckManager, CheckSummary
 from diffa.db.data_models import CountCheck, MergedCountCheck
+from diffa.utils import CheckRunTakenOverException, DiffaException
 from common import get_test_config_manager
 
 
@@ -105,7 +107,7 @@ def check_manager():
 def test__merge_count_check(
     check_manager, source_counts, target_counts, expected_merged_counts
 ):
-    merged_counts = check_manager._merge_count_checks(source_counts, target_counts)
+    merged_counts = list(check_manager._merge_count_checks(source_counts, target_counts))
     assert expected_merged_counts == merged_counts
 
 @pytest.mark.parametrize(
@@ -189,13 +191,13 @@ def test__merge_count_check(
                     cnt=200,
                     check_date=datetime.strptime("2024-01-01", "%Y-%m-%d").date(),
                     status="True",
-                    country="US"
+                    country="Singapore"
                 ),
                 CountCheck.create_with_dimensions(["status", "country"])(
                     cnt=200,
                     check_date=datetime.strptime("2024-01-01", "%Y-%m-%d").date(),
                     status="True",
-                    country="Singapore"
+                    country="US"
                 )
             ],
             [
@@ -236,10 +238,69 @@ def test__merge_count_check(
     ],
 )
 def test__merge_count_check_with_dimensions(check_manager, source_counts, target_counts, expected_merged_counts):
-    merged_counts = check_manager._merge_count_checks(source_counts, target_counts)
+    merged_counts = list(check_manager._merge_count_checks(source_counts, target_counts))
     assert expected_merged_counts == merged_counts
 
 
+def test__merge_count_check_rejects_unordered_counts(check_manager):
+    count_check = CountCheck.create_with_dimensions(["country"])
+    source_counts = [
+        count_check(cnt=100, check_date=datetime(2024, 1, 1).date(), country="US"),
+        count_check(cnt=100, check_date=datetime(2024, 1, 1).date(), country="Singapore"),
+    ]
+
+    with pytest.raises(ValueError, match="source counts are not ordered"):
+        list(check_manager._merge_count_checks(source_counts, []))
+
+
+def test__merge_count_check_orders_null_dimensions_last(check_manager):
+    count_check = CountCheck.create_with_dimensions(["country"])
+    source_counts = [
+        count_check(cnt=100, check_date=datetime(2024, 1, 1).date(), country="US"),
+        count_check(cnt=100, check_date=datetime(2024, 1, 1).date(), country=None),
+    ]
+    target_counts = [
+        count_check(cnt=100, check_date=datetime(2024, 1, 1).date(), country=None),
+    ]
+
+    merged_counts = list(check_manager._merge_count_checks(source_counts, target_counts))
+
+    assert [(mcc.country, mcc.target_count) for mcc in merged_counts] == [
+        ("US", 0),
+        (None, 100),
+    ]
+
+
+def test__merge_days(check_manager):
+    merged_count_check = MergedCountCheck.create_with_dimensions([("status", str)])
+    merged_count_checks = [
+        merged_count_check(
+            source_count=100, target_count=100, check_date=datetime(2024, 1, 1).date(), status="a"
+        ),
+        merged_count_check(
+            source_count=100, target_count=90, check_date=datetime(2024, 1, 1).date(), status="b"
+        ),
+        merged_count_check(
+            source_count=10, target_count=10, check_date=datetime(2024, 1, 2).date(), status="a"
+        ),
+    ]
+
+    days = list(check_manager._merge_days(iter(merged_count_checks)))
+
+    assert [day_check for day_check, _ in days] == [
+        MergedCountCheck(
+            source_count=200, target_count=190, is_valid=False, check_date=datetime(2024, 1, 1).date()
+        ),
+        MergedCountCheck(
+            source_count=10, target_count=10, is_valid=True, check_date=datetime(2024, 1, 2).date()
+        ),
+    ]
+    assert [day_checks for _, day_checks in days] == [
+        merged_count_checks[:2],
+        merged_count_checks[2:],
+    ]
+
+
 @pytest.mark.parametrize(
     "merged_count_checks, expected_merged_by_date",
     [
@@ -400,3 +461,89 @@ def test__merge_by_check_date(check_manager, merged_count_checks, expected_merge
 def test__check_if_valid_diff(check_manager, merged_by_date, expected_is_valid_diff):
     is_valid_diff = check_manager._check_if_valid_diff(merged_by_date)
     assert is_valid_diff == expected_is_valid_diff
+
+
+def get_failed_day_checks():
+    merged_count_check = MergedCountCheck.create_with_dimensions([("status", str)])
+    check_date = datetime.strptime("2024-01-01", "%Y-%m-%d").date()
+    day_checks = [
+        merged_count_check(source_count=10, target_count=10, check_date=check_date, status="a"),
+        merged_count_check(source_count=10, target_count=9, check_date=check_date, status="b"),
+        merged_count_check(source_count=10, target_count=5, check_date=check_date, status="c"),
+        merged_count_check(source_count=10, target_count=12, check_date=check_date, status="d"),
+    ]
+    return check_date, day_checks, CheckManager._merge_by_check_date(day_checks)
+
+
+def test_check_summary_details_top_k_worst_groups():
+    check_date, day_checks, merged_by_date = get_failed_day_checks()
+
+    summary = CheckSummary(
+        merged_by_date, CheckManager._group_checks_by_date(day_checks), top_k=2
+    )
+
+    assert summary.get_worst_checks(check_date) == [day_checks[2], day_checks[1]]
+    assert "... 2 more groups" in str(summary)
+    assert "status='a'" not in str(summary)
+
+
+def test_build_check_summary_writes_full_breakdown(check_manager, tmp_path):
+    _, day_checks, merged_by_date = get_failed_day_checks()
+    summary_file = tmp_path / "breakdown.csv"
+    check_manager.cm.diffa_check.update(summary_file=str(summary_file))
+
+    check_manager._build_check_summary(day_checks, merged_by_date)
+
+    assert summary_file.read_text().splitlines() == [
+        "check_date,status,source_count,target_count,diff_count,is_valid",
+        "2024-01-01,a,10,10,0,True",
+        "2024-01-01,b,10,9,-1,False",
+        "2024-01-01,c,10,5,-5,False",
+        "2024-01-01,d,10,12,2,True",
+    ]
+
+
+def test_columnar_engine_without_numpy_fails_before_counting(check_manager):
+    check_manager.cm.diffa_check.update(merge_engine="columnar")
+
+    with patch("diffa.managers.columnar_merge.np", None), patch.object(
+        check_manager.diffa_check_service,
+        "get_check_state",
+        return_value=(date(2024, 1, 1), None),
+    ), patch.object(
+        check_manager.source_target_service, "get_count_rows"
+    ) as get_count_rows:
+        with pytest.raises(DiffaException, match="numpy"):
+            check_manager.compare_tables()
+
+    get_count_rows.assert_not_called()
+
+
+def test_taken_over_run_stops_saving_checks(check_manager):
+    days = [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3)]
+    saved = []
+
+    def save_diffa_checks(diffa_checks):
+        for diffa_check in diffa_checks:
+            saved.append(diffa_check)
+            # Another run of the pair takes the run over after the first day
+            check_manager.taken_over.set()
+
+    with patch.object(
+        check_manager.diffa_check_service, "get_check_state", return_value=(None, [])
+    ), patch.object(
+        check_manager.source_target_service,
+        "get_counts",
+        return_value=(
+            iter([CountCheck(cnt=1, check_date=day) for day in days]),
+            iter([CountCheck(cnt=1, check_date=day) for day in days]),
+        ),
+    ), patch.object(
+        check_manager.diffa_check_service,
+        "save_diffa_checks",
+        side_effect=save_diffa_checks,
+    ):
+        with pytest.raises(CheckRunTakenOverException):
+            check_manager.compare_tables()
+
+    assert len(saved) == 1
@@ -0,0 +1,146 @@
+import random
+from datetime import date, datetime, timedelta
+from itertools import starmap
+
+import pytest
+
+from diffa.db.data_models import CountCheck, Granularity
+from diffa.managers.check_manager import CheckManager
+from common import get_test_config_manager
+
+np = pytest.importorskip("numpy")
+
+from diffa.managers.columnar_merge import ColumnarMerge  # noqa: E402
+
+
+@pytest.fixture
+def check_manager():
+    return CheckManager(config_manager=get_test_config_manager())
+
+
+def make_count_rows(
+    rng: random.Random,
+    dimension_cols: list,
+    n_days: int = 30,
+    with_checksum=False,
+    first_bucket: date = date(2024, 1, 1),
+    bucket_size: timedelta = timedelta(days=1),
+):
+    """Random count rows in the count query order (check_date, dimensions)"""
+
+    rows = []
+    for day in range(n_days):
+        check_date = first_bucket + day * bucket_size
+        groups = {
+            tuple(rng.choice(["a", "B", "c", None]) for _ in dimension_cols)
+            for _ in range(rng.randint(0, 8))
+        }
+        for group in groups:
+            if with_checksum:
+                # Few distinct counts and checksums, so that both sides often match
+                checksum = rng.choice([-(2**63), 2**63 - 1, 7])
+                rows.append((rng.randint(0, 3), check_date, *group, checksum))
+            else:
+                rows.append((rng.randint(0, 100), check_date, *group))
+    return sorted(
+        rows,
+        key=lambda row: (row[1], tuple((value is None, value or "") for value in row[2:])),
+    )
+
+
+def row_based_merge(
+    check_manager, dimension_cols, source_rows, target_rows, with_checksum=False
+):
+    row_type = CountCheck.create_with_dimensions(dimension_cols, with_checksum)
+    merged_by_date, invalid_merged_count_checks = {}, []
+    for day_check, day_checks in check_manager._merge_days(
+        check_manager._merge_count_checks(
+            starmap(row_type, source_rows), starmap(row_type, target_rows)
+        )
+    ):
+        merged_by_date[day_check.check_date] = day_check
+        if not day_check.is_valid:
+            invalid_merged_count_checks.extend(day_checks)
+    return merged_by_date, invalid_merged_count_checks
+
+
+@pytest.mark.parametrize("dimension_cols", [[], ["status"], ["status", "country"]])
+@pytest.mark.parametrize("seed", range(5))
+def test_columnar_merge_is_equivalent_to_row_based_merge(
+    check_manager, dimension_cols, seed
+):
+    rng = random.Random(seed)
+    source_rows = make_count_rows(rng, dimension_cols)
+    target_rows = make_count_rows(rng, dimension_cols)
+
+    expected_by_date, expected_invalid = row_based_merge(
+        check_manager, dimension_cols, source_rows, target_rows
+    )
+    merged_by_date, invalid = ColumnarMerge(dimension_cols).merge(
+        iter(source_rows), iter(target_rows)
+    )
+
+    assert list(map(check_manager._to_diffa_check, merged_by_date.values())) == list(
+        map(check_manager._to_diffa_check, expected_by_date.values())
+    )
+    assert invalid == expected_invalid
+
+
+@pytest.mark.parametrize("dimension_cols", [[], ["status", "country"]])
+@pytest.mark.parametrize("seed", range(5))
+def test_columnar_merge_compares_checksums_like_row_based_merge(
+    check_manager, dimension_cols, seed
+):
+    rng = random.Random(seed)
+    source_rows = make_count_rows(rng, dimension_cols, with_checksum=True)
+    target_rows = make_count_rows(rng, dimension_cols, with_checksum=True)
+
+    expected_by_date, expected_invalid = row_based_merge(
+        check_manager, dimension_cols, source_rows, target_rows, with_checksum=True
+    )
+    merged_by_date, invalid = ColumnarMerge(dimension_cols, with_checksum=True).merge(
+        iter(source_rows), iter(target_rows)
+    )
+
+    assert any(mcc.has_checksum_diff() for mcc in expected_invalid)
+    assert list(map(check_manager._to_diffa_check, merged_by_date.values())) == list(
+        map(check_manager._to_diffa_check, expected_by_date.values())
+    )
+    assert invalid == expected_invalid
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_columnar_merge_of_hourly_buckets(check_manager, seed):
+    rng = random.Random(seed)
+    source_rows, target_rows = (
+        make_count_rows(
+            rng,
+            ["status"],
+            n_days=50,
+            first_bucket=datetime(2024, 1, 1, 20),
+            bucket_size=timedelta(hours=1),
+        )
+        for _ in range(2)
+    )
+
+    expected_by_date, expected_invalid = row_based_merge(
+        check_manager, ["status"], source_rows, target_rows
+    )
+    merged_by_date, invalid = ColumnarMerge(
+        ["status"], granularity=Granularity("hour")
+    ).merge(iter(source_rows), iter(target_rows))
+
+    assert merged_by_date == expected_by_date
+    assert list(merged_by_date)[-1] == datetime(2024, 1, 3, 21)
+    assert invalid == expected_invalid
+
+
+def test_columnar_merge_without_rows():
+    assert ColumnarMerge(["status"]).merge(iter([]), iter([])) == ({}, [])
+
+
+def test_columnar_merge_rejects_duplicated_groups():
+    rows = [(1, date(2024, 1, 1), "a"), (2, date(2024, 1, 1), "a")]
+
+    with pytest.raises(ValueError, match="duplicated"):
+        ColumnarMerge(["status"]).merge(iter(rows), iter([]))
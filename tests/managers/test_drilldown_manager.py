@@ -0,0 +1,130 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from diffa.db.data_models import KeyRangeDiff, KeySegment
+from diffa.managers.drilldown_manager import (
+    DrillDownManager,
+    get_key_after,
+    split_key_segment,
+)
+from diffa.utils import DiffaException
+from common import get_test_config_manager
+
+DAY = date(2024, 1, 1)
+
+
+class InMemorySide:
+    """Drill-down queries of a side over in-memory rows of (check_date, key, row hash)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetched_keys = 0
+
+    def _segment_rows(self, segments):
+        for i, segment in enumerate(segments):
+            for check_date, key, row_hash in self.rows:
+                if check_date == segment.check_date and (
+                    segment.key_start <= key < segment.key_end
+                ):
+                    yield i, key, row_hash
+
+    def get_key_bounds(self, key_col, check_dates):
+        for check_date in check_dates:
+            keys = [key for day, key, _ in self.rows if day == check_date]
+            if keys:
+                yield check_date, min(keys), max(keys)
+
+    def count_key_segments(self, key_col, segments):
+        stats = {}
+        for i, _, row_hash in self._segment_rows(segments):
+            count, checksum = stats.get(i, (0, 0))
+            stats[i] = (count + 1, checksum + row_hash)
+        return [(i, *segment_stats) for i, segment_stats in stats.items()]
+
+    def get_segment_keys(self, key_col, segments):
+        keys = sorted(self._segment_rows(segments))
+        self.fetched_keys += len(keys)
+        return keys
+
+
+def drill_down(source_rows, target_rows, threshold=4, check_dates=(DAY,)):
+    config_manager = get_test_config_manager()
+    config_manager.source.update(drill_down_key="id")
+    config_manager.diffa_check.update(drill_down_threshold=threshold)
+    source, target = InMemorySide(source_rows), InMemorySide(target_rows)
+    drill_down_manager = DrillDownManager(config_manager, source, target)
+    return drill_down_manager.drill_down(list(check_dates)), source
+
+
+def make_rows(keys, check_date=DAY):
+    return [(check_date, key, key * 7) for key in keys]
+
+
+def test_drill_down_finds_the_exact_missing_extra_and_changed_key_ranges():
+    source_rows = make_rows(range(1000))
+    target_rows = [
+        row
+        for row in make_rows(range(1000))
+        if not 100 <= row[1] <= 104 and row[1] != 700
+    ] + make_rows([1000, 1001])
+    target_rows = [
+        (check_date, key, row_hash + 1 if key == 500 else row_hash)
+        for check_date, key, row_hash in target_rows
+    ]
+
+    key_range_diffs, source = drill_down(source_rows, target_rows)
+
+    assert key_range_diffs == [
+        KeyRangeDiff(DAY, "missing", 100, 104, 5),
+        KeyRangeDiff(DAY, "changed", 500, 500, 1),
+        KeyRangeDiff(DAY, "missing", 700, 700, 1),
+        KeyRangeDiff(DAY, "extra", 1000, 1001, 2),
+    ]
+    # Only the keys of a few differing segments (of at most 4 rows) are fetched
+    assert source.fetched_keys <= 2 * len(key_range_diffs) * 4
+
+
+def test_drill_down_coalesces_a_range_across_adjacent_segments():
+    key_range_diffs, _ = drill_down(
+        make_rows(range(64)), make_rows(range(20)) + make_rows(range(40, 64)), threshold=2
+    )
+
+    assert key_range_diffs == [KeyRangeDiff(DAY, "missing", 20, 39, 20)]
+
+
+def test_drill_down_splits_the_days_and_skips_days_without_keys():
+    other_day = DAY + timedelta(days=1)
+    source_rows = make_rows(range(10)) + make_rows(range(10), other_day)
+    target_rows = make_rows(range(10)) + make_rows(range(9), other_day)
+
+    key_range_diffs, _ = drill_down(
+        source_rows, target_rows, check_dates=(DAY, other_day, DAY + timedelta(days=2))
+    )
+
+    assert key_range_diffs == [KeyRangeDiff(other_day, "missing", 9, 9, 1)]
+
+
+@pytest.mark.parametrize(
+    "segment, expected_halves",
+    [
+        (KeySegment(DAY, 0, 10), (KeySegment(DAY, 0, 5), KeySegment(DAY, 5, 10))),
+        (KeySegment(DAY, 4, 5), None),
+        (
+            KeySegment(DAY, datetime(2024, 1, 1), datetime(2024, 1, 2)),
+            (
+                KeySegment(DAY, datetime(2024, 1, 1), datetime(2024, 1, 1, 12)),
+                KeySegment(DAY, datetime(2024, 1, 1, 12), datetime(2024, 1, 2)),
+            ),
+        ),
+        (KeySegment(DAY, Decimal("1"), get_key_after(Decimal("1"))), None),
+    ],
+)
+def test_split_key_segment(segment, expected_halves):
+    assert split_key_segment(segment) == expected_halves
+
+
+def test_get_key_after_rejects_keys_that_cannot_be_bisected():
+    with pytest.raises(DiffaException):
+        get_key_after("a")
@@ -0,0 +1,104 @@
+from datetime import date
+from unittest.mock import MagicMock
+
+from diffa.db.data_models import DiffaCheckRunSchema, MergedCountCheck
+from diffa.metrics import CheckMetrics, MetricsExporter, export_check_metrics, format_metrics
+from diffa.timings import PhaseTiming
+from common import get_test_config_manager
+
+
+def make_check_metrics(source_table: str, status: str = "VALID") -> CheckMetrics:
+    return CheckMetrics(
+        pair_labels=(("source_table", source_table), ("target_table", "events")),
+        status=status,
+        duration_seconds=1.5,
+        finished_at=1700000000.0,
+        timings=[
+            PhaseTiming("source_query", 0.5, rows=10, bytes=100, execute_seconds=0.2, fetch_seconds=0.1),
+            PhaseTiming("merge", 0.25),
+        ],
+        checked_days=3,
+        invalid_days=1,
+        counted_rows={"source": 30, "target": 29},
+    )
+
+
+def test_format_metrics():
+    metrics = format_metrics([make_check_metrics('public."events"\n')])
+    lines = metrics.splitlines()
+
+    labels = 'source_table="public.\\"events\\"\\n",target_table="events"'
+    assert f'diffa_check_status{{{labels},status="VALID"}} 1' in lines
+    assert f'diffa_check_status{{{labels},status="FAILED"}} 0' in lines
+    assert f"diffa_check_run_duration_seconds{{{labels}}} 1.5" in lines
+    assert f'diffa_check_phase_seconds{{{labels},phase="merge"}} 0.25' in lines
+    assert f'diffa_check_query_seconds{{{labels},side="source"}} {0.2 + 0.1}' in lines
+    assert f'diffa_check_fetched_rows{{{labels},side="source"}} 10' in lines
+    assert f'diffa_check_counted_rows{{{labels},side="target"}} 29' in lines
+    assert f"diffa_check_invalid_days{{{labels}}} 1" in lines
+    assert "# TYPE diffa_check_invalid_days gauge" in lines
+    assert lines[-1] == "# EOF"
+
+
+def test_metrics_exporter_keeps_the_last_run_of_each_pair(tmp_path):
+    metrics_file = tmp_path / "diffa.prom"
+    exporter = MetricsExporter.for_file(str(metrics_file))
+
+    assert MetricsExporter.for_file(str(metrics_file)) is exporter
+
+    exporter.export(make_check_metrics("table_0", "FAILED"))
+    exporter.export(make_check_metrics("table_1"))
+    exporter.export(make_check_metrics("table_0", "INVALID"))
+
+    status_lines = [
+        line
+        for line in metrics_file.read_text().splitlines()
+        if line.startswith("diffa_check_status") and line.endswith(" 1")
+    ]
+    assert status_lines == [
+        'diffa_check_status{source_table="table_0",target_table="events",status="INVALID"} 1',
+        'diffa_check_status{source_table="table_1",target_table="events",status="VALID"} 1',
+    ]
+    assert [path.name for path in tmp_path.iterdir()] == ["diffa.prom"]
+
+
+def test_export_check_metrics_from_the_run_and_check(tmp_path):
+    config_manager = get_test_config_manager()
+    config_manager.diffa_check.update(metrics_file=str(tmp_path / "diffa.prom"))
+    run_manager = MagicMock(
+        current_run=DiffaCheckRunSchema(
+            source_database="db",
+            source_schema="public",
+            source_table="events",
+            target_database="db",
+            target_schema="public",
+            target_table="events",
+            status="COMPLETED",
+        )
+    )
+    run_manager.get_run_duration.return_value = 2.0
+    check_manager = MagicMock(
+        cm=config_manager,
+        merged_by_date={
+            date(2024, 1, 1): MergedCountCheck(5, 5, date(2024, 1, 1)),
+            date(2024, 1, 2): MergedCountCheck(5, 4, date(2024, 1, 2)),
+        },
+    )
+    check_manager.get_timings.return_value = []
+
+    export_check_metrics(run_manager, check_manager, "INVALID")
+
+    metrics = (tmp_path / "diffa.prom").read_text()
+    assert 'source_schema="public",source_table="events"' in metrics
+    assert 'side="source"} 10\n' in metrics and 'side="target"} 9\n' in metrics
+    assert 'target_table="events"} 2\n' in metrics  # Checked days
+    assert 'status="INVALID"} 1\n' in metrics
+
+
+def test_export_check_metrics_never_fails_the_check(tmp_path):
+    config_manager = get_test_config_manager()
+    config_manager.diffa_check.update(metrics_file=str(tmp_path / "missing" / "diffa.prom"))
+
+    export_check_metrics(MagicMock(), MagicMock(cm=config_manager), "VALID")
+
+    assert not (tmp_path / "missing").exists()
@@ -0,0 +1,101 @@
+import time
+import tracemalloc
+
+from diffa.managers.check_manager import CheckManager
+from diffa.profiling import CheckProfiler
+from diffa.timings import PhaseTimer, QueryStats, TimingsReport, estimate_rows_size
+from common import get_test_config_manager
+
+
+def slow_items(n_items: int, delay: float):
+    for i in range(n_items):
+        time.sleep(delay)
+        yield i
+
+
+def test_phases_are_timed_exclusively():
+    phase_timer = PhaseTimer()
+    query_stats = QueryStats()
+    query_stats.add_query(execute_seconds=0.5)
+    query_stats.add_rows([(1, "a"), (2, "b")], fetch_seconds=0.25)
+    phase_timer.set_query_stats("source_query", query_stats)
+
+    with phase_timer.phase("state_lookup"):
+        time.sleep(0.02)
+    with phase_timer.phase("upsert"):
+        for _ in phase_timer.timed_iter(
+            "merge", phase_timer.timed_iter("source_query", slow_items(3, 0.02))
+        ):
+            time.sleep(0.01)
+
+    timings = {timing.phase: timing for timing in phase_timer.get_timings()}
+
+    assert list(timings) == ["state_lookup", "source_query", "merge", "upsert"]
+    assert 0.02 <= timings["state_lookup"].elapsed_seconds < 0.04
+    # The waits for the rows only count for the query, the rest of the loop for the upsert
+    assert 0.06 <= timings["source_query"].elapsed_seconds < 0.09
+    assert timings["merge"].elapsed_seconds < 0.01
+    assert 0.03 <= timings["upsert"].elapsed_seconds < 0.05
+    assert (timings["source_query"].rows, timings["source_query"].bytes) == (2, 4)
+    assert timings["source_query"].execute_seconds == 0.5
+    assert timings["source_query"].fetch_seconds == 0.25
+    assert timings["merge"].rows is None
+
+    report = str(TimingsReport(phase_timer.get_timings()))
+    assert "source_query" in report and "total" in report
+
+
+def test_timed_iter_closes_the_iterable_when_stopped_early():
+    closed = []
+
+    def items():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    timed_items = PhaseTimer().timed_iter("merge", items())
+    next(timed_items)
+    timed_items.close()
+
+    assert closed == [True]
+
+
+def test_estimate_rows_size_samples_large_batches():
+    rows = [(i % 10, "x" * 9) for i in range(10000)]
+
+    assert estimate_rows_size(rows) == 10 * len(rows)
+
+
+def make_strings(n_strings: int):
+    return [str(i) for i in range(n_strings)]
+
+
+def test_check_profiler_writes_the_reports(tmp_path):
+    profiler = CheckProfiler(str(tmp_path / "profiles"), "public.events")
+
+    with profiler.profile():
+        with profiler.phase_timer.phase("merge"):
+            big = make_strings(100000)
+            with profiler.phase_timer.phase("source_query"):
+                small = make_strings(1000)
+        del big, small
+
+    suffixes = sorted(path.name.split(".", 2)[-1] for path in (tmp_path / "profiles").iterdir())
+    assert suffixes == ["hotspots.txt", "memory.txt", "pstats"]
+    assert set(profiler.phase_timer.peaks) == {"merge", "source_query"}
+    assert profiler.phase_timer.peaks["merge"] > 2**20
+    hotspots = next((tmp_path / "profiles").glob("*.hotspots.txt")).read_text()
+    assert "make_strings" in hotspots
+    assert not tracemalloc.is_tracing()
+
+
+def test_check_manager_profiles_only_with_a_profile_dir(tmp_path):
+    config_manager = get_test_config_manager()
+
+    assert CheckManager(config_manager).profiler is None
+    assert type(CheckManager(config_manager).phase_timer) is PhaseTimer
+
+    config_manager.diffa_check.update(profile_dir=str(tmp_path))
+    check_manager = CheckManager(config_manager)
+    assert check_manager.phase_timer is check_manager.profiler.phase_timer
@@ -0,0 +1,126 @@
+import csv
+import itertools
+import threading
+from datetime import date
+
+import pytest
+
+from diffa.db.data_models import MergedCountCheck
+from diffa.managers.pk_diff_manager import PkDiffManager, merge_sorted_keys
+from common import get_test_config_manager
+
+DAY = date(2024, 1, 1)
+NEXT_DAY = date(2024, 1, 2)
+
+
+@pytest.mark.parametrize(
+    "source_keys, target_keys, expected_diffs",
+    [
+        # Case 1: Same keys on both sides
+        ([(DAY, "1"), (DAY, "2")], [(DAY, "1"), (DAY, "2")], []),
+        # Case 2: Missing and extra keys, compared bytewise ("10" < "9")
+        (
+            [(DAY, "10"), (DAY, "2"), (DAY, "9")],
+            [(DAY, "2"), (DAY, "3"), (DAY, "9")],
+            [(DAY, "missing", "10"), (DAY, "extra", "3")],
+        ),
+        # Case 3: The same key on other days
+        (
+            [(DAY, "1"), (NEXT_DAY, "1")],
+            [(NEXT_DAY, "1"), (NEXT_DAY, "2")],
+            [(DAY, "missing", "1"), (NEXT_DAY, "extra", "2")],
+        ),
+        # Case 4: A duplicated key
+        ([(DAY, "1"), (DAY, "1")], [(DAY, "1")], [(DAY, "missing", "1")]),
+        # Case 5: One side is empty
+        ([], [(DAY, "1")], [(DAY, "extra", "1")]),
+    ],
+)
+def test_merge_sorted_keys(source_keys, target_keys, expected_diffs):
+    assert list(merge_sorted_keys(iter(source_keys), iter(target_keys))) == expected_diffs
+
+
+def test_merge_sorted_keys_rejects_unordered_keys():
+    with pytest.raises(ValueError, match="target keys are not ordered"):
+        list(merge_sorted_keys([(DAY, "1")], [(DAY, "2"), (DAY, "1")]))
+
+
+class InMemorySide:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def stream_keys(self, pk_col, check_dates):
+        return iter(sorted(row for row in self.keys if row[0] in check_dates))
+
+
+@pytest.fixture
+def pk_diff_manager(tmp_path):
+    config_manager = get_test_config_manager()
+    config_manager.source.update(pk_col="id")
+    config_manager.diffa_check.update(
+        pk_diff_file=str(tmp_path / "pk_diff.csv"), pk_diff_max_rows=100
+    )
+    return PkDiffManager(
+        config_manager,
+        InMemorySide([(DAY, str(i)) for i in range(10)]),
+        InMemorySide([(DAY, str(i)) for i in range(10) if i != 4] + [(DAY, "42")]),
+    )
+
+
+def test_pk_diff_writes_the_differing_keys(pk_diff_manager):
+    keys_by_kind = pk_diff_manager.diff([DAY])
+
+    assert keys_by_kind == {"missing": 1, "extra": 1}
+    with open(pk_diff_manager.get_pk_diff_file(), encoding="utf-8") as f:
+        assert list(csv.reader(f)) == [
+            ["check_date", "kind", "id"],
+            ["2024-01-01", "missing", "4"],
+            ["2024-01-01", "extra", "42"],
+        ]
+
+
+class EndlessSide:
+    """Key query that never ends by itself: its stream runs until it is stopped"""
+
+    def stream_keys(self, pk_col, check_dates):
+        return ((DAY, f"{i:09d}") for i in itertools.count())
+
+
+def running_key_streams():
+    return [t for t in threading.enumerate() if t.name.endswith("-keys")]
+
+
+def test_pk_diff_starts_no_key_query_without_a_writable_file(pk_diff_manager, tmp_path):
+    pk_diff_manager.source_db = pk_diff_manager.target_db = EndlessSide()
+    pk_diff_manager.cm.diffa_check.update(pk_diff_file=str(tmp_path / "missing" / "pk.csv"))
+
+    with pytest.raises(FileNotFoundError):
+        pk_diff_manager.diff([DAY])
+
+    assert running_key_streams() == []
+
+
+def test_pk_diff_stops_the_key_queries_on_errors(pk_diff_manager):
+    # Unordered keys make the merge fail midway
+    pk_diff_manager.source_db = EndlessSide()
+    pk_diff_manager.target_db.stream_keys = lambda pk_col, check_dates: iter(
+        [(DAY, "0"), (DAY, "")]
+    )
+
+    with pytest.raises(ValueError):
+        pk_diff_manager.diff([DAY])
+
+    assert running_key_streams() == []
+
+
+def test_pk_diff_only_lists_invalid_days_small_enough(pk_diff_manager):
+    merged_by_date = {
+        day_check.check_date: day_check
+        for day_check in [
+            MergedCountCheck(source_count=10, target_count=9, check_date=DAY),
+            MergedCountCheck(source_count=10, target_count=10, check_date=NEXT_DAY),
+            MergedCountCheck(source_count=60, target_count=50, check_date=date(2024, 1, 3)),
+        ]
+    }
+
+    assert pk_diff_manager.get_enumerable_dates(merged_by_date) == [DAY]
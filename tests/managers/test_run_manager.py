@@ -1,3 +1,4 @@
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -28,8 +29,6 @@ def run_manager(config_manager, mock_diffa_check_run_service):
 
 def test_start_run_no_running_checks(run_manager):
 
-    run_manager.diffa_check_run_service.getting_running_check_runs.return_value = []
-
     run_manager.start_run()
 
     run_manager.diffa_check_run_service.create_new_check_run.assert_called_once_with(
@@ -39,14 +38,46 @@ def test_start_run_no_running_checks(run_manager):
 
 def test_start_run_with_running_checks(run_manager):
 
-    run_manager.diffa_check_run_service.getting_running_check_runs.return_value = [
-        "mock_running_1",
-        "mock_running_2",
-    ]
+    run_manager.diffa_check_run_service.create_new_check_run.side_effect = (
+        RunningCheckRunsException(
+            ["mock_running_1", "mock_running_2"], "There are other RUNNING checks"
+        )
+    )
 
     with pytest.raises(RunningCheckRunsException):
         run_manager.start_run()
 
+    assert run_manager._heartbeat is None
+
+
+def test_start_run_sends_heartbeats_until_completed(run_manager):
+
+    run_manager.cm.diffa_check_run.update(run_heartbeat_interval=0.01)
+
+    run_manager.start_run()
+    time.sleep(0.1)
+    run_manager.complete_run()
+    n_heartbeats = run_manager.diffa_check_run_service.heartbeat_check_run.call_count
+    time.sleep(0.05)
+
+    assert n_heartbeats >= 2
+    assert run_manager.diffa_check_run_service.heartbeat_check_run.call_count == n_heartbeats
+    run_manager.diffa_check_run_service.heartbeat_check_run.assert_called_with(
+        run_manager.current_run
+    )
+
+
+def test_start_run_flags_taken_over_runs(run_manager):
+
+    run_manager.cm.diffa_check_run.update(run_heartbeat_interval=0.01)
+    run_manager.diffa_check_run_service.heartbeat_check_run.return_value = False
+
+    run_manager.start_run()
+    taken_over = run_manager.taken_over.wait(timeout=1)
+    run_manager.fail_run()
+
+    assert taken_over
+
 
 def test_complete_run(run_manager):
 
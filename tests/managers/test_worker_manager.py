@@ -0,0 +1,109 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from diffa.db.data_models import DiffaCheckJobSchema
+from diffa.db.diffa_check_job import DiffaCheckJobService
+from diffa.managers.batch_manager import PairResult
+from diffa.managers.worker_manager import WorkerManager
+from diffa.utils import Heartbeat
+from common import TEST_POSTGRESQL_CONN_STRING, get_test_config_manager
+
+
+def make_job(source_table: str, **check_options) -> DiffaCheckJobSchema:
+    return DiffaCheckJobSchema(
+        check_options={
+            "source_db_uri": TEST_POSTGRESQL_CONN_STRING,
+            "source_table": source_table,
+            "target_db_uri": TEST_POSTGRESQL_CONN_STRING,
+            "target_table": source_table,
+        }
+        | check_options,
+        status="RUNNING",
+        attempts=1,
+        worker_id="worker:1",
+    )
+
+
+@pytest.fixture
+def worker_manager():
+    worker_manager = WorkerManager(
+        get_test_config_manager(), max_concurrency=2, exit_when_empty=True
+    )
+    worker_manager.diffa_check_job_service = MagicMock(spec=DiffaCheckJobService)
+    return worker_manager
+
+
+def test_run_processes_the_queue_until_empty(worker_manager):
+    jobs = [make_job(f"table_{i}") for i in range(5)]
+    lock = threading.Lock()
+
+    def claim_next_job(*args):
+        with lock:
+            return jobs.pop(0) if jobs else None
+
+    worker_manager.diffa_check_job_service.claim_next_job.side_effect = claim_next_job
+
+    def fake_run_pair(config_manager):
+        status = "INVALID" if config_manager.source.get_db_table() == "table_3" else "VALID"
+        return PairResult(pair=config_manager.source.get_db_table(), status=status, elapsed_seconds=0)
+
+    with patch.object(worker_manager.batch_manager, "run_pair", fake_run_pair):
+        results = worker_manager.run()
+
+    assert sorted(result.pair for result in results) == [f"table_{i}" for i in range(5)]
+    finished = {
+        call.args[0].check_options["source_table"]: call.args[1]
+        for call in worker_manager.diffa_check_job_service.finish_job.call_args_list
+    }
+    assert finished == {f"table_{i}": "INVALID" if i == 3 else "VALID" for i in range(5)}
+
+
+def test_run_job_uses_the_queue_diffa_db_and_sends_heartbeats(worker_manager):
+    worker_manager.heartbeat_interval = 0.01
+    job = make_job("events", source_schema="src")
+
+    def slow_run_pair(config_manager):
+        time.sleep(0.1)
+        return PairResult(pair="events", status="VALID", elapsed_seconds=0.1)
+
+    with patch.object(worker_manager.batch_manager, "run_pair", side_effect=slow_run_pair) as run_pair:
+        result = worker_manager.run_job(job)
+
+    config_manager = run_pair.call_args.args[0]
+    assert config_manager.source.get_db_schema() == "src"
+    assert config_manager.diffa_check.get_db_uri() == worker_manager.cm.diffa_check_job.get_db_uri()
+    assert result.status == "VALID"
+    assert worker_manager.diffa_check_job_service.heartbeat_job.call_count >= 2
+    worker_manager.diffa_check_job_service.finish_job.assert_called_once_with(job, "VALID", None)
+
+
+def test_run_job_fails_invalid_options(worker_manager):
+    job = make_job("events", unknown_option=1)
+
+    result = worker_manager.run_job(job)
+
+    assert result.status == "FAILED"
+    assert "unknown_option" in result.error
+    worker_manager.diffa_check_job_service.finish_job.assert_called_once_with(
+        job, "FAILED", result.error
+    )
+
+
+def test_heartbeat_beats_until_exit_and_survives_failures():
+    beats = []
+
+    def beat():
+        beats.append(time.monotonic())
+        if len(beats) == 1:
+            raise RuntimeError("connection lost")
+
+    with Heartbeat(beat, interval=0.01):
+        time.sleep(0.1)
+    n_beats = len(beats)
+    time.sleep(0.05)
+
+    assert n_beats >= 3
+    assert len(beats) == n_beats